@@ -0,0 +1,620 @@
+#!/usr/bin/env python3
+"""
+Servidores locales de prueba y banco de rendimiento para `sync_geodivisions.py`.
+
+Características:
+- Simula la API de Positiva (`consultaDivisionPolitica` / `ConsultaCiudades`) y el backend SGDEA
+  (`/geodivision`, `/geodivision/actualizar-lote-*` y unas rutas de lectura propias del simulador,
+  `STATE_PATHS`, para probar `--delta-sync` con `--backend-*-path`) con `http.server`, sin
+  dependencias adicionales.
+- Los datos pueden ser sintéticos (reproducibles con `--seed`) o reproducirse desde el SQLite de la
+  caché de respuestas (`--fixtures-cache`) grabado por una corrida real con `--cache-mode`.
+- Cada servidor puede inyectar latencia, una tasa de HTTP 5xx y una tasa de HTTP 429; el backend
+  puede además rechazar siempre ciertos registros (`--poison-rate`) o los cuerpos gzip
+  (`--reject-gzip`); acepta `Content-Encoding: gzip` y cuenta bytes recibidos comprimidos y en JSON.
+- `run` barre combinaciones de `--max-workers`, `--municipality-workers`, `--chunk-size` y
+  `--throttle-ms`, ejecuta `sync_geodivisions.py` como subproceso contra los servidores locales y
+  reporta registros por segundo y la latencia p95 por etapa (a partir de `--metrics-json`).
+- `serve` solo levanta los servidores para pruebas manuales.
+
+Ejemplo:
+    python bench_geodivisions.py run --max-workers 2,4,8 --chunk-size 100,250 --latency-ms 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+SYNC_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sync_geodivisions.py")
+DEPARTMENTS_PATH = "/pdp/v1/positiva/scp/parametrica/consultaDivisionPolitica"
+MUNICIPIOS_PATH = "/ciudades/v1/positiva/scp/parametrica/ConsultaCiudades"
+# Rutas de lectura del estado que solo existen en el simulador (el backend real define las suyas).
+STATE_PATHS = ("geodivision/{idPais}/departamentos", "geodivision/{idPais}/municipios")
+
+
+@dataclass
+class FaultProfile:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    throttle_rate: float = 0.0
+    poison_rate: float = 0.0
+    poison_status: int = 501
+    reject_gzip: bool = False
+
+    def is_poison(self, record: Dict[str, Any]) -> bool:
+        """Registro que el backend rechaza siempre con `poison_status` (determinístico por contenido)."""
+        if not self.poison_rate:
+            return False
+        digest = zlib.crc32(json.dumps(record, sort_keys=True).encode("utf-8"))
+        return digest % 10000 < self.poison_rate * 10000
+
+    def apply(self, rng: random.Random) -> Optional[int]:
+        """Aplica la latencia y devuelve el status de error a responder, o None si la petición procede."""
+        delay = self.latency_ms + (rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        roll = rng.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return self.error_status
+        return None
+
+
+@dataclass
+class FixtureSet:
+    """Países, departamentos y municipios que sirven los servidores simulados."""
+
+    countries: List[Dict[str, Any]]
+    departments: Dict[int, List[Dict[str, Any]]]
+    municipios: Dict[Tuple[int, int], List[Dict[str, Any]]]
+
+    @property
+    def total_records(self) -> int:
+        return sum(len(deps) for deps in self.departments.values()) + sum(
+            len(munis) for munis in self.municipios.values()
+        )
+
+    @classmethod
+    def synthetic(cls, countries: int, departments: int, municipios: int, seed: int) -> "FixtureSet":
+        rng = random.Random(seed)
+        country_rows: List[Dict[str, Any]] = []
+        department_map: Dict[int, List[Dict[str, Any]]] = {}
+        municipio_map: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+        for index in range(countries):
+            local_id = index + 1
+            external_id = 1000 + local_id
+            country_rows.append({"idPais": local_id, "idPositiva": external_id, "nombre": f"País {local_id}"})
+            # Tamaños sesgados para que haya países grandes y pequeños, como en la API real.
+            dep_count = max(1, int(departments * rng.uniform(0.2, 2.0)))
+            deps = []
+            for dep_index in range(dep_count):
+                division_id = external_id * 1000 + dep_index
+                deps.append(
+                    {
+                        "idDivisionPolitica": division_id,
+                        "nombreDepartamento": f"Departamento {local_id}-{dep_index}",
+                        "nombreEstado": f"Estado {local_id}-{dep_index}",
+                    }
+                )
+                muni_count = max(1, int(municipios * rng.uniform(0.2, 2.0)))
+                municipio_map[(external_id, division_id)] = [
+                    {
+                        "consecutivo": division_id * 1000 + muni_index,
+                        "nombreCiudad": f"Ciudad {division_id}-{muni_index}",
+                        "codigoDivipola": f"{division_id % 100000:05d}{muni_index:03d}",
+                    }
+                    for muni_index in range(muni_count)
+                ]
+            department_map[external_id] = deps
+        return cls(country_rows, department_map, municipio_map)
+
+    @classmethod
+    def from_cache(cls, path: str) -> "FixtureSet":
+        """Reproduce las respuestas grabadas en la caché SQLite de `sync_geodivisions.py --cache-mode`."""
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT endpoint, id_pais, id_division, body FROM responses").fetchall()
+        finally:
+            conn.close()
+        department_map: Dict[int, List[Dict[str, Any]]] = {}
+        municipio_map: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+        for endpoint, id_pais, id_division, body in rows:
+            data = json.loads(zlib.decompress(body).decode("utf-8"))
+            if endpoint == DEPARTMENTS_PATH:
+                department_map[id_pais] = data
+            elif endpoint == MUNICIPIOS_PATH:
+                municipio_map[(id_pais, id_division)] = data
+        external_ids = sorted(department_map)
+        countries = [
+            {"idPais": index + 1, "idPositiva": external_id, "nombre": f"País {external_id}"}
+            for index, external_id in enumerate(external_ids)
+        ]
+        return cls(countries, department_map, municipio_map)
+
+
+class FakeState:
+    """Estado compartido por los manejadores: fixtures, fallas, registros persistidos y contadores."""
+
+    def __init__(self, fixtures: FixtureSet, faults: FaultProfile, seed: int):
+        self.fixtures = fixtures
+        self.faults = faults
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.stored: Dict[Tuple[int, str], Dict[Tuple[Any, Any], Dict[str, Any]]] = {}
+        self.counters: Dict[str, int] = {}
+        self.local_to_external = {row["idPais"]: row["idPositiva"] for row in fixtures.countries}
+        self.inflight = 0
+        # Con valor, cualquier petición con otro Bearer recibe 401 (para probar la renovación de tokens).
+        self.bearer: Optional[str] = None
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def enter(self) -> None:
+        """Marca una petición en curso y guarda el máximo simultáneo en `max_concurrentes`."""
+        with self.lock:
+            self.inflight += 1
+            self.counters["max_concurrentes"] = max(self.counters.get("max_concurrentes", 0), self.inflight)
+
+    def leave(self) -> None:
+        with self.lock:
+            self.inflight -= 1
+
+    def next_fault(self) -> Optional[int]:
+        with self.lock:
+            seed = self.rng.random()
+        return self.faults.apply(random.Random(seed))
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stored.clear()
+            self.counters.clear()
+
+
+_UNSUPPORTED_ENCODING = object()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeServer"
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002 - firma de BaseHTTPRequestHandler
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if raw and self.headers.get("Content-Encoding") == "gzip":
+            self.server.state.count("bytes_gzip", len(raw))
+            if self.server.state.faults.reject_gzip:
+                return _UNSUPPORTED_ENCODING
+            raw = gzip.decompress(raw)
+        self.server.state.count("bytes_json", len(raw))
+        return json.loads(raw) if raw else None
+
+    def _unauthorized(self) -> bool:
+        bearer = self.server.state.bearer
+        if bearer is None or self.headers.get("Authorization") == f"Bearer {bearer}":
+            return False
+        self.server.state.count("rechazos_401")
+        self._send_json(401, {"error": "token inválido"})
+        return True
+
+    def _faulted(self) -> bool:
+        status = self.server.state.next_fault()
+        if status is None:
+            return False
+        self.server.state.count(f"injected_{status}")
+        headers = {"Retry-After": "0"} if status == 429 else None
+        self._send_json(status, {"error": "falla inyectada"}, headers)
+        return True
+
+    def do_GET(self) -> None:  # noqa: N802 - API de BaseHTTPRequestHandler
+        self.server.state.enter()
+        try:
+            self._get()
+        finally:
+            self.server.state.leave()
+
+    def do_POST(self) -> None:  # noqa: N802 - API de BaseHTTPRequestHandler
+        self.server.state.enter()
+        try:
+            self._post()
+        finally:
+            self.server.state.leave()
+
+    def _get(self) -> None:
+        state = self.server.state
+        state.count("requests")
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        path = parts.path.rstrip("/")
+        if self._unauthorized() or self._faulted():
+            return
+        if path == DEPARTMENTS_PATH:
+            self._send_json(200, state.fixtures.departments.get(int(query.get("idPais", 0)), []))
+            return
+        if path == MUNICIPIOS_PATH:
+            key = (int(query.get("idPais", 0)), int(query.get("idDivisionPolitica", 0)))
+            self._send_json(200, state.fixtures.municipios.get(key, []))
+            return
+        if path == "/geodivision":
+            self._send_json(200, state.fixtures.countries)
+            return
+        segments = path.strip("/").split("/")
+        if len(segments) == 3 and segments[0] == "geodivision" and segments[2] in ("departamentos", "municipios"):
+            external_id = state.local_to_external.get(int(segments[1]))
+            with state.lock:
+                records = list(state.stored.get((external_id, segments[2]), {}).values())
+            self._send_json(200, records)
+            return
+        self._send_json(404, {"error": f"Ruta no simulada: {path}"})
+
+    def _post(self) -> None:
+        state = self.server.state
+        state.count("requests")
+        payload = self._read_body()
+        if payload is _UNSUPPORTED_ENCODING:
+            self._send_json(415, {"error": "Content-Encoding no soportado"})
+            return
+        if self._unauthorized() or self._faulted():
+            return
+        path = urlsplit(self.path).path.rstrip("/")
+        if path.endswith("actualizar-lote-departamento"):
+            kind = "departamentos"
+        elif path.endswith("actualizar-lote-municipios"):
+            kind = "municipios"
+        else:
+            self._send_json(404, {"error": f"Ruta no simulada: {path}"})
+            return
+        records = payload or []
+        if any(state.faults.is_poison(record) for record in records):
+            state.count("poison_rechazados")
+            self._send_json(state.faults.poison_status, {"error": "registro envenenado"})
+            return
+        with state.lock:
+            for record in records:
+                bucket = state.stored.setdefault((record.get("idPais"), kind), {})
+                bucket[(record.get("idDepartamento"), record.get("idMunicipio"))] = record
+        state.count(f"{kind}_recibidos", len(records))
+        self._send_json(200, {"procesados": len(records)})
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # El backlog por defecto (5) provoca resets de conexión con muchos workers/lanes.
+    request_queue_size = 1024
+
+    def __init__(self, address: Tuple[str, int], state: FakeState):
+        super().__init__(address, FakeHandler)
+        self.state = state
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(state: FakeState, host: str = "127.0.0.1", port: int = 0) -> FakeServer:
+    server = FakeServer((host, port), state)
+    thread = threading.Thread(target=server.serve_forever, name=f"fake-{server.url}", daemon=True)
+    thread.start()
+    return server
+
+
+@dataclass
+class BenchResult:
+    config: Dict[str, Any]
+    seconds: float
+    records_sent: int
+    records_per_second: float
+    failures: int
+    returncode: int
+    p95_seconds: Dict[str, Optional[float]] = field(default_factory=dict)
+    server_counters: Dict[str, int] = field(default_factory=dict)
+
+
+def run_sync(
+    config: Dict[str, Any],
+    positiva: FakeServer,
+    backend: FakeServer,
+    extra_args: List[str],
+    workdir: str,
+) -> BenchResult:
+    metrics_path = os.path.join(workdir, "metrics.json")
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    command = [
+        sys.executable,
+        SYNC_SCRIPT,
+        "--backend-url",
+        backend.url,
+        "--backend-token",
+        "bench",
+        "--external-token",
+        "bench",
+        "--external-base-url",
+        positiva.url,
+        "--metrics-json",
+        metrics_path,
+        "--report-file",
+        os.path.join(workdir, "failures.csv"),
+    ]
+    for option, value in config.items():
+        command.extend([f"--{option.replace('_', '-')}", str(value)])
+    command.extend(extra_args)
+
+    positiva.state.reset()
+    backend.state.reset()
+    started = time.monotonic()
+    completed = subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+    elapsed = time.monotonic() - started
+    if completed.returncode != 0:
+        logging.warning("Corrida %s terminó con código %d:\n%s", config, completed.returncode, completed.stderr[-2000:])
+
+    summary: Dict[str, Any] = {}
+    if os.path.exists(metrics_path):
+        with open(metrics_path, encoding="utf-8") as handle:
+            summary = json.load(handle)
+    countries = summary.get("countries", [])
+    records = sum(row.get("records_sent", 0) for row in countries)
+    stages = summary.get("stages", {})
+    counters = dict(positiva.state.counters)
+    for name, value in backend.state.counters.items():
+        counters[f"backend_{name}"] = value
+    return BenchResult(
+        config=config,
+        seconds=round(elapsed, 3),
+        records_sent=records,
+        records_per_second=round(records / elapsed, 1) if elapsed > 0 else 0.0,
+        failures=sum(row.get("failures", 0) for row in countries),
+        returncode=completed.returncode,
+        p95_seconds={stage: stats.get("p95_seconds") for stage, stats in stages.items()},
+        server_counters=counters,
+    )
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def build_fixtures(args: argparse.Namespace) -> FixtureSet:
+    if args.fixtures_cache:
+        fixtures = FixtureSet.from_cache(args.fixtures_cache)
+        logging.info("Fixtures reproducidos desde %s.", args.fixtures_cache)
+    else:
+        fixtures = FixtureSet.synthetic(args.countries, args.departments, args.municipios, args.seed)
+    logging.info(
+        "Fixtures: %d países, %d registros en total.", len(fixtures.countries), fixtures.total_records
+    )
+    return fixtures
+
+
+def start_fakes(args: argparse.Namespace, fixtures: FixtureSet) -> Tuple[FakeServer, FakeServer]:
+    positiva = start_server(
+        FakeState(
+            fixtures,
+            FaultProfile(
+                latency_ms=args.latency_ms,
+                jitter_ms=args.jitter_ms,
+                error_rate=args.external_error_rate,
+                error_status=args.error_status,
+                throttle_rate=args.external_429_rate,
+            ),
+            args.seed,
+        ),
+        port=args.positiva_port,
+    )
+    backend = start_server(
+        FakeState(
+            fixtures,
+            FaultProfile(
+                latency_ms=args.backend_latency_ms,
+                jitter_ms=args.jitter_ms,
+                error_rate=args.backend_error_rate,
+                error_status=args.error_status,
+                throttle_rate=args.backend_429_rate,
+                poison_rate=args.poison_rate,
+                poison_status=args.poison_status,
+                reject_gzip=args.reject_gzip,
+            ),
+            args.seed + 1,
+        ),
+        port=args.backend_port,
+    )
+    logging.info("Positiva simulada en %s, backend simulado en %s.", positiva.url, backend.url)
+    return positiva, backend
+
+
+def write_results(results: List[BenchResult], destination: str) -> None:
+    directory = os.path.dirname(destination)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if destination.endswith(".json"):
+        with open(destination, "w", encoding="utf-8") as handle:
+            json.dump([asdict(result) for result in results], handle, ensure_ascii=False, indent=2)
+        return
+    stages = sorted({stage for result in results for stage in result.p95_seconds})
+    with open(destination, "w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle)
+        config_keys = list(results[0].config) if results else []
+        writer.writerow(config_keys + ["seconds", "records_sent", "records_per_second", "failures"]
+                        + [f"p95_{stage}" for stage in stages])
+        for result in results:
+            writer.writerow(
+                [result.config[key] for key in config_keys]
+                + [result.seconds, result.records_sent, result.records_per_second, result.failures]
+                + [result.p95_seconds.get(stage) for stage in stages]
+            )
+
+
+def print_results(results: List[BenchResult]) -> None:
+    print(f"{'configuración':<70} {'seg':>8} {'reg/s':>9} {'fallos':>7} {'p95 fetch_mun':>14} {'p95 persist_mun':>16}")
+    for result in sorted(results, key=lambda item: item.records_per_second, reverse=True):
+        label = " ".join(f"{key}={value}" for key, value in result.config.items())
+        print(
+            f"{label:<70} {result.seconds:>8.2f} {result.records_per_second:>9.1f} {result.failures:>7} "
+            f"{str(result.p95_seconds.get('fetch_municipios')):>14} "
+            f"{str(result.p95_seconds.get('persist_municipios')):>16}"
+        )
+
+
+def command_run(args: argparse.Namespace, extra_args: List[str]) -> None:
+    fixtures = build_fixtures(args)
+    positiva, backend = start_fakes(args, fixtures)
+    grid = list(
+        itertools.product(
+            parse_int_list(args.max_workers),
+            parse_int_list(args.municipality_workers),
+            parse_int_list(args.chunk_size),
+            parse_int_list(args.throttle_ms),
+        )
+    )
+    results: List[BenchResult] = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_geodivisions_") as workdir:
+            for max_workers, municipality_workers, chunk_size, throttle_ms in grid:
+                config = {
+                    "max_workers": max_workers,
+                    "municipality_workers": municipality_workers,
+                    "chunk_size": chunk_size,
+                    "throttle_ms": throttle_ms,
+                }
+                for repetition in range(args.repeat):
+                    logging.info("Ejecutando %s (repetición %d/%d).", config, repetition + 1, args.repeat)
+                    results.append(run_sync(config, positiva, backend, extra_args, workdir))
+    finally:
+        positiva.shutdown()
+        backend.shutdown()
+
+    print_results(results)
+    if args.output:
+        write_results(results, args.output)
+        logging.info("Resultados escritos en %s.", args.output)
+
+
+def command_serve(args: argparse.Namespace) -> None:
+    fixtures = build_fixtures(args)
+    positiva, backend = start_fakes(args, fixtures)
+    print(f"--external-base-url {positiva.url} --backend-url {backend.url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        positiva.shutdown()
+        backend.shutdown()
+
+
+def add_common_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--countries", type=int, default=20, help="Países sintéticos a generar.")
+    parser.add_argument("--departments", type=int, default=15, help="Departamentos promedio por país.")
+    parser.add_argument("--municipios", type=int, default=40, help="Municipios promedio por departamento.")
+    parser.add_argument("--seed", type=int, default=7, help="Semilla para fixtures y fallas inyectadas.")
+    parser.add_argument(
+        "--fixtures-cache",
+        help="SQLite de caché de sync_geodivisions.py a reproducir en lugar de datos sintéticos.",
+    )
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latencia añadida a la API de Positiva.")
+    parser.add_argument("--backend-latency-ms", type=float, default=0.0, help="Latencia añadida al backend.")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Variación aleatoria adicional de latencia.")
+    parser.add_argument("--external-error-rate", type=float, default=0.0, help="Fracción de respuestas 5xx de Positiva.")
+    parser.add_argument("--backend-error-rate", type=float, default=0.0, help="Fracción de respuestas 5xx del backend.")
+    parser.add_argument("--error-status", type=int, default=500, help="Status HTTP usado para los errores inyectados.")
+    parser.add_argument("--external-429-rate", type=float, default=0.0, help="Fracción de respuestas 429 de Positiva.")
+    parser.add_argument("--backend-429-rate", type=float, default=0.0, help="Fracción de respuestas 429 del backend.")
+    parser.add_argument(
+        "--poison-rate",
+        type=float,
+        default=0.0,
+        help="Fracción de registros que el backend rechaza siempre (para probar bisección/cuarentena).",
+    )
+    parser.add_argument(
+        "--poison-status",
+        type=int,
+        default=501,
+        help="Status HTTP con que se rechazan los registros envenenados (500 pasa por los reintentos).",
+    )
+    parser.add_argument(
+        "--reject-gzip",
+        action="store_true",
+        help="El backend responde 415 a los cuerpos con Content-Encoding: gzip.",
+    )
+    parser.add_argument("--positiva-port", type=int, default=0, help="Puerto de la API de Positiva simulada.")
+    parser.add_argument("--backend-port", type=int, default=0, help="Puerto del backend simulado.")
+
+
+def parse_args() -> Tuple[argparse.Namespace, List[str]]:
+    parser = argparse.ArgumentParser(
+        description="Servidores simulados y banco de rendimiento para sync_geodivisions.py."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run",
+        help="Barre configuraciones de sync_geodivisions.py contra los servidores simulados.",
+        description="Los argumentos no reconocidos se pasan tal cual a sync_geodivisions.py (por ej. --engine async).",
+    )
+    add_common_arguments(run_parser)
+    run_parser.add_argument("--max-workers", default="4", help="Valores separados por coma.")
+    run_parser.add_argument("--municipality-workers", default="2", help="Valores separados por coma.")
+    run_parser.add_argument("--chunk-size", default="250", help="Valores separados por coma.")
+    run_parser.add_argument("--throttle-ms", default="0", help="Valores separados por coma.")
+    run_parser.add_argument("--repeat", type=int, default=1, help="Repeticiones por configuración.")
+    run_parser.add_argument("--output", help="CSV o JSON (según extensión) con los resultados.")
+
+    serve_parser = subparsers.add_parser("serve", help="Solo levanta los servidores simulados.")
+    add_common_arguments(serve_parser)
+
+    return parser.parse_known_args()
+
+
+def main() -> None:
+    args, extra_args = parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(levelname)s] %(asctime)s - %(message)s",
+    )
+    if args.command == "run":
+        command_run(args, extra_args)
+    else:
+        if extra_args:
+            raise SystemExit(f"Argumentos no reconocidos: {' '.join(extra_args)}")
+        command_serve(args)
+
+
+if __name__ == "__main__":
+    main()
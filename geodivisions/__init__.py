@@ -0,0 +1 @@
+"""Implementación de `sync_geodivisions.py`, separada en módulos por responsabilidad."""
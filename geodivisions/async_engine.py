@@ -0,0 +1,551 @@
+"""Motor asyncio (`--engine async`): el mismo barrido desde un único event loop con aiohttp."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - dependencia opcional (--engine async)
+    aiohttp = None
+
+from . import core
+from .breaker import CircuitOpenError
+from .core import (
+    DEPARTMENT_DIFF_FIELDS,
+    DEPARTMENTS_ENDPOINT,
+    DEPARTMENTS_PATH,
+    MUNICIPIO_DIFF_FIELDS,
+    MUNICIPIOS_ENDPOINT,
+    MUNICIPIOS_PATH,
+    BackendState,
+    BatchQueue,
+    ParkedBatch,
+    SyncResult,
+    backend_state_urls,
+    build_backend_state,
+    current_chunk_size,
+    current_run,
+    delta_state_paths,
+    fetch_failure,
+    handle_batch_error,
+    hold_quarantined,
+    journal_ack,
+    journal_country_done,
+    journal_fetched_municipios,
+    journal_finish_country,
+    journal_pending,
+    journal_store_municipios,
+    log_delta,
+    persist_inflight_limit,
+    serialize_sample,
+)
+from .http_client import AsyncHttpClient, TokenSource, wait_for_slot_async
+from .metrics import metrics
+from .records import (
+    DeltaStats,
+    DepartmentRecord,
+    MunicipioBuffer,
+    MunicipioDedup,
+    MunicipioRecord,
+    build_departamento_payload,
+    collect_municipio_buffer,
+    collect_municipio_payloads,
+    department_identifiers,
+    department_payload_key,
+    diff_payloads,
+    merge_municipio_batches,
+    municipio_payload_key,
+    normalize_departments,
+    normalize_municipios,
+)
+from .storage import SyncFailure, cached_fetch_async
+
+
+async def fetch_departments_async(
+    client: AsyncHttpClient, external_id: int, token: TokenSource, throttle_ms: int
+) -> List[DepartmentRecord]:
+    async def load() -> Any:
+        url = f"{core.POSITIVA_BASE_URL}{DEPARTMENTS_PATH}"
+        await wait_for_slot_async(url, throttle_ms)
+        with metrics.timed("fetch_departamentos"):
+            return await client.request_json("GET", url, token, params={"idPais": external_id}) or []
+
+    return normalize_departments(await cached_fetch_async(DEPARTMENTS_PATH, external_id, 0, load))
+
+
+async def fetch_municipios_async(
+    client: AsyncHttpClient, external_id: int, division_id: int, token: TokenSource, throttle_ms: int
+) -> List[MunicipioRecord]:
+    async def load() -> Any:
+        url = f"{core.POSITIVA_BASE_URL}{MUNICIPIOS_PATH}"
+        await wait_for_slot_async(url, throttle_ms)
+        with metrics.timed("fetch_municipios"):
+            return (
+                await client.request_json(
+                    "GET",
+                    url,
+                    token,
+                    params={"idPais": external_id, "idDivisionPolitica": division_id},
+                )
+                or []
+            )
+
+    return normalize_municipios(await cached_fetch_async(MUNICIPIOS_PATH, external_id, division_id, load))
+
+
+async def fetch_backend_state_async(
+    client: AsyncHttpClient,
+    backend_url: str,
+    token: TokenSource,
+    country_id: int,
+    external_id: int,
+    state_paths: Tuple[str, str],
+) -> Optional[BackendState]:
+    payloads = []
+    try:
+        for url in backend_state_urls(backend_url, country_id, external_id, state_paths):
+            await wait_for_slot_async(url)
+            payloads.append(await client.request_json("GET", url, token))
+    except requests.RequestException as exc:
+        current_run().backend_state_failures.record(country_id, external_id, exc)
+        return None
+    return build_backend_state(*payloads)
+
+
+async def persist_entities_async(
+    client: AsyncHttpClient,
+    endpoint_suffix: str,
+    stage: str,
+    backend_url: str,
+    token: TokenSource,
+    entities: Sequence[Dict],
+    chunk_size: int,
+    country_id: int,
+    external_id: int,
+    inflight: Optional[int] = None,
+) -> Tuple[int, List[SyncFailure]]:
+    entities = await asyncio.to_thread(journal_pending, stage, country_id, entities)
+    entities = hold_quarantined(endpoint_suffix, stage, backend_url, token, entities, country_id, external_id)
+    if not entities:
+        return 0, []
+
+    coalescer = current_run().coalescers.get(endpoint_suffix)
+    if coalescer is not None:
+        return await asyncio.wrap_future(coalescer.submit(entities, country_id, external_id))
+
+    pending = BatchQueue(entities, lambda: current_chunk_size(endpoint_suffix, chunk_size))
+    lanes = inflight or persist_inflight_limit(endpoint_suffix)
+    if lanes <= 1 or len(entities) <= current_chunk_size(endpoint_suffix, chunk_size):
+        return await send_batches_async(
+            client, endpoint_suffix, stage, backend_url, token, pending, chunk_size, country_id, external_id
+        )
+
+    # Igual que en `persist_entities`, pero sin lock: los carriles solo ceden el control en los await.
+    async def lane() -> Tuple[int, List[SyncFailure]]:
+        sent = 0
+        failures: List[SyncFailure] = []
+        while pending:
+            local = BatchQueue([], lambda: current_chunk_size(endpoint_suffix, chunk_size))
+            local.appendleft(pending.popleft())
+            lane_sent, lane_failures = await send_batches_async(
+                client,
+                endpoint_suffix,
+                stage,
+                backend_url,
+                token,
+                local,
+                chunk_size,
+                country_id,
+                external_id,
+                pending.drain,
+            )
+            sent += lane_sent
+            failures.extend(lane_failures)
+        return sent, failures
+
+    outcomes = await asyncio.gather(*(lane() for _ in range(lanes)))
+    return sum(sent for sent, _ in outcomes), [failure for _, failures in outcomes for failure in failures]
+
+
+async def send_batches_async(
+    client: AsyncHttpClient,
+    endpoint_suffix: str,
+    stage: str,
+    backend_url: str,
+    token: TokenSource,
+    pending: BatchQueue,
+    chunk_size: int,
+    country_id: int,
+    external_id: int,
+    take_rest: Callable[[], List[Dict]] = list,
+) -> Tuple[int, List[SyncFailure]]:
+    url = f"{backend_url.rstrip('/')}/{endpoint_suffix.lstrip('/')}"
+    sent = 0
+    failures: List[SyncFailure] = []
+
+    while pending:
+        batch = pending.popleft()
+        if not batch:
+            continue
+        await wait_for_slot_async(url)
+        started = time.monotonic()
+        try:
+            with metrics.timed(stage):
+                await client.request_json("POST", url, token, payload=batch, timeout=120)
+            sent += len(batch)
+            await asyncio.to_thread(journal_ack, stage, country_id, batch)
+            if core.batch_sizer is not None:
+                core.batch_sizer.record_success(endpoint_suffix, len(batch), time.monotonic() - started)
+        except CircuitOpenError:
+            current_run().parked_batches.park(
+                ParkedBatch(
+                    endpoint_suffix,
+                    stage,
+                    backend_url,
+                    token,
+                    chunk_size,
+                    country_id,
+                    external_id,
+                    batch + pending.drain() + take_rest(),
+                )
+            )
+            break
+        except Exception as exc:
+            failure = handle_batch_error(exc, batch, pending, stage, country_id, external_id)
+            if failure:
+                failures.append(failure)
+            elif core.batch_sizer is not None:
+                core.batch_sizer.record_split(endpoint_suffix, len(batch))
+
+    return sent, failures
+
+
+class AsyncMunicipioStream:
+    """Equivalente asyncio de `MunicipioStream`: una cola acotada drenada por una tarea consumidora."""
+
+    def __init__(
+        self,
+        client: AsyncHttpClient,
+        backend_url: str,
+        token: TokenSource,
+        chunk_size: int,
+        country_id: int,
+        external_id: int,
+        queue_size: int,
+    ):
+        self._client = client
+        self._backend_url = backend_url
+        self._token = token
+        self._chunk_size = chunk_size
+        self._country_id = country_id
+        self._external_id = external_id
+        self._queue: "asyncio.Queue[Optional[List[Dict]]]" = asyncio.Queue(maxsize=max(1, queue_size))
+        self.received = 0
+        self.sent = 0
+        self.failures: List[SyncFailure] = []
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, batch: List[Dict]) -> None:
+        if batch:
+            await self._queue.put(batch)
+
+    async def close(self) -> None:
+        await self._queue.put(None)
+        await self._task
+
+    async def _flush(self, batch: List[Dict]) -> None:
+        sent, failures = await persist_entities_async(
+            self._client,
+            MUNICIPIOS_ENDPOINT,
+            "persist_municipios",
+            self._backend_url,
+            self._token,
+            batch,
+            self._chunk_size,
+            self._country_id,
+            self._external_id,
+        )
+        self.sent += sent
+        self.failures.extend(failures)
+
+    async def _run(self) -> None:
+        buffer: List[Dict] = []
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            self.received += len(item)
+            buffer.extend(item)
+            size = current_chunk_size(MUNICIPIOS_ENDPOINT, self._chunk_size)
+            while len(buffer) >= size:
+                await self._flush(buffer[:size])
+                del buffer[:size]
+                size = current_chunk_size(MUNICIPIOS_ENDPOINT, self._chunk_size)
+        if buffer:
+            await self._flush(buffer)
+
+
+async def sync_country_async(
+    client: AsyncHttpClient,
+    country: Dict,
+    backend_url: str,
+    backend_token: TokenSource,
+    external_token: TokenSource,
+    throttle_ms: int,
+    chunk_size: int,
+    municipality_workers: int,
+    backend_state_paths: Optional[Tuple[str, str]] = None,
+    stream_queue_size: int = 0,
+) -> SyncResult:
+    country_id = country["idPais"]
+    external_id = country.get("idPositiva")
+    result = SyncResult(country_id=country_id, external_id=external_id or 0)
+
+    if external_id is None:
+        logging.info("País %s no tiene idPositiva. Se omite.", country_id)
+        return result
+
+    if await asyncio.to_thread(journal_country_done, country_id):
+        logging.info("País %s/%s: completado según el journal. Se omite.", country_id, external_id)
+        return result
+
+    logging.info("País %s/%s: descargando departamentos.", country_id, external_id)
+    try:
+        remote_departments = await fetch_departments_async(client, external_id, external_token, throttle_ms)
+    except requests.RequestException as exc:
+        result.failures.append(
+            fetch_failure(
+                country_id,
+                external_id,
+                "fetch_departamentos",
+                exc,
+                "No se pudieron obtener departamentos",
+                "Error de red al obtener departamentos",
+            )
+        )
+        return result
+
+    if not remote_departments:
+        logging.info("País %s/%s: sin departamentos en API externa.", country_id, external_id)
+        return result
+
+    backend_state = (
+        await fetch_backend_state_async(
+            client, backend_url, backend_token, country_id, external_id, backend_state_paths
+        )
+        if backend_state_paths is not None
+        else None
+    )
+
+    dept_payloads = [build_departamento_payload(external_id, dep) for dep in remote_departments]
+    if backend_state is not None:
+        dept_payloads, result.department_delta = diff_payloads(
+            dept_payloads, backend_state.departments, department_payload_key, DEPARTMENT_DIFF_FIELDS
+        )
+        log_delta(country_id, external_id, "departamentos", result.department_delta)
+    deps_sent, dep_failures = await persist_entities_async(
+        client,
+        DEPARTMENTS_ENDPOINT,
+        "persist_departamentos",
+        backend_url,
+        backend_token,
+        dept_payloads,
+        chunk_size,
+        country_id,
+        external_id,
+    )
+    result.departments_sent = deps_sent
+    result.failures.extend(dep_failures)
+    logging.info(
+        "País %s/%s: %d/%d departamentos enviados (%d fallos).",
+        country_id,
+        external_id,
+        deps_sent,
+        len(dept_payloads),
+        len(dep_failures),
+    )
+
+    stream: Optional[AsyncMunicipioStream] = None
+    stream_dedup = MunicipioDedup()
+    if stream_queue_size > 0:
+        stream = AsyncMunicipioStream(
+            client, backend_url, backend_token, chunk_size, country_id, external_id, stream_queue_size
+        )
+        if backend_state is not None:
+            result.municipality_delta = DeltaStats()
+
+    # Equivalente al pool de `--municipality-workers` hilos del motor threads.
+    department_slots = asyncio.Semaphore(max(1, municipality_workers))
+
+    async def process_department_municipios(dep: DepartmentRecord) -> Optional[MunicipioBuffer]:
+        async with department_slots:
+            return await fetch_department_municipios(dep)
+
+    async def fetch_department_municipios(dep: DepartmentRecord) -> Optional[MunicipioBuffer]:
+        try:
+            division_id_int, remote_dep_id_int, dep_name = department_identifiers(dep)
+        except ValueError as exc:
+            result.failures.append(
+                SyncFailure(
+                    country_id=country_id,
+                    external_id=external_id,
+                    stage="fetch_municipios",
+                    status=None,
+                    message=str(exc),
+                    sample=serialize_sample(dep.raw),
+                )
+            )
+            return None
+        fetched = await asyncio.to_thread(journal_fetched_municipios, country_id, division_id_int)
+        try:
+            if fetched is None:
+                fetched = await fetch_municipios_async(
+                    client, external_id, division_id_int, external_token, throttle_ms
+                )
+                await asyncio.to_thread(journal_store_municipios, country_id, division_id_int, fetched)
+        except requests.RequestException as exc:
+            result.failures.append(
+                fetch_failure(
+                    country_id,
+                    external_id,
+                    "fetch_municipios",
+                    exc,
+                    f"No se pudieron obtener municipios para departamento {remote_dep_id_int}",
+                    f"Error de red obteniendo municipios para departamento {remote_dep_id_int}",
+                    str(division_id_int),
+                )
+            )
+            return None
+        if stream is None:
+            return collect_municipio_buffer(external_id, division_id_int, remote_dep_id_int, dep_name, fetched)
+        local_batch = collect_municipio_payloads(
+            external_id,
+            division_id_int,
+            remote_dep_id_int,
+            dep_name,
+            fetched,
+        )
+        if not local_batch:
+            return None
+        local_batch = stream_dedup.admit(remote_dep_id_int, local_batch)
+        if backend_state is not None:
+            local_batch, _ = diff_payloads(
+                local_batch,
+                backend_state.municipios,
+                municipio_payload_key,
+                MUNICIPIO_DIFF_FIELDS,
+                result.municipality_delta,
+            )
+        await stream.put(local_batch)
+        return None
+
+    try:
+        buffers = await asyncio.gather(*(process_department_municipios(dep) for dep in remote_departments))
+    finally:
+        if stream is not None:
+            await stream.close()
+
+    if stream is not None:
+        mun_total, mun_sent, mun_failures = stream.received, stream.sent, stream.failures
+        if result.municipality_delta is not None:
+            log_delta(country_id, external_id, "municipios", result.municipality_delta)
+    else:
+        municipios_payload: Sequence[Dict] = merge_municipio_batches(
+            external_id, (buffer for buffer in buffers if buffer is not None)
+        )
+        if backend_state is not None:
+            municipios_payload, result.municipality_delta = diff_payloads(
+                municipios_payload, backend_state.municipios, municipio_payload_key, MUNICIPIO_DIFF_FIELDS
+            )
+            log_delta(country_id, external_id, "municipios", result.municipality_delta)
+
+        mun_total = len(municipios_payload)
+        mun_sent, mun_failures = await persist_entities_async(
+            client,
+            MUNICIPIOS_ENDPOINT,
+            "persist_municipios",
+            backend_url,
+            backend_token,
+            municipios_payload,
+            chunk_size,
+            country_id,
+            external_id,
+        )
+    result.municipalities_sent = mun_sent
+    result.failures.extend(mun_failures)
+    logging.info(
+        "País %s/%s: %d/%d municipios enviados (%d fallos).",
+        country_id,
+        external_id,
+        mun_sent,
+        mun_total,
+        len(mun_failures),
+    )
+    await asyncio.to_thread(journal_finish_country, result)
+    return result
+
+
+async def timed_sync_country_async(slots: asyncio.Semaphore, *args: Any) -> SyncResult:
+    """Un país por cupo de `slots` (`--max-workers`), como el pool de hilos del motor threads."""
+    async with slots:
+        started = time.monotonic()
+        result = await sync_country_async(*args)
+        metrics.record_country(result, time.monotonic() - started)
+        return result
+
+
+async def _run_async_engine(
+    targets: List[Dict],
+    args: argparse.Namespace,
+    backend_token: TokenSource,
+    external_token: TokenSource,
+) -> List[SyncResult]:
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=args.async_host_limit)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        client = AsyncHttpClient(http, backoff_factor=args.retry_backoff, status_retries=args.status_retries)
+        country_slots = asyncio.Semaphore(max(1, args.max_workers))
+        outcomes = await asyncio.gather(
+            *(
+                timed_sync_country_async(
+                    country_slots,
+                    client,
+                    country,
+                    args.backend_url,
+                    backend_token,
+                    external_token,
+                    args.throttle_ms,
+                    args.chunk_size,
+                    args.municipality_workers,
+                    delta_state_paths(args),
+                    args.stream_queue_size if args.stream else 0,
+                )
+                for country in targets
+            ),
+            return_exceptions=True,
+        )
+
+    results: List[SyncResult] = []
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            logging.error("Error sincronizando país: %s", outcome, exc_info=outcome)
+        elif outcome:
+            results.append(outcome)
+    return results
+
+
+def run_async_engine(
+    targets: List[Dict],
+    args: argparse.Namespace,
+    backend_token: TokenSource,
+    external_token: TokenSource,
+) -> List[SyncResult]:
+    if aiohttp is None:
+        raise SystemExit("El motor async requiere aiohttp (pip install aiohttp).")
+    return asyncio.run(_run_async_engine(targets, args, backend_token, external_token))
@@ -0,0 +1,208 @@
+"""Circuit breakers por endpoint (`--breaker-threshold`), compartidos entre hilos y corrutinas."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from .metrics import metrics
+
+
+class CircuitOpenError(requests.RequestException):
+    """El circuito del endpoint está abierto: la petición no se envía."""
+
+
+class CircuitBreaker:
+    """Circuito closed/open/half-open de un endpoint, compartido entre hilos y corrutinas.
+
+    - closed: deja pasar todo; `threshold` fallos consecutivos (cada respuesta 5xx o 429, o un error de
+      conexión una vez agotados sus reintentos) lo abren.
+    - open: rechaza las peticiones (o las hace esperar hasta `max_wait`) durante el cooldown.
+    - half-open: deja pasar una única petición de prueba; si responde se cierra, si falla se reabre con
+      el cooldown duplicado (hasta `max_cooldown`).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, threshold: int, cooldown: float, max_cooldown: float = 300.0):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.state = self.CLOSED
+        self._cooldown = cooldown
+        self._failures = 0
+        self._opened_until = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _admit(self) -> float:
+        """Reserva el paso y devuelve 0, o los segundos a esperar antes de volver a intentarlo."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now < self._opened_until:
+                    return self._opened_until - now
+                self.state = self.HALF_OPEN
+                logging.info("Circuito %s semiabierto: enviando petición de prueba.", self.name)
+            if self._probe_in_flight:
+                return min(1.0, self._cooldown)
+            self._probe_in_flight = True
+            return 0.0
+
+    def _reject(self) -> CircuitOpenError:
+        metrics.inc("circuit_rejections_total", endpoint=self.name)
+        return CircuitOpenError(f"Circuito abierto para {self.name}")
+
+    def before_call(self, max_wait: float = 0.0) -> None:
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self._admit()
+            if wait <= 0:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise self._reject()
+            time.sleep(min(wait, remaining))
+
+    async def before_call_async(self, max_wait: float = 0.0) -> None:
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self._admit()
+            if wait <= 0:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise self._reject()
+            await asyncio.sleep(min(wait, remaining))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self.state != self.CLOSED:
+                logging.info("Circuito %s cerrado: el endpoint respondió de nuevo.", self.name)
+                self.state = self.CLOSED
+                self._cooldown = self.base_cooldown
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                self._cooldown = min(self.max_cooldown, self._cooldown * 2)
+                self._open()
+                return
+            self._failures += 1
+            if self.state == self.CLOSED and self._failures >= self.threshold:
+                self._open()
+
+    def release(self) -> None:
+        """Libera la prueba de half-open sin cambiar de estado (errores ajenos a la salud del endpoint)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def remaining_cooldown(self) -> float:
+        """Segundos que faltan para que el circuito abierto pase a half-open (0 si no está abierto)."""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self._opened_until - time.monotonic())
+
+    def wait_until_ready(self, max_wait: float) -> bool:
+        """Espera (hasta `max_wait`) a que el circuito admita una petición, sin reservar la prueba."""
+        try:
+            self.before_call(max_wait)
+        except CircuitOpenError:
+            return False
+        self.release()
+        return True
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_until = time.monotonic() + self._cooldown
+        metrics.inc("circuit_opened_total", endpoint=self.name)
+        logging.warning(
+            "Circuito %s abierto tras %d fallos consecutivos; se pausa %.0fs.",
+            self.name,
+            self._failures,
+            self._cooldown,
+        )
+
+
+def endpoint_key(url: str) -> str:
+    """Host + ruta con los segmentos numéricos normalizados (`/geodivision/{id}/municipios`)."""
+    parts = urlsplit(url)
+    segments = ["{id}" if segment.isdigit() else segment for segment in parts.path.rstrip("/").split("/")]
+    return parts.netloc + "/".join(segments)
+
+
+def is_breaker_failure(status: Optional[int] = None, exc: Optional[BaseException] = None) -> bool:
+    if exc is not None:
+        return isinstance(exc, (requests.ConnectionError, requests.Timeout)) and not isinstance(exc, CircuitOpenError)
+    return status is not None and (status >= 500 or status == 429)
+
+
+class CircuitBreakerRegistry:
+    """Circuitos indexados por `endpoint_key`; deshabilitado mientras `threshold` sea 0."""
+
+    def __init__(self) -> None:
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self.threshold = 0
+        self.cooldown = 30.0
+        self.max_cooldown = 300.0
+        self.max_wait = 0.0
+
+    def configure(self, threshold: int, cooldown: float, max_wait: float) -> None:
+        self.clear()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_wait = max_wait
+
+    def for_url(self, url: str) -> Optional[CircuitBreaker]:
+        if self.threshold <= 0:
+            return None
+        key = endpoint_key(url)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(
+                    key, self.threshold, self.cooldown, self.max_cooldown
+                )
+            return breaker
+
+    def clear(self) -> None:
+        with self._lock:
+            self._breakers.clear()
+        self.threshold = 0
+
+
+circuit_breakers = CircuitBreakerRegistry()
+
+
+def configure_circuit_breakers(args: argparse.Namespace) -> None:
+    if not args.breaker_threshold:
+        circuit_breakers.clear()
+        return
+    circuit_breakers.configure(
+        args.breaker_threshold,
+        args.breaker_cooldown,
+        args.breaker_max_wait if args.breaker_mode == "pause" else 0.0,
+    )
+    logging.info(
+        "Circuit breaker por endpoint: %d fallos consecutivos, cooldown %.0fs, modo %s.",
+        args.breaker_threshold,
+        args.breaker_cooldown,
+        args.breaker_mode,
+    )
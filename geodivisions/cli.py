@@ -0,0 +1,681 @@
+"""Argumentos de línea de comandos, configuración del proceso y de cada corrida, y `run_sync`."""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import logging
+import os
+import time
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import core, storage
+from .async_engine import run_async_engine
+from .breaker import configure_circuit_breakers
+from .core import (
+    RunState,
+    begin_run,
+    close_coalescers,
+    close_persist_lanes,
+    configure_batch_sizer,
+    configure_coalescers,
+    configure_persist_inflight,
+    configure_quarantine,
+    end_run,
+    extra_persist_lanes,
+    fetch_countries,
+    parse_persist_inflight,
+    retry_parked_batches,
+    run_threaded_engine,
+    send_quarantined_records,
+)
+from .http_client import (
+    DEFAULT_BACKEND_TOKEN_URL,
+    DEFAULT_EXTERNAL_TOKEN_URL,
+    TokenProvider,
+    TokenSource,
+    configure_body_encoder,
+    http_pool,
+    obtain_backend_token,
+    obtain_external_token,
+    rate_limiters,
+    report_http_pool,
+)
+from .metrics import metrics
+from .records import DeltaStats
+from .replay import replay_targets, run_replay
+from .scheduler import run_scheduled_engine
+from .shards import load_shard_weights, parse_shard, shard_targets, write_run_summary
+from .storage import (
+    FailureSink,
+    SyncFailure,
+    configure_journal,
+    configure_response_cache,
+    default_report_path,
+    read_failures_report,
+)
+
+
+def configure_http_pool(args: argparse.Namespace) -> int:
+    """Dimensiona el pool compartido según cuántas peticiones pueden estar en vuelo a la vez por host."""
+    size = args.http_pool_size
+    if not size:
+        if args.engine == "scheduler":
+            size = args.max_workers
+        else:
+            # Hilos de país más los de municipios de cada país; el consumidor de `--stream` y los hilos
+            # del coalescer también envían.
+            size = args.max_workers * (args.municipality_workers + 1)
+            if args.stream:
+                size += args.max_workers
+            # Carriles extra de `--persist-inflight` (0 con --coalesce).
+            size += extra_persist_lanes(args)
+        if args.coalesce:
+            size += 2 * args.coalesce_workers
+    http_pool.configure(size, args.status_retries, args.retry_backoff)
+    logging.info("Pool HTTP compartido: hasta %d conexiones keep-alive por host.", http_pool.maxsize)
+    return http_pool.maxsize
+
+
+def configure_rate_limits(args: argparse.Namespace) -> None:
+    rate_limiters.clear()
+    if args.external_rps:
+        rate_limiters.configure(core.POSITIVA_BASE_URL, args.external_rps, args.external_burst)
+        logging.info("Límite externo: %.2f req/s (ráfaga %s).", args.external_rps, args.external_burst or "auto")
+    if args.backend_rps:
+        rate_limiters.configure(args.backend_url, args.backend_rps, args.backend_burst)
+        logging.info("Límite backend: %.2f req/s (ráfaga %s).", args.backend_rps, args.backend_burst or "auto")
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Sincroniza departamentos y municipios externos usando hilos."
+    )
+    parser.add_argument(
+        "--backend-url",
+        default="http://localhost:8081",
+        help="URL base del backend SGDEA (por ej. http://localhost:8081)",
+    )
+    parser.add_argument(
+        "--external-base-url",
+        default=core.POSITIVA_BASE_URL,
+        help="URL base de la API de Positiva (por ej. un servidor local de bench_geodivisions.py).",
+    )
+    parser.add_argument(
+        "--backend-token",
+        help="Token Bearer para invocar los endpoints del backend. Si se omite, se intentará obtener con credenciales.",
+    )
+    parser.add_argument(
+        "--external-token",
+        help="Token Bearer para la API externa de Positiva. Si se omite se usa el mismo del backend.",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=os.cpu_count() or 4,
+        help="Número máximo de países en paralelo (hilos, o corrutinas con --engine async).",
+    )
+    parser.add_argument(
+        "--municipality-workers",
+        type=int,
+        default=max(2, (os.cpu_count() or 4) // 2),
+        help="Descargas de municipios en paralelo por país (hilos, o corrutinas con --engine async).",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("threads", "async", "scheduler"),
+        default="threads",
+        help=(
+            "Motor de ejecución: hilos anidados (por defecto), un único event loop asyncio con aiohttp "
+            "o un planificador global con --max-workers hilos en total."
+        ),
+    )
+    parser.add_argument(
+        "--http-pool-size",
+        type=int,
+        default=0,
+        help="Conexiones keep-alive por host del pool HTTP compartido (0 = según --max-workers, "
+        "--municipality-workers y --engine).",
+    )
+    parser.add_argument(
+        "--status-retries",
+        type=int,
+        default=5,
+        help="Reintentos con backoff ante HTTP 429/5xx antes de dar la respuesta por definitiva (0 = ninguno). "
+        "Con --breaker-threshold, 0 hace que el circuito cuente cada 5xx en lugar de cada petición agotada.",
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        default=0.5,
+        help="Factor de backoff exponencial (segundos) entre reintentos HTTP.",
+    )
+    parser.add_argument(
+        "--persist-inflight",
+        type=parse_persist_inflight,
+        default=None,
+        metavar="N|departamentos=N,municipios=M",
+        help="Lotes POST en vuelo a la vez por endpoint dentro de cada país (por defecto 1, secuencial). "
+        "La bisección ante 5xx sigue siendo por lote. Se ignora con --coalesce y con --engine scheduler, "
+        "donde cada lote ya es un envío acotado por el coalescer o por --max-workers.",
+    )
+    parser.add_argument(
+        "--prefetch-departments",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Descarga por adelantado los departamentos de hasta N países siguientes (motores threads y "
+        "scheduler; 0 = desactivado).",
+    )
+    parser.add_argument(
+        "--async-host-limit",
+        type=int,
+        default=64,
+        help="Máximo de conexiones simultáneas por host en el motor async.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=250,
+        help="Cantidad de registros por batch al persistir.",
+    )
+    parser.add_argument(
+        "--adaptive-batches",
+        action="store_true",
+        help="Ajusta el tamaño de lote por endpoint (AIMD) partiendo de --chunk-size.",
+    )
+    parser.add_argument(
+        "--max-chunk-size",
+        type=int,
+        default=1000,
+        help="Tamaño máximo de lote al que puede crecer --adaptive-batches.",
+    )
+    parser.add_argument(
+        "--batch-step",
+        type=int,
+        default=25,
+        help="Incremento aditivo del tamaño de lote tras una racha de lotes exitosos.",
+    )
+    parser.add_argument(
+        "--batch-latency-budget",
+        type=float,
+        default=5.0,
+        help="Latencia objetivo en segundos por POST; si se excede el tamaño de lote se reduce a la mitad.",
+    )
+    parser.add_argument(
+        "--batch-size-file",
+        help="JSON donde se cargan y guardan los tamaños de lote aprendidos entre corridas.",
+    )
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Combina los payloads de varios países en lotes completos por endpoint antes de enviarlos "
+        "(no compatible con --engine scheduler).",
+    )
+    parser.add_argument(
+        "--coalesce-window-ms",
+        type=int,
+        default=250,
+        help="Tiempo máximo que un registro espera en el coalescer antes de enviar un lote parcial.",
+    )
+    parser.add_argument(
+        "--coalesce-workers",
+        type=int,
+        default=2,
+        help="Hilos que envían en paralelo los lotes combinados de cada endpoint.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Persiste los municipios mientras se descargan (cola acotada por país) en lugar de al final "
+        "(motores threads y async).",
+    )
+    parser.add_argument(
+        "--stream-queue-size",
+        type=int,
+        default=16,
+        help="Máximo de departamentos pendientes de persistir en la cola de --stream.",
+    )
+    parser.add_argument(
+        "--throttle-ms",
+        type=int,
+        default=50,
+        help="Retardo en ms entre llamadas a la API externa (por hilo). Se ignora si se usa --external-rps.",
+    )
+    parser.add_argument(
+        "--external-rps",
+        type=float,
+        help="Tasa máxima global de peticiones por segundo hacia la API de Positiva (token bucket; "
+        "cuenta cada intento, reintentos incluidos).",
+    )
+    parser.add_argument(
+        "--external-burst",
+        type=int,
+        help="Tamaño de ráfaga del token bucket externo. Por defecto ceil(--external-rps).",
+    )
+    parser.add_argument(
+        "--backend-rps",
+        type=float,
+        help="Tasa máxima global de peticiones por segundo hacia el backend SGDEA (token bucket; cuenta "
+        "cada intento, reintentos incluidos).",
+    )
+    parser.add_argument(
+        "--backend-burst",
+        type=int,
+        help="Tamaño de ráfaga del token bucket del backend. Por defecto ceil(--backend-rps).",
+    )
+    parser.add_argument(
+        "--cache-mode",
+        choices=("off", "read", "refresh", "offline"),
+        default="off",
+        help=(
+            "Caché local de respuestas de Positiva: off (sin caché), read (usa entradas vigentes), "
+            "refresh (descarga y actualiza todo) u offline (solo caché, sin llamadas externas)."
+        ),
+    )
+    parser.add_argument(
+        "--cache-file",
+        help="Ruta del SQLite de caché. Por defecto ./exports/geodivision_cache.sqlite.",
+    )
+    parser.add_argument(
+        "--cache-ttl-hours",
+        type=float,
+        default=168,
+        help="Vigencia en horas de cada entrada de la caché en modo read.",
+    )
+    parser.add_argument(
+        "--delta-sync",
+        action="store_true",
+        help="Lee el estado actual del backend por país y envía solo registros nuevos o modificados.",
+    )
+    parser.add_argument(
+        "--backend-departments-path",
+        help="Ruta (GET) con los departamentos del país en el backend, requerida con --delta-sync. Admite "
+        "{idPais} e {idPositiva}.",
+    )
+    parser.add_argument(
+        "--backend-municipios-path",
+        help="Ruta (GET) con los municipios del país en el backend, requerida con --delta-sync. Admite "
+        "{idPais} e {idPositiva}.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="K/N",
+        help="Procesa solo la parte k de n de los países (partición determinista balanceada por tamaño).",
+    )
+    parser.add_argument(
+        "--shard-weights",
+        metavar="JSON",
+        help="Pesos {idPais: tamaño} para --shard (todos los shards deben usar el mismo archivo para que la "
+        "partición coincida); sin él los países se reparten de forma uniforme por idPais.",
+    )
+    parser.add_argument(
+        "--summary-file",
+        help="JSON con los totales por país de la corrida, para combinarlo con merge-reports.",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="REPORTE",
+        help="Reporte de fallos (CSV o JSONL) de una corrida anterior: solo se reintentan sus lotes y "
+        "descargas fallidas, sin recorrer los demás países.",
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="JOURNAL",
+        help="Journal SQLite de progreso. Si existe se omiten las unidades ya completadas; si no, se crea.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="Ruta donde escribir las métricas en formato texto de Prometheus al finalizar.",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        help="Ruta donde escribir el resumen de métricas en JSON al finalizar.",
+    )
+    parser.add_argument(
+        "--countries",
+        type=int,
+        nargs="*",
+        help="IDs locales de país a sincronizar. Si se omite se procesan todos los externos.",
+    )
+    parser.add_argument(
+        "--report-file",
+        help="Ruta del reporte de fallos (CSV, o JSONL si termina en .jsonl); se escribe a medida que "
+        "ocurren. Por defecto se guarda en ./exports.",
+    )
+    parser.add_argument(
+        "--backend-token-url",
+        default=DEFAULT_BACKEND_TOKEN_URL,
+        help="Endpoint para solicitar el token del backend (POST JSON username/password).",
+    )
+    parser.add_argument(
+        "--backend-username",
+        help="Usuario a utilizar si se desea obtener automáticamente el token del backend.",
+    )
+    parser.add_argument(
+        "--backend-password",
+        help="Contraseña a utilizar si se desea obtener automáticamente el token del backend.",
+    )
+    parser.add_argument(
+        "--external-token-url",
+        default=DEFAULT_EXTERNAL_TOKEN_URL,
+        help="Endpoint OAuth2 client_credentials del proveedor externo.",
+    )
+    parser.add_argument(
+        "--external-client-id",
+        help="Client ID para solicitar el token externo (client_credentials).",
+    )
+    parser.add_argument(
+        "--external-client-secret",
+        help="Client secret para solicitar el token externo (client_credentials).",
+    )
+    parser.add_argument(
+        "--external-cookie",
+        help="Cookie opcional requerida por el endpoint externo (si aplica).",
+    )
+    parser.add_argument(
+        "--breaker-threshold",
+        type=int,
+        default=0,
+        help="Fallos consecutivos (5xx, 429 o de conexión) que abren el circuito de un endpoint. 0 lo deshabilita.",
+    )
+    parser.add_argument(
+        "--breaker-cooldown",
+        type=float,
+        default=30.0,
+        help="Segundos que el circuito permanece abierto antes de enviar una petición de prueba.",
+    )
+    parser.add_argument(
+        "--breaker-mode",
+        choices=("park", "pause"),
+        default="park",
+        help="park: con el circuito abierto los lotes se aparcan al instante para una pasada posterior; "
+        "pause: las peticiones esperan hasta --breaker-max-wait a que el circuito se cierre.",
+    )
+    parser.add_argument(
+        "--breaker-max-wait",
+        type=float,
+        default=120.0,
+        help="Espera máxima por petición en modo pause antes de aparcar el lote; también acota cuánto "
+        "espera cada pasada final (--breaker-passes) a que el circuito de un endpoint se recupere.",
+    )
+    parser.add_argument(
+        "--breaker-passes",
+        type=int,
+        default=1,
+        help="Pasadas finales sobre los lotes aparcados por circuitos abiertos.",
+    )
+    parser.add_argument(
+        "--quarantine-file",
+        help="JSON con los registros aislados por bisección (lote de 1 con 5xx); persiste entre corridas.",
+    )
+    parser.add_argument(
+        "--quarantine-mode",
+        choices=("defer", "skip"),
+        default="defer",
+        help="defer: los registros en cuarentena se envían uno a uno al final; skip: se omiten.",
+    )
+    parser.add_argument(
+        "--gzip-requests",
+        action="store_true",
+        help="Envía los lotes actualizar-lote-* serializados con orjson (si está instalado) y comprimidos "
+        "con gzip; si el backend los rechaza se reenvían sin comprimir.",
+    )
+    parser.add_argument(
+        "--gzip-level",
+        type=int,
+        default=5,
+        help="Nivel de compresión gzip (1-9) para --gzip-requests.",
+    )
+    parser.add_argument(
+        "--token-refresh-margin",
+        type=float,
+        default=60.0,
+        help="Segundos antes del vencimiento (expires_in o claim exp) en que se renuevan los tokens "
+        "obtenidos con credenciales.",
+    )
+    return parser
+
+
+def validate_args(parser: argparse.ArgumentParser, args: argparse.Namespace) -> argparse.Namespace:
+    if args.engine == "scheduler" and args.coalesce:
+        # Los hilos del scheduler esperan el Future del coalescer: sus envíos no pueden ser tareas del mismo
+        # pool, y con un pool aparte la concurrencia total dejaría de estar acotada por --max-workers.
+        parser.error("--coalesce no es compatible con --engine scheduler.")
+    if args.engine == "scheduler" and args.stream:
+        # El scheduler ya reparte los lotes de municipios como tareas del pool; el consumidor de `--stream`
+        # sería un hilo fuera de --max-workers.
+        parser.error("--stream no es compatible con --engine scheduler.")
+    if args.delta_sync and not (args.backend_departments_path and args.backend_municipios_path):
+        # El backend no tiene una ruta de lectura estándar: sin las dos rutas no hay estado con qué comparar.
+        parser.error("--delta-sync requiere --backend-departments-path y --backend-municipios-path.")
+    return args
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = build_arg_parser()
+    return validate_args(parser, parser.parse_args(argv))
+
+
+def configure_process(args: argparse.Namespace) -> None:
+    core.configure_positiva(args.external_base_url)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(levelname)s] %(asctime)s - %(message)s",
+    )
+
+
+def build_token_providers(args: argparse.Namespace) -> Tuple[TokenProvider, TokenProvider]:
+    backend_loader = None
+    if args.backend_username and args.backend_password:
+        backend_loader = functools.partial(
+            obtain_backend_token, args.backend_token_url, args.backend_username, args.backend_password
+        )
+    if args.backend_token:
+        backend_token = TokenProvider(
+            "backend", args.backend_token, loader=backend_loader, refresh_margin=args.token_refresh_margin
+        )
+    elif backend_loader is not None:
+        backend_token = TokenProvider(
+            "backend", *backend_loader(), loader=backend_loader, refresh_margin=args.token_refresh_margin
+        )
+    else:
+        raise SystemExit(
+            "Debe proporcionar --backend-token o las credenciales --backend-username/--backend-password."
+        )
+
+    external_loader = None
+    if args.external_client_id and args.external_client_secret:
+        external_loader = functools.partial(
+            obtain_external_token,
+            args.external_token_url,
+            args.external_client_id,
+            args.external_client_secret,
+            args.external_cookie,
+        )
+    if args.external_token:
+        external_token = TokenProvider(
+            "externo", args.external_token, loader=external_loader, refresh_margin=args.token_refresh_margin
+        )
+    elif external_loader is not None:
+        external_token = TokenProvider(
+            "externo", *external_loader(), loader=external_loader, refresh_margin=args.token_refresh_margin
+        )
+    else:
+        logging.info("No se proporcionó token externo ni credenciales. Se reutilizará el token del backend.")
+        external_token = backend_token
+    return backend_token, external_token
+
+
+def configure_run(args: argparse.Namespace) -> None:
+    """Estado compartido del proceso; en `serve` se configura una sola vez y se reutiliza entre corridas."""
+    configure_rate_limits(args)
+    configure_response_cache(args)
+    configure_journal(args)
+    configure_batch_sizer(args)
+    configure_circuit_breakers(args)
+    configure_quarantine(args)
+    configure_body_encoder(args)
+    configure_persist_inflight(args)
+    configure_http_pool(args)
+
+
+def close_run_state() -> None:
+    end_run()
+    close_persist_lanes()
+    if storage.sync_journal is not None:
+        storage.sync_journal.close()
+    if storage.response_cache is not None:
+        storage.response_cache.close()
+
+
+def run_sync(args: argparse.Namespace, backend_token: TokenSource, external_token: TokenSource) -> Dict[str, Any]:
+    """Una sincronización completa (o replay/shard) con el estado ya configurado; devuelve su resumen.
+
+    Cada llamada corre con un `RunState` nuevo que se cierra al terminar, también si la corrida falla.
+    """
+    run = begin_run()
+    try:
+        return _run_sync(run, args, backend_token, external_token)
+    finally:
+        end_run()
+
+
+def _run_sync(
+    run: RunState, args: argparse.Namespace, backend_token: TokenSource, external_token: TokenSource
+) -> Dict[str, Any]:
+    started = time.time()
+    replay_failures: List[SyncFailure] = []
+    if args.replay:
+        replay_failures = [
+            failure
+            for failure in read_failures_report(args.replay)
+            if failure.external_id and (not args.countries or failure.country_id in args.countries)
+        ]
+        targets = [country for country, _ in replay_targets(replay_failures).values()]
+    else:
+        countries = fetch_countries(args.backend_url, backend_token)
+        targets = [
+            country
+            for country in countries
+            if country.get("idPositiva")
+            and country.get("idPositiva") != 170
+            and (not args.countries or country.get("idPais") in args.countries)
+        ]
+
+    if args.shard:
+        total_targets = len(targets)
+        targets = shard_targets(targets, args.shard, load_shard_weights(args.shard_weights))
+        selected = {country["idPais"] for country in targets}
+        replay_failures = [failure for failure in replay_failures if failure.country_id in selected]
+        logging.info(
+            "Shard %d/%d: %d de %d países (%s).",
+            *args.shard,
+            len(targets),
+            total_targets,
+            f"pesos de {args.shard_weights}" if args.shard_weights else "reparto uniforme por idPais",
+        )
+
+    if not targets:
+        logging.warning("No se encontraron países externos para sincronizar.")
+        if args.summary_file:
+            write_run_summary(args.summary_file, [], args.shard, None)
+        return {"started_at": started, "finished_at": time.time(), "countries": 0}
+
+    if args.replay:
+        logging.info("Reintentando %d fallos de %s en %d países.", len(replay_failures), args.replay, len(targets))
+    else:
+        logging.info("Iniciando sincronización para %d países.", len(targets))
+    sink = run.failure_sink = FailureSink(args.report_file or default_report_path())
+    configure_coalescers(args, backend_token)
+    try:
+        try:
+            if args.replay:
+                results = run_replay(replay_failures, args, backend_token, external_token)
+            elif args.engine == "async":
+                results = run_async_engine(targets, args, backend_token, external_token)
+            elif args.engine == "scheduler":
+                results = run_scheduled_engine(targets, args, backend_token, external_token)
+            else:
+                results = run_threaded_engine(targets, args, backend_token, external_token)
+        finally:
+            close_coalescers()
+        retry_parked_batches(results, args.breaker_passes, args.breaker_max_wait)
+        send_quarantined_records(results)
+    finally:
+        sink.close()
+    if core.record_quarantine is not None:
+        core.record_quarantine.save()
+        quarantine = core.record_quarantine
+        logging.info("Cuarentena guardada en %s (%d registros).", quarantine.path, len(quarantine))
+
+    if core.batch_sizer is not None:
+        logging.info("Tamaños de lote finales: %s.", core.batch_sizer.snapshot())
+        if args.batch_size_file:
+            core.batch_sizer.save(args.batch_size_file)
+    if storage.response_cache is not None:
+        cache = storage.response_cache
+        logging.info("Caché de respuestas: %d aciertos, %d fallos.", cache.hits, cache.misses)
+
+    report_http_pool()
+    total_departments = sum(r.departments_sent for r in results)
+    total_municipios = sum(r.municipalities_sent for r in results)
+    logging.info(
+        "Sincronización finalizada: %d países procesados, %d departamentos y %d municipios enviados.",
+        len(results),
+        total_departments,
+        total_municipios,
+    )
+    for stage, stats in metrics.summary()["stages"].items():
+        logging.info(
+            "Etapa %s: %d llamadas, promedio %.3fs, p95 <= %ss, máx %.3fs.",
+            stage,
+            stats["count"],
+            stats["avg_seconds"],
+            stats["p95_seconds"],
+            stats["max_seconds"],
+        )
+    metrics.write(args.metrics_file, args.metrics_json)
+    summary: Dict[str, Any] = {
+        "started_at": started,
+        "countries": len(results),
+        "departments_sent": total_departments,
+        "municipalities_sent": total_municipios,
+        "failures": sink.count,
+        "failed_countries": len(sink.countries),
+        "report_file": sink.path if sink.count else None,
+    }
+    if args.delta_sync:
+        summary["backend_state_failures"] = run.backend_state_failures.count
+        for label, attr in (("departamentos", "department_delta"), ("municipios", "municipality_delta")):
+            deltas = [getattr(r, attr) for r in results if getattr(r, attr) is not None]
+            totals = DeltaStats(
+                new=sum(d.new for d in deltas),
+                changed=sum(d.changed for d in deltas),
+                unchanged=sum(d.unchanged for d in deltas),
+            )
+            summary[attr] = asdict(totals)
+            logging.info(
+                "Delta %s: %d sin cambios, %d nuevos, %d modificados.",
+                label,
+                totals.unchanged,
+                totals.new,
+                totals.changed,
+            )
+
+    if sink.count:
+        logging.warning(
+            "Se registraron %d fallos en %d países (%s). Revisa el reporte: %s",
+            sink.count,
+            len(sink.countries),
+            ", ".join(f"{stage}={count}" for stage, count in sorted(sink.stages.items())),
+            sink.path,
+        )
+    else:
+        logging.info("Todos los lotes se procesaron sin errores reportados.")
+    if args.summary_file:
+        write_run_summary(args.summary_file, results, args.shard, sink)
+    summary["finished_at"] = time.time()
+    return summary
@@ -0,0 +1,1843 @@
+"""
+Sincronización de un país: descarga de Positiva, persistencia en lotes (bisección ante 5xx, lotes adaptativos,
+carriles en vuelo, coalescencia, cuarentena y lotes aparcados por el circuito) y el motor de hilos.
+"""
+
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import functools
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import requests
+
+from . import storage
+from .breaker import CircuitOpenError, circuit_breakers
+from .http_client import (
+    TokenSource,
+    build_session,
+    extract_http_context,
+    get_backend_session,
+    get_external_session,
+    post_batch,
+    response_json,
+    wait_for_slot,
+)
+from .metrics import metrics
+from .records import (
+    DeltaStats,
+    DepartmentRecord,
+    MunicipioBuffer,
+    MunicipioDedup,
+    MunicipioRecord,
+    build_departamento_payload,
+    collect_municipio_buffer,
+    collect_municipio_payloads,
+    department_identifiers,
+    department_payload_key,
+    diff_payloads,
+    extract_records,
+    merge_municipio_batches,
+    municipio_payload_key,
+    normalize_departments,
+    normalize_municipios,
+)
+from .storage import FailureSink, SyncFailure, cached_fetch
+
+
+POSITIVA_BASE_URL = "https://core-positiva-apis-pre-apicast-staging.apps.openshift4.positiva.gov.co"
+
+
+DEPARTMENTS_PATH = "/pdp/v1/positiva/scp/parametrica/consultaDivisionPolitica"
+
+
+MUNICIPIOS_PATH = "/ciudades/v1/positiva/scp/parametrica/ConsultaCiudades"
+
+
+DEPARTMENTS_ENDPOINT = "geodivision/actualizar-lote-departamento"
+
+
+MUNICIPIOS_ENDPOINT = "geodivision/actualizar-lote-municipios"
+
+
+ADAPTIVE_SUCCESS_STREAK = 3
+
+
+DEPARTMENT_DIFF_FIELDS = ("idDivisionPolitica", "nombreDepartamento", "nombreEstado")
+
+
+MUNICIPIO_DIFF_FIELDS = ("idDivisionPolitica", "nombreDepartamento", "nombreMunicipio", "divipola")
+
+
+def configure_positiva(base_url: str) -> None:
+    global POSITIVA_BASE_URL
+    POSITIVA_BASE_URL = base_url.rstrip("/")
+
+
+class FailureLog:
+    """Fallos de un `SyncResult`.
+
+    Con el reporte de la corrida abierto (`RunState.failure_sink`) cada fallo se entrega al escritor y aquí
+    solo queda el conteo (que es lo que consultan el journal y las métricas); sin él se conservan en memoria.
+    """
+
+    __slots__ = ("_count", "_items", "_lock")
+
+    def __init__(self) -> None:
+        self._count = 0
+        self._items: List[SyncFailure] = []
+        self._lock = threading.Lock()
+
+    def append(self, failure: SyncFailure) -> None:
+        with self._lock:
+            self._count += 1
+        sink = current_run().failure_sink
+        if sink is not None:
+            sink.put(failure)
+        else:
+            self._items.append(failure)
+
+    def extend(self, failures: Iterable[SyncFailure]) -> None:
+        for failure in failures:
+            self.append(failure)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[SyncFailure]:
+        return iter(list(self._items))
+
+
+@dataclass
+class SyncResult:
+    country_id: int
+    external_id: Optional[int]
+    departments_sent: int = 0
+    municipalities_sent: int = 0
+    failures: FailureLog = field(default_factory=FailureLog)
+    department_delta: Optional[DeltaStats] = None
+    municipality_delta: Optional[DeltaStats] = None
+
+
+@dataclass
+class BackendState:
+    """Registros que el backend ya tiene para un país, indexados igual que los payloads."""
+
+    departments: Dict[int, Dict]
+    municipios: Dict[Tuple[int, int], Dict]
+
+
+class AdaptiveBatchSizer:
+    """Tamaño de lote AIMD por endpoint, compartido entre hilos y países.
+
+    - Incremento aditivo (`step`) tras `ADAPTIVE_SUCCESS_STREAK` lotes completos exitosos por debajo
+      del presupuesto de latencia.
+    - Reducción multiplicativa (mitad) ante un 5xx o un POST que excede el presupuesto.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        step: int,
+        latency_budget: float,
+        learned: Optional[Dict[str, int]] = None,
+    ):
+        self.initial = initial
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.step = max(1, step)
+        self.latency_budget = latency_budget
+        self._sizes: Dict[str, int] = {
+            endpoint: self._clamp(size) for endpoint, size in (learned or {}).items()
+        }
+        self._streaks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _clamp(self, size: int) -> int:
+        return max(self.minimum, min(self.maximum, int(size)))
+
+    def current(self, endpoint: str) -> int:
+        with self._lock:
+            return self._sizes.get(endpoint, self._clamp(self.initial))
+
+    def record_success(self, endpoint: str, batch_len: int, elapsed: float) -> None:
+        with self._lock:
+            size = self._sizes.get(endpoint, self._clamp(self.initial))
+            if elapsed > self.latency_budget:
+                self._sizes[endpoint] = self._clamp(size // 2)
+                self._streaks[endpoint] = 0
+                return
+            # Solo los lotes del tamaño vigente demuestran que se puede crecer (no las colas ni mitades).
+            if batch_len < size:
+                return
+            streak = self._streaks.get(endpoint, 0) + 1
+            if streak >= ADAPTIVE_SUCCESS_STREAK:
+                self._sizes[endpoint] = self._clamp(size + self.step)
+                streak = 0
+            self._streaks[endpoint] = streak
+
+    def record_split(self, endpoint: str, batch_len: int) -> None:
+        with self._lock:
+            size = self._sizes.get(endpoint, self._clamp(self.initial))
+            self._sizes[endpoint] = self._clamp(min(size, batch_len) // 2)
+            self._streaks[endpoint] = 0
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._sizes)
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(self.snapshot(), handle, indent=2)
+
+    @staticmethod
+    def load(path: Optional[str]) -> Dict[str, int]:
+        if not path or not os.path.exists(path):
+            return {}
+        try:
+            with open(path, encoding="utf-8") as handle:
+                data = json.load(handle)
+        except (OSError, ValueError) as exc:
+            logging.warning("No se pudo leer %s (%s). Se usa --chunk-size.", path, exc)
+            return {}
+        return {str(endpoint): int(size) for endpoint, size in data.items()}
+
+
+batch_sizer: Optional[AdaptiveBatchSizer] = None
+
+
+def configure_batch_sizer(args: argparse.Namespace) -> Optional[AdaptiveBatchSizer]:
+    global batch_sizer
+    if not args.adaptive_batches:
+        batch_sizer = None
+        return None
+    learned = AdaptiveBatchSizer.load(args.batch_size_file)
+    batch_sizer = AdaptiveBatchSizer(
+        initial=args.chunk_size,
+        minimum=1,
+        maximum=args.max_chunk_size,
+        step=args.batch_step,
+        latency_budget=args.batch_latency_budget,
+        learned=learned,
+    )
+    if learned:
+        logging.info("Tamaños de lote aprendidos: %s.", learned)
+    return batch_sizer
+
+
+def current_chunk_size(endpoint_suffix: str, chunk_size: int) -> int:
+    return batch_sizer.current(endpoint_suffix) if batch_sizer is not None else chunk_size
+
+
+PERSIST_INFLIGHT_ENDPOINTS = {"departamentos": DEPARTMENTS_ENDPOINT, "municipios": MUNICIPIOS_ENDPOINT}
+
+
+def parse_persist_inflight(value: str) -> Dict[str, int]:
+    """`N` para ambos endpoints o `departamentos=N,municipios=M` (argparse type)."""
+    limits: Dict[str, int] = {}
+    try:
+        for part in value.split(","):
+            name, sep, count = part.strip().rpartition("=")
+            if not sep:
+                limits.update(dict.fromkeys(PERSIST_INFLIGHT_ENDPOINTS.values(), int(count)))
+            elif name in PERSIST_INFLIGHT_ENDPOINTS:
+                limits[PERSIST_INFLIGHT_ENDPOINTS[name]] = int(count)
+            else:
+                raise ValueError(name)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Valor inválido {value!r}: use N o departamentos=N,municipios=M."
+        ) from None
+    if any(count < 1 for count in limits.values()):
+        raise argparse.ArgumentTypeError(f"Valor inválido {value!r}: se requiere al menos 1 lote en vuelo.")
+    return limits
+
+
+persist_inflight: Dict[str, int] = {}
+
+
+# Carriles adicionales de todos los `persist_entities` del proceso (el hilo que llama corre el primero).
+persist_lanes: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def extra_persist_lanes(args: argparse.Namespace) -> int:
+    """Hilos adicionales de persistencia: un carril menos que el máximo por cada hilo de país."""
+    if args.engine == "scheduler" or args.coalesce:
+        return 0
+    return args.max_workers * (max((args.persist_inflight or {}).values(), default=1) - 1)
+
+
+def configure_persist_inflight(args: argparse.Namespace) -> Dict[str, int]:
+    global persist_inflight, persist_lanes
+    close_persist_lanes()
+    persist_inflight = {}
+    if not any(count > 1 for count in (args.persist_inflight or {}).values()):
+        return persist_inflight
+    if args.engine == "scheduler" or args.coalesce:
+        # Allí cada lote ya es una tarea del scheduler o un envío del coalescer, con su propio límite.
+        logging.info("--persist-inflight no aplica con --engine scheduler ni con --coalesce; se ignora.")
+        return persist_inflight
+    persist_inflight = dict(args.persist_inflight)
+    if args.engine != "async":
+        persist_lanes = concurrent.futures.ThreadPoolExecutor(
+            max_workers=extra_persist_lanes(args), thread_name_prefix="persist-lane"
+        )
+    logging.info(
+        "Lotes en vuelo por endpoint: %s.",
+        ", ".join(
+            f"{name}={persist_inflight_limit(endpoint)}" for name, endpoint in PERSIST_INFLIGHT_ENDPOINTS.items()
+        ),
+    )
+    return persist_inflight
+
+
+def close_persist_lanes() -> None:
+    global persist_lanes
+    if persist_lanes is not None:
+        persist_lanes.shutdown(wait=True)
+        persist_lanes = None
+
+
+def persist_inflight_limit(endpoint_suffix: str) -> int:
+    return persist_inflight.get(endpoint_suffix, 1)
+
+
+class BatchQueue:
+    """Cola de lotes para `persist_entities`.
+
+    Primero entrega las mitades re-encoladas por bisección (`appendleft`) y luego corta nuevos lotes
+    de `entities` con el tamaño vigente, de modo que los cambios del tamaño adaptativo se aplican
+    a los siguientes cortes.
+    """
+
+    def __init__(self, entities: Sequence[Dict], size_fn: Callable[[], int]):
+        self._entities = entities
+        self._size_fn = size_fn
+        self._cursor = 0
+        self._requeued: deque = deque()
+
+    def __bool__(self) -> bool:
+        return bool(self._requeued) or self._cursor < len(self._entities)
+
+    def appendleft(self, batch: List[Dict]) -> None:
+        self._requeued.appendleft(batch)
+
+    def popleft(self) -> List[Dict]:
+        if self._requeued:
+            return self._requeued.popleft()
+        size = max(1, self._size_fn())
+        batch = self._entities[self._cursor : self._cursor + size]
+        self._cursor += size
+        return batch
+
+    def drain(self) -> List[Dict]:
+        """Vacía la cola y devuelve los registros que quedaban sin enviar."""
+        remaining = [entity for batch in self._requeued for entity in batch]
+        remaining.extend(self._entities[self._cursor :])
+        self._requeued.clear()
+        self._cursor = len(self._entities)
+        return remaining
+
+
+def serialize_sample(payload: Optional[dict]) -> Optional[str]:
+    if not payload:
+        return None
+    try:
+        return json.dumps(payload, ensure_ascii=False)[:500]
+    except Exception:  # pragma: no cover - serialización defensiva
+        return str(payload)[:500]
+
+
+def journal_record_key(stage: str, payload: Dict) -> Optional[str]:
+    key = (department_payload_key if stage == "persist_departamentos" else municipio_payload_key)(payload)
+    if key is None:
+        return None
+    return ":".join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+
+
+def journal_pending(stage: str, country_id: int, entities: Sequence[Dict]) -> Sequence[Dict]:
+    journal = storage.sync_journal
+    if journal is None or not entities:
+        return entities
+    acked = journal.acked_keys(stage, country_id)
+    if not acked:
+        return entities
+    pending = [entity for entity in entities if journal_record_key(stage, entity) not in acked]
+    if len(pending) < len(entities):
+        logging.info(
+            "País %s: %d registros de %s ya confirmados en el journal.",
+            country_id,
+            len(entities) - len(pending),
+            stage,
+        )
+    return pending
+
+
+def journal_ack(stage: str, country_id: int, batch: List[Dict]) -> None:
+    journal = storage.sync_journal
+    if journal is None:
+        return
+    keys = [key for key in (journal_record_key(stage, entity) for entity in batch) if key is not None]
+    journal.ack_records(stage, country_id, keys)
+
+
+def journal_country_done(country_id: int) -> bool:
+    return storage.sync_journal is not None and storage.sync_journal.is_done("country", country_id)
+
+
+def journal_finish_country(result: SyncResult) -> None:
+    run = current_run()
+    if (
+        storage.sync_journal is not None
+        and not result.failures
+        and not run.parked_batches.has_country(result.country_id)
+        and not run.quarantine_deferred.has_country(result.country_id)
+    ):
+        storage.sync_journal.mark_done("country", result.country_id)
+
+
+def journal_fetched_municipios(country_id: int, division_id: int) -> Optional[List["MunicipioRecord"]]:
+    if storage.sync_journal is None:
+        return None
+    fetched = storage.sync_journal.load_unit("municipios_fetch", country_id, str(division_id))
+    return None if fetched is None else normalize_municipios(fetched)
+
+
+def journal_store_municipios(country_id: int, division_id: int, fetched: List["MunicipioRecord"]) -> None:
+    if storage.sync_journal is not None:
+        raw = [muni.raw for muni in fetched]
+        storage.sync_journal.mark_done("municipios_fetch", country_id, str(division_id), raw)
+
+
+def fetch_countries(backend_url: str, token: TokenSource) -> List[Dict]:
+    session = build_session(token)
+    url = f"{backend_url.rstrip('/')}/geodivision"
+    resp = session.get(url, timeout=30)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def fetch_departments_from_external(
+    external_id: int, token: TokenSource, throttle_ms: int
+) -> List[DepartmentRecord]:
+    def load() -> Any:
+        session = get_external_session(token)
+        url = f"{POSITIVA_BASE_URL}{DEPARTMENTS_PATH}"
+        wait_for_slot(url, throttle_ms)
+        with metrics.timed("fetch_departamentos"):
+            resp = session.get(
+                url,
+                params={"idPais": external_id},
+                timeout=60,
+            )
+        resp.raise_for_status()
+        return response_json(resp) or []
+
+    return normalize_departments(cached_fetch(DEPARTMENTS_PATH, external_id, 0, load))
+
+
+def fetch_municipios_from_external(
+    external_id: int, division_id: int, token: TokenSource, throttle_ms: int
+) -> List[MunicipioRecord]:
+    def load() -> Any:
+        session = get_external_session(token)
+        url = f"{POSITIVA_BASE_URL}{MUNICIPIOS_PATH}"
+        wait_for_slot(url, throttle_ms)
+        with metrics.timed("fetch_municipios"):
+            resp = session.get(
+                url,
+                params={"idPais": external_id, "idDivisionPolitica": division_id},
+                timeout=60,
+            )
+        resp.raise_for_status()
+        return response_json(resp) or []
+
+    return normalize_municipios(cached_fetch(MUNICIPIOS_PATH, external_id, division_id, load))
+
+
+class DepartmentPrefetcher:
+    """Descarga por adelantado las listas de departamentos de los próximos países.
+
+    Recorre los países en el orden en que los tomará el motor y mantiene como máximo `lookahead` listas
+    descargadas (o en curso) sin consumir; cada país que toma la suya libera un cupo. Si un país pide su
+    lista antes de que el prefetch la lance, la descarga él mismo y el prefetch la omite. Los errores de
+    la descarga se entregan al país, que los reporta igual que sin prefetch.
+
+    Las descargas van a un pool propio o, con `submit`, a otro ejecutor (el `WorkScheduler`, para que
+    cuenten dentro de `--max-workers`). Si el país pide una lista cuya descarga todavía no empezó, la
+    cancela y la descarga él mismo: así un hilo del scheduler nunca espera una tarea encolada detrás suyo.
+    """
+
+    def __init__(
+        self,
+        countries: Iterable[Dict],
+        token: TokenSource,
+        throttle_ms: int,
+        lookahead: int,
+        submit: Optional[Callable[[Callable[[], Any]], concurrent.futures.Future]] = None,
+    ):
+        self._order = [
+            country["idPositiva"]
+            for country in countries
+            if country.get("idPositiva") is not None and not journal_country_done(country["idPais"])
+        ]
+        self._token = token
+        self._throttle_ms = throttle_ms
+        self._slots = threading.Semaphore(max(1, lookahead))
+        self._futures: Dict[int, concurrent.futures.Future] = {}
+        self._claimed: Set[int] = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        if submit is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(max(1, lookahead), 4), thread_name_prefix="prefetch-departamentos"
+            )
+            submit = self._pool.submit
+        self._submit = submit
+        self._thread = threading.Thread(target=self._run, name="prefetch-departamentos", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        for external_id in self._order:
+            self._slots.acquire()
+            with self._lock:
+                if self._closed:
+                    return
+                if external_id in self._claimed:
+                    self._claimed.discard(external_id)
+                    self._slots.release()
+                    continue
+                self._futures[external_id] = self._submit(
+                    functools.partial(fetch_departments_from_external, external_id, self._token, self._throttle_ms)
+                )
+
+    def get(self, external_id: int) -> List[DepartmentRecord]:
+        with self._lock:
+            future = self._futures.pop(external_id, None)
+            if future is None:
+                self._claimed.add(external_id)
+        if future is not None and future.cancel():
+            self._slots.release()
+            future = None
+        if future is None:
+            metrics.inc("departments_prefetch_total", result="direct")
+            return fetch_departments_from_external(external_id, self._token, self._throttle_ms)
+        metrics.inc("departments_prefetch_total", result="ready" if future.done() else "waited")
+        try:
+            return future.result()
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            pending = list(self._futures.values())
+            self._futures.clear()
+        self._slots.release()
+        for future in pending:
+            future.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+def start_department_prefetch(
+    countries: List[Dict],
+    args: argparse.Namespace,
+    token: TokenSource,
+    submit: Optional[Callable[[Callable[[], Any]], concurrent.futures.Future]] = None,
+) -> None:
+    if args.prefetch_departments > 0:
+        current_run().department_prefetcher = DepartmentPrefetcher(
+            countries, token, args.throttle_ms, args.prefetch_departments, submit
+        )
+        logging.info("Prefetch de departamentos: hasta %d países por delante.", args.prefetch_departments)
+
+
+def stop_department_prefetch() -> None:
+    run = current_run()
+    if run.department_prefetcher is not None:
+        run.department_prefetcher.close()
+        run.department_prefetcher = None
+
+
+def fetch_country_departments(external_id: int, token: TokenSource, throttle_ms: int) -> List[DepartmentRecord]:
+    """Departamentos del país, tomados del prefetch si está activo."""
+    prefetcher = current_run().department_prefetcher
+    if prefetcher is None:
+        return fetch_departments_from_external(external_id, token, throttle_ms)
+    return prefetcher.get(external_id)
+
+
+def build_backend_state(departments_data: Any, municipios_data: Any) -> BackendState:
+    departments: Dict[int, Dict] = {}
+    for record in extract_records(departments_data):
+        key = department_payload_key(record)
+        if key is not None:
+            departments[key] = record
+    municipios: Dict[Tuple[int, int], Dict] = {}
+    for record in extract_records(municipios_data):
+        key = municipio_payload_key(record)
+        if key is not None:
+            municipios[key] = record
+    return BackendState(departments=departments, municipios=municipios)
+
+
+def backend_state_urls(
+    backend_url: str, country_id: int, external_id: int, state_paths: Tuple[str, str]
+) -> List[str]:
+    base = backend_url.rstrip("/")
+    ids = {"idPais": country_id, "idPositiva": external_id}
+    return [f"{base}/{path.format(**ids).lstrip('/')}" for path in state_paths]
+
+
+class BackendStateFailures:
+    """Lecturas fallidas del estado del backend en la corrida: un aviso visible y el resto en debug.
+
+    Cada país sin estado se envía completo; si el backend no expone el estado fallan todos, y un
+    aviso por país taparía el log sin decir nada nuevo. El total va a `backend_state_failures_total`
+    y al resumen de la corrida.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, country_id: int, external_id: int, exc: BaseException) -> None:
+        metrics.inc("backend_state_failures_total")
+        with self._lock:
+            self.count += 1
+            first = self.count == 1
+        if first:
+            logging.warning(
+                "--delta-sync degradado: no se pudo leer el estado del backend (país %s/%s: %s). Los países "
+                "sin estado se envían completos; el total queda en backend_state_failures_total.",
+                country_id,
+                external_id,
+                exc,
+            )
+        else:
+            logging.debug("País %s/%s: sin estado del backend (%s). Se enviará todo.", country_id, external_id, exc)
+
+
+def fetch_backend_state(
+    backend_url: str, token: TokenSource, country_id: int, external_id: int, state_paths: Tuple[str, str]
+) -> Optional[BackendState]:
+    """Lee el estado actual del país en el backend; si no es posible se devuelve None (sincronización completa)."""
+    session = get_backend_session(token)
+    payloads = []
+    try:
+        for url in backend_state_urls(backend_url, country_id, external_id, state_paths):
+            wait_for_slot(url)
+            resp = session.get(url, timeout=60)
+            resp.raise_for_status()
+            payloads.append(response_json(resp))
+    except (requests.RequestException, ValueError) as exc:
+        current_run().backend_state_failures.record(country_id, external_id, exc)
+        return None
+    return build_backend_state(*payloads)
+
+
+def batch_failure(
+    country_id: int,
+    external_id: int,
+    stage: str,
+    status: Optional[int],
+    message: str,
+    batch: List[Dict],
+    fingerprint: Optional[str] = None,
+) -> SyncFailure:
+    return SyncFailure(
+        country_id=country_id,
+        external_id=external_id,
+        stage=stage,
+        status=status,
+        message=message,
+        payload_size=len(batch),
+        sample=serialize_sample(batch[0]),
+        records=[journal_record_key(stage, payload) or serialize_sample(payload) or "" for payload in batch],
+        fingerprint=fingerprint,
+        payload=json.dumps(batch, ensure_ascii=False),
+    )
+
+
+def batch_error_outcome(exc: Exception, stage: str, batch_len: int) -> Tuple[bool, Optional[int], str]:
+    """Clasifica el error de un POST de lote: (partir y reintentar, status HTTP, mensaje del fallo)."""
+    if isinstance(exc, requests.HTTPError):
+        status, _ = extract_http_context(exc)
+        if status and 500 <= status < 600 and batch_len > 1:
+            return True, status, ""
+        return False, status, f"HTTP error en {stage}: {exc}"
+    if isinstance(exc, requests.RequestException):
+        return False, None, f"Request error en {stage}: {exc}"
+    return False, None, f"Error inesperado en {stage}: {exc}"
+
+
+def split_batch(batch: List[Any], pending: Any, stage: str) -> int:
+    """Re-encola las dos mitades del lote al frente de `pending` y devuelve el nuevo tamaño."""
+    metrics.inc("batch_splits_total", stage=stage)
+    new_size = max(1, len(batch) // 2)
+    right = batch[new_size:]
+    left = batch[:new_size]
+    if right:
+        pending.appendleft(right)
+    if left:
+        pending.appendleft(left)
+    return new_size
+
+
+def handle_batch_error(
+    exc: Exception,
+    batch: List[Dict],
+    pending: "BatchQueue",
+    stage: str,
+    country_id: int,
+    external_id: int,
+) -> Optional[SyncFailure]:
+    """Parte el lote ante un HTTP 5xx (re-encolando ambas mitades) o devuelve el fallo a registrar."""
+    should_split, status, message = batch_error_outcome(exc, stage, len(batch))
+    if should_split:
+        new_size = split_batch(batch, pending, stage)
+        logging.warning(
+            "País %s/%s: HTTP %s en %s con lote de %d registros. Reintentando con lotes de %d.",
+            country_id,
+            external_id,
+            status,
+            stage,
+            len(batch),
+            new_size,
+        )
+        return None
+    fingerprint = quarantine_isolated(exc, stage, country_id, status, message, batch)
+    return batch_failure(country_id, external_id, stage, status, message, batch, fingerprint)
+
+
+@dataclass
+class ParkedBatch:
+    endpoint_suffix: str
+    stage: str
+    backend_url: str
+    token: TokenSource
+    chunk_size: int
+    country_id: int
+    external_id: int
+    entities: List[Dict]
+
+
+class ParkedBatches:
+    """Registros apartados del flujo principal para enviarlos al final de la corrida.
+
+    Se usa para los lotes de endpoints con el circuito abierto (`retry_parked_batches`) y para los
+    registros en cuarentena (`send_quarantined_records`); mientras un país tenga registros apartados
+    no se marca como terminado en el journal.
+    """
+
+    def __init__(self, reason: str) -> None:
+        self.reason = reason
+        self._items: List[ParkedBatch] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def park(self, batch: ParkedBatch) -> None:
+        if not batch.entities:
+            return
+        with self._lock:
+            self._items.append(batch)
+        metrics.inc("records_parked_total", len(batch.entities), stage=batch.stage, reason=self.reason)
+        logging.warning(
+            "País %s/%s: %s en %s; %d registros aparcados para una pasada posterior.",
+            batch.country_id,
+            batch.external_id,
+            self.reason,
+            batch.stage,
+            len(batch.entities),
+        )
+
+    def has_country(self, country_id: int) -> bool:
+        with self._lock:
+            return any(item.country_id == country_id for item in self._items)
+
+    def take(self) -> List[ParkedBatch]:
+        with self._lock:
+            items, self._items = self._items, []
+        return items
+
+
+class RecordQuarantine:
+    """Registros envenenados: los que la bisección aisló en lotes de 1 y aun así recibieron un 5xx.
+
+    Cada registro se identifica por una huella de su contenido (etapa + JSON canónico), de modo que si
+    el origen lo corrige deja de coincidir. El archivo JSON (`--quarantine-file`) sobrevive entre
+    corridas; `hold_quarantined` los saca del flujo normal para enviarlos uno a uno al final (modo
+    defer) u omitirlos (modo skip).
+    """
+
+    def __init__(self, path: str, mode: str, entries: Optional[Dict[str, Dict]] = None):
+        self.path = path
+        self.mode = mode
+        self._entries: Dict[str, Dict] = dict(entries or {})
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    @staticmethod
+    def fingerprint(stage: str, payload: Dict) -> str:
+        canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(f"{stage}|{canonical}".encode("utf-8")).hexdigest()[:24]
+
+    def add(self, stage: str, country_id: int, status: Optional[int], message: str, payload: Dict) -> str:
+        fingerprint = self.fingerprint(stage, payload)
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                entry = self._entries[fingerprint] = {
+                    "stage": stage,
+                    "country_id": country_id,
+                    "record_key": journal_record_key(stage, payload),
+                    "payload": payload,
+                    "first_seen": now,
+                    "hits": 0,
+                }
+            entry.update(status=status, message=message[:500], last_seen=now, hits=entry["hits"] + 1)
+        metrics.inc("records_quarantined_total", stage=stage)
+        return fingerprint
+
+    def split(self, stage: str, entities: Sequence[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Separa `entities` en (enviar ahora, en cuarentena)."""
+        with self._lock:
+            if not self._entries:
+                return entities, []
+            known = set(self._entries)
+        clean: List[Dict] = []
+        held: List[Dict] = []
+        for entity in entities:
+            (held if self.fingerprint(stage, entity) in known else clean).append(entity)
+        return clean, held
+
+    def heal(self, stage: str, payload: Dict) -> None:
+        with self._lock:
+            self._entries.pop(self.fingerprint(stage, payload), None)
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = {"records": dict(self._entries)}
+        with open(self.path, "w", encoding="utf-8") as handle:
+            json.dump(data, handle, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def load(path: str) -> Dict[str, Dict]:
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, encoding="utf-8") as handle:
+                data = json.load(handle)
+        except (OSError, ValueError) as exc:
+            logging.warning("No se pudo leer la cuarentena %s (%s). Se inicia vacía.", path, exc)
+            return {}
+        return dict(data.get("records", {}))
+
+
+record_quarantine: Optional[RecordQuarantine] = None
+
+
+def configure_quarantine(args: argparse.Namespace) -> Optional[RecordQuarantine]:
+    global record_quarantine
+    if not args.quarantine_file:
+        record_quarantine = None
+        return None
+    record_quarantine = RecordQuarantine(
+        args.quarantine_file, args.quarantine_mode, RecordQuarantine.load(args.quarantine_file)
+    )
+    if len(record_quarantine):
+        logging.info(
+            "Cuarentena %s: %d registros conocidos (modo %s).",
+            args.quarantine_file,
+            len(record_quarantine),
+            args.quarantine_mode,
+        )
+    return record_quarantine
+
+
+def quarantine_isolated(
+    exc: Exception,
+    stage: str,
+    country_id: int,
+    status: Optional[int],
+    message: str,
+    batch: List[Dict],
+) -> Optional[str]:
+    """Pone en cuarentena el registro si la bisección lo aisló (lote de 1 con HTTP 5xx)."""
+    if record_quarantine is None or len(batch) != 1 or not isinstance(exc, requests.HTTPError):
+        return None
+    if not status or not 500 <= status < 600:
+        return None
+    fingerprint = record_quarantine.add(stage, country_id, status, message, batch[0])
+    logging.warning("País %s: registro %s de %s puesto en cuarentena.", country_id, fingerprint, stage)
+    return fingerprint
+
+
+def hold_quarantined(
+    endpoint_suffix: str,
+    stage: str,
+    backend_url: str,
+    token: TokenSource,
+    entities: Sequence[Dict],
+    country_id: int,
+    external_id: int,
+) -> Sequence[Dict]:
+    """Saca del flujo los registros en cuarentena: se difieren al final (defer) o se omiten (skip)."""
+    run = current_run()
+    if record_quarantine is None or not run.quarantine_holding:
+        return entities
+    entities, held = record_quarantine.split(stage, entities)
+    if not held:
+        return entities
+    if record_quarantine.mode == "skip":
+        metrics.inc("records_quarantine_skipped_total", len(held), stage=stage)
+        logging.warning(
+            "País %s/%s: %d registros de %s omitidos por estar en cuarentena.",
+            country_id,
+            external_id,
+            len(held),
+            stage,
+        )
+    else:
+        run.quarantine_deferred.park(
+            ParkedBatch(endpoint_suffix, stage, backend_url, token, 1, country_id, external_id, held)
+        )
+    return entities
+
+
+class _CoalesceTicket:
+    """Registros que un país envió al coalescer; resuelve su futuro cuando todos quedan confirmados o fallidos."""
+
+    def __init__(self, country_id: int, external_id: int, count: int, future: concurrent.futures.Future):
+        self.country_id = country_id
+        self.external_id = external_id
+        self.remaining = count
+        self.sent = 0
+        self.failures: List[SyncFailure] = []
+        self.future = future
+        self.lock = threading.Lock()
+
+
+class BatchCoalescer:
+    """Agrupa payloads de varios países en POSTs de tamaño completo hacia un endpoint `actualizar-lote-*`.
+
+    `submit` devuelve un `concurrent.futures.Future` con `(enviados, fallos)` del país, de modo que los
+    hilos pueden bloquear con `.result()` y el motor async puede esperar con `asyncio.wrap_future`.
+    Un hilo despachador corta lotes cuando el buffer alcanza el tamaño vigente o cuando el registro más
+    antiguo supera la ventana de espera; los POST se ejecutan en un pool pequeño con la misma bisección
+    ante 5xx, y cada fallo se reparte por país con su propio `SyncFailure`.
+    """
+
+    def __init__(
+        self,
+        endpoint_suffix: str,
+        stage: str,
+        backend_url: str,
+        token: TokenSource,
+        chunk_size: int,
+        window_seconds: float,
+        workers: int,
+    ):
+        self.endpoint_suffix = endpoint_suffix
+        self.stage = stage
+        self._backend_url = backend_url
+        self._url = f"{backend_url.rstrip('/')}/{endpoint_suffix.lstrip('/')}"
+        self._token = token
+        self._chunk_size = chunk_size
+        self._window = window_seconds
+        self._buffer: deque = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix=f"coalesce-{stage}"
+        )
+        self._thread = threading.Thread(target=self._run, name=f"coalesce-{stage}", daemon=True)
+        self._thread.start()
+
+    def submit(self, entities: Sequence[Dict], country_id: int, external_id: int) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        if not entities:
+            future.set_result((0, []))
+            return future
+        ticket = _CoalesceTicket(country_id, external_id, len(entities), future)
+        now = time.monotonic()
+        with self._cond:
+            self._buffer.extend((entity, ticket, now) for entity in entities)
+            self._cond.notify()
+        return future
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    size = current_chunk_size(self.endpoint_suffix, self._chunk_size)
+                    if not self._buffer:
+                        if self._closed:
+                            return
+                        self._cond.wait()
+                        continue
+                    age = time.monotonic() - self._buffer[0][2]
+                    if len(self._buffer) >= size or self._closed or age >= self._window:
+                        break
+                    self._cond.wait(self._window - age)
+                batch = [self._buffer.popleft() for _ in range(min(size, len(self._buffer)))]
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch: List[Tuple[Dict, _CoalesceTicket, float]]) -> None:
+        pending: deque = deque([batch])
+        while pending:
+            entries = pending.popleft()
+            payloads = [entry[0] for entry in entries]
+            try:
+                session = get_backend_session(self._token)
+                wait_for_slot(self._url)
+                started = time.monotonic()
+                with metrics.timed(self.stage):
+                    resp = post_batch(session, self._url, payloads)
+                resp.raise_for_status()
+            except CircuitOpenError:
+                remaining = entries + [entry for chunk in pending for entry in chunk]
+                pending.clear()
+                self._settle(remaining, None, None, parked=True)
+                continue
+            except Exception as exc:
+                should_split, status, message = batch_error_outcome(exc, self.stage, len(entries))
+                if should_split:
+                    new_size = split_batch(entries, pending, self.stage)
+                    logging.warning(
+                        "Lote combinado de %d registros (%d países): HTTP %s en %s. Reintentando con lotes de %d.",
+                        len(entries),
+                        len({id(entry[1]) for entry in entries}),
+                        status,
+                        self.stage,
+                        new_size,
+                    )
+                    if batch_sizer is not None:
+                        batch_sizer.record_split(self.endpoint_suffix, len(entries))
+                    continue
+                fingerprint = quarantine_isolated(
+                    exc, self.stage, entries[0][1].country_id, status, message, [entry[0] for entry in entries]
+                )
+                self._settle(entries, status, message, fingerprint=fingerprint)
+                continue
+            if batch_sizer is not None:
+                batch_sizer.record_success(self.endpoint_suffix, len(entries), time.monotonic() - started)
+            self._settle(entries, None, None)
+
+    def _settle(
+        self,
+        entries: List[Tuple[Dict, _CoalesceTicket, float]],
+        status: Optional[int],
+        message: Optional[str],
+        parked: bool = False,
+        fingerprint: Optional[str] = None,
+    ) -> None:
+        groups: Dict[int, Tuple[_CoalesceTicket, List[Dict]]] = {}
+        for payload, ticket, _ in entries:
+            groups.setdefault(id(ticket), (ticket, []))[1].append(payload)
+        for ticket, payloads in groups.values():
+            if parked:
+                current_run().parked_batches.park(
+                    ParkedBatch(
+                        self.endpoint_suffix,
+                        self.stage,
+                        self._backend_url,
+                        self._token,
+                        self._chunk_size,
+                        ticket.country_id,
+                        ticket.external_id,
+                        payloads,
+                    )
+                )
+            elif message is None:
+                try:
+                    journal_ack(self.stage, ticket.country_id, payloads)
+                except Exception:  # pragma: no cover - el journal no debe bloquear el futuro del país
+                    logging.exception("No se pudo registrar el lote en el journal.")
+            with ticket.lock:
+                if message is not None:
+                    ticket.failures.append(
+                        batch_failure(
+                            ticket.country_id, ticket.external_id, self.stage, status, message, payloads, fingerprint
+                        )
+                    )
+                elif not parked:
+                    ticket.sent += len(payloads)
+                ticket.remaining -= len(payloads)
+                done = ticket.remaining == 0
+            if done:
+                ticket.future.set_result((ticket.sent, ticket.failures))
+
+
+def configure_coalescers(args: argparse.Namespace, backend_token: TokenSource) -> None:
+    if not args.coalesce:
+        return
+    coalescers = current_run().coalescers
+    for endpoint_suffix, stage in (
+        (DEPARTMENTS_ENDPOINT, "persist_departamentos"),
+        (MUNICIPIOS_ENDPOINT, "persist_municipios"),
+    ):
+        coalescers[endpoint_suffix] = BatchCoalescer(
+            endpoint_suffix,
+            stage,
+            args.backend_url,
+            backend_token,
+            args.chunk_size,
+            args.coalesce_window_ms / 1000,
+            args.coalesce_workers,
+        )
+    logging.info(
+        "Coalescer de lotes activo (ventana %d ms, %d hilos por endpoint).",
+        args.coalesce_window_ms,
+        args.coalesce_workers,
+    )
+
+
+def close_coalescers() -> None:
+    coalescers = current_run().coalescers
+    for coalescer in coalescers.values():
+        coalescer.close()
+    coalescers.clear()
+
+
+class RunState:
+    """Lo que una corrida acumula: reporte de fallos, lotes aparcados, coalescers, prefetch y avisos.
+
+    `run_sync` abre uno nuevo (`begin_run`) y lo cierra al terminar (`end_run`), de modo que en `serve`
+    ninguna corrida hereda nada de la anterior. Lo configurado una vez por proceso (caché, journal,
+    circuitos, pool HTTP, tamaños de lote, cuarentena) no vive aquí. Fuera de una corrida rige uno vacío:
+    los fallos quedan en memoria y no hay coalescers ni prefetch.
+    """
+
+    def __init__(self, failure_sink: Optional[FailureSink] = None) -> None:
+        self.failure_sink = failure_sink
+        self.backend_state_failures = BackendStateFailures()
+        self.parked_batches = ParkedBatches("circuito abierto")
+        self.quarantine_deferred = ParkedBatches("registros en cuarentena")
+        # `send_quarantined_records` lo apaga para el envío individual del final de la corrida.
+        self.quarantine_holding = True
+        self.coalescers: Dict[str, BatchCoalescer] = {}
+        self.department_prefetcher: Optional[DepartmentPrefetcher] = None
+
+
+_run_state = RunState()
+
+
+def current_run() -> RunState:
+    return _run_state
+
+
+def begin_run() -> RunState:
+    global _run_state
+    end_run()
+    _run_state = RunState()
+    return _run_state
+
+
+def end_run() -> None:
+    """Detiene prefetch y coalescers de la corrida en curso y vacía su reporte de fallos."""
+    global _run_state
+    stop_department_prefetch()
+    close_coalescers()
+    if _run_state.failure_sink is not None:
+        _run_state.failure_sink.close()
+    _run_state = RunState()
+
+
+def retry_parked_batches(results: List[SyncResult], passes: int, max_wait: float) -> None:
+    """Reintenta los registros aparcados por circuitos abiertos y suma el resultado a cada país.
+
+    Las pasadas son secuenciales (para no volver a saturar un endpoint que se está recuperando). En cada
+    pasada se espera una sola vez por endpoint, lo que le quede de cooldown y como mucho `max_wait`, a
+    que el circuito deje pasar la petición de prueba; si no llega a tiempo, o la prueba falla y el circuito
+    se reabre, los lotes restantes de ese endpoint se vuelven a aparcar sin esperar. Lo que siga aparcado
+    después de `passes` pasadas se reporta como fallo.
+    """
+    parked_batches = current_run().parked_batches
+    if not parked_batches:
+        return
+    by_country = {result.country_id: result for result in results}
+    touched: Set[int] = set()
+    for attempt in range(1, passes + 1):
+        batches = parked_batches.take()
+        if not batches:
+            break
+        logging.info(
+            "Pasada %d/%d sobre lotes aparcados: %d registros de %d países.",
+            attempt,
+            passes,
+            sum(len(parked.entities) for parked in batches),
+            len({parked.country_id for parked in batches}),
+        )
+        ready: Set[str] = set()
+        reopened: Set[str] = set()
+        for parked in batches:
+            breaker = circuit_breakers.for_url(
+                f"{parked.backend_url.rstrip('/')}/{parked.endpoint_suffix.lstrip('/')}"
+            )
+            if breaker is not None:
+                if breaker.name not in ready and breaker.name not in reopened:
+                    wait = min(max_wait, breaker.remaining_cooldown())
+                    if wait > 0:
+                        logging.info(
+                            "Pasada %d/%d: circuito %s abierto; se espera %.1fs a la petición de prueba.",
+                            attempt,
+                            passes,
+                            breaker.name,
+                            wait,
+                        )
+                    if breaker.wait_until_ready(wait):
+                        ready.add(breaker.name)
+                    else:
+                        logging.warning(
+                            "Pasada %d/%d: el circuito %s sigue abierto; sus lotes quedan aparcados.",
+                            attempt,
+                            passes,
+                            breaker.name,
+                        )
+                        reopened.add(breaker.name)
+                if breaker.name in reopened:
+                    parked_batches.park(parked)
+                    continue
+            still_parked = len(parked_batches)
+            sent, failures = persist_entities(
+                parked.endpoint_suffix,
+                parked.stage,
+                parked.backend_url,
+                parked.token,
+                parked.entities,
+                parked.chunk_size,
+                parked.country_id,
+                parked.external_id,
+                inflight=1,
+            )
+            if breaker is not None and len(parked_batches) > still_parked:
+                reopened.add(breaker.name)
+            result = by_country.get(parked.country_id)
+            if result is None:
+                continue
+            touched.add(parked.country_id)
+            if parked.endpoint_suffix == DEPARTMENTS_ENDPOINT:
+                result.departments_sent += sent
+            else:
+                result.municipalities_sent += sent
+            result.failures.extend(failures)
+
+    for parked in parked_batches.take():
+        result = by_country.get(parked.country_id)
+        if result is not None:
+            result.failures.append(
+                batch_failure(
+                    parked.country_id,
+                    parked.external_id,
+                    parked.stage,
+                    None,
+                    f"Circuito abierto en {parked.stage}: registros aparcados sin enviar tras {passes} pasadas.",
+                    parked.entities,
+                )
+            )
+    for country_id in touched:
+        journal_finish_country(by_country[country_id])
+
+
+def send_quarantined_records(results: List[SyncResult]) -> None:
+    """Envía uno a uno, al final de la corrida, los registros diferidos por estar en cuarentena.
+
+    Los que el backend acepta salen de la cuarentena; los que vuelven a fallar con 5xx siguen en ella
+    (con `hits` incrementado) y quedan en el reporte con su huella.
+    """
+    run = current_run()
+    batches = run.quarantine_deferred.take()
+    if record_quarantine is None or not batches:
+        return
+    run.quarantine_holding = False
+    by_country = {result.country_id: result for result in results}
+    logging.info(
+        "Enviando %d registros en cuarentena de forma individual.",
+        sum(len(parked.entities) for parked in batches),
+    )
+    for parked in batches:
+        result = by_country.get(parked.country_id)
+        for payload in parked.entities:
+            sent, failures = persist_entities(
+                parked.endpoint_suffix,
+                parked.stage,
+                parked.backend_url,
+                parked.token,
+                [payload],
+                1,
+                parked.country_id,
+                parked.external_id,
+            )
+            if sent:
+                record_quarantine.heal(parked.stage, payload)
+            if result is None:
+                continue
+            if parked.endpoint_suffix == DEPARTMENTS_ENDPOINT:
+                result.departments_sent += sent
+            else:
+                result.municipalities_sent += sent
+            result.failures.extend(failures)
+    for country_id in {parked.country_id for parked in batches}:
+        if country_id in by_country:
+            journal_finish_country(by_country[country_id])
+
+
+def persist_entities(
+    endpoint_suffix: str,
+    stage: str,
+    backend_url: str,
+    token: TokenSource,
+    entities: Sequence[Dict],
+    chunk_size: int,
+    country_id: int,
+    external_id: int,
+    inflight: Optional[int] = None,
+) -> Tuple[int, List[SyncFailure]]:
+    entities = journal_pending(stage, country_id, entities)
+    entities = hold_quarantined(endpoint_suffix, stage, backend_url, token, entities, country_id, external_id)
+    if not entities:
+        return 0, []
+
+    coalescer = current_run().coalescers.get(endpoint_suffix)
+    if coalescer is not None:
+        return coalescer.submit(entities, country_id, external_id).result()
+
+    pending = BatchQueue(entities, lambda: current_chunk_size(endpoint_suffix, chunk_size))
+    lanes = inflight or persist_inflight_limit(endpoint_suffix)
+    if persist_lanes is None or lanes <= 1 or len(entities) <= current_chunk_size(endpoint_suffix, chunk_size):
+        return send_batches(
+            endpoint_suffix, stage, backend_url, token, pending, chunk_size, country_id, external_id
+        )
+
+    # Cada carril toma el siguiente lote de la cola compartida y lo envía con su propia cola local, así
+    # las mitades de una bisección se quedan en el carril que las produjo. El hilo que llama corre un
+    # carril y el resto va al pool compartido `persist_lanes`; si el pool está ocupado, los carriles que
+    # arrancan tarde encuentran la cola vacía y terminan enseguida.
+    lock = threading.Lock()
+
+    def take_batch() -> List[Dict]:
+        with lock:
+            return pending.popleft() if pending else []
+
+    def take_rest() -> List[Dict]:
+        with lock:
+            return pending.drain()
+
+    def lane() -> Tuple[int, List[SyncFailure]]:
+        sent = 0
+        failures: List[SyncFailure] = []
+        while True:
+            batch = take_batch()
+            if not batch:
+                return sent, failures
+            local = BatchQueue([], lambda: current_chunk_size(endpoint_suffix, chunk_size))
+            local.appendleft(batch)
+            lane_sent, lane_failures = send_batches(
+                endpoint_suffix,
+                stage,
+                backend_url,
+                token,
+                local,
+                chunk_size,
+                country_id,
+                external_id,
+                take_rest,
+            )
+            sent += lane_sent
+            failures.extend(lane_failures)
+
+    extra = [persist_lanes.submit(lane) for _ in range(lanes - 1)]
+    outcomes = [lane()] + [future.result() for future in extra]
+    return sum(sent for sent, _ in outcomes), [failure for _, failures in outcomes for failure in failures]
+
+
+def send_batches(
+    endpoint_suffix: str,
+    stage: str,
+    backend_url: str,
+    token: TokenSource,
+    pending: BatchQueue,
+    chunk_size: int,
+    country_id: int,
+    external_id: int,
+    take_rest: Callable[[], List[Dict]] = list,
+) -> Tuple[int, List[SyncFailure]]:
+    """Envía los lotes de `pending` uno tras otro; la bisección por 5xx re-encola en la misma cola.
+
+    Si el circuito del endpoint se abre se aparca lo que queda, incluido lo que devuelva `take_rest`
+    (el resto de la cola compartida cuando hay varios carriles en vuelo).
+    """
+    session = get_backend_session(token)
+    url = f"{backend_url.rstrip('/')}/{endpoint_suffix.lstrip('/')}"
+    sent = 0
+    failures: List[SyncFailure] = []
+
+    while pending:
+        batch = pending.popleft()
+        if not batch:
+            continue
+        wait_for_slot(url)
+        started = time.monotonic()
+        try:
+            try:
+                resp = post_batch(session, url, batch)
+            finally:
+                metrics.observe(stage, time.monotonic() - started)
+            resp.raise_for_status()
+            sent += len(batch)
+            journal_ack(stage, country_id, batch)
+            if batch_sizer is not None:
+                batch_sizer.record_success(endpoint_suffix, len(batch), time.monotonic() - started)
+        except CircuitOpenError:
+            current_run().parked_batches.park(
+                ParkedBatch(
+                    endpoint_suffix,
+                    stage,
+                    backend_url,
+                    token,
+                    chunk_size,
+                    country_id,
+                    external_id,
+                    batch + pending.drain() + take_rest(),
+                )
+            )
+            break
+        except Exception as exc:
+            failure = handle_batch_error(exc, batch, pending, stage, country_id, external_id)
+            if failure:
+                failures.append(failure)
+            elif batch_sizer is not None:
+                batch_sizer.record_split(endpoint_suffix, len(batch))
+
+    return sent, failures
+
+
+def persist_departments(
+    backend_url: str,
+    token: TokenSource,
+    departments: List[Dict],
+    chunk_size: int,
+    country_id: int,
+    external_id: int,
+) -> Tuple[int, List[SyncFailure]]:
+    return persist_entities(
+        DEPARTMENTS_ENDPOINT,
+        "persist_departamentos",
+        backend_url,
+        token,
+        departments,
+        chunk_size,
+        country_id,
+        external_id,
+    )
+
+
+def persist_municipios(
+    backend_url: str,
+    token: TokenSource,
+    municipios: Sequence[Dict],
+    chunk_size: int,
+    country_id: int,
+    external_id: int,
+) -> Tuple[int, List[SyncFailure]]:
+    return persist_entities(
+        MUNICIPIOS_ENDPOINT,
+        "persist_municipios",
+        backend_url,
+        token,
+        municipios,
+        chunk_size,
+        country_id,
+        external_id,
+    )
+
+
+class MunicipioStream:
+    """Persiste municipios a medida que llegan los departamentos (`--stream`).
+
+    Los productores encolan el lote de cada departamento en una cola acotada; un único hilo consumidor
+    acumula hasta `chunk_size` registros y los envía con `persist_municipios`, de modo que la descarga
+    y la escritura se solapan y la memoria queda acotada por el tamaño de la cola.
+    """
+
+    def __init__(
+        self,
+        backend_url: str,
+        token: TokenSource,
+        chunk_size: int,
+        country_id: int,
+        external_id: int,
+        queue_size: int,
+    ):
+        self._backend_url = backend_url
+        self._token = token
+        self._chunk_size = chunk_size
+        self._country_id = country_id
+        self._external_id = external_id
+        self._queue: "queue.Queue[Optional[List[Dict]]]" = queue.Queue(maxsize=max(1, queue_size))
+        self.received = 0
+        self.sent = 0
+        self.failures: List[SyncFailure] = []
+        self._thread = threading.Thread(
+            target=self._run, name=f"stream-municipios-{country_id}", daemon=True
+        )
+        self._thread.start()
+
+    def put(self, batch: List[Dict]) -> None:
+        if batch:
+            self._queue.put(batch)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _flush(self, batch: List[Dict]) -> None:
+        sent, failures = persist_municipios(
+            self._backend_url,
+            self._token,
+            batch,
+            self._chunk_size,
+            self._country_id,
+            self._external_id,
+        )
+        self.sent += sent
+        self.failures.extend(failures)
+
+    def _run(self) -> None:
+        buffer: List[Dict] = []
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self.received += len(item)
+            buffer.extend(item)
+            size = current_chunk_size(MUNICIPIOS_ENDPOINT, self._chunk_size)
+            while len(buffer) >= size:
+                self._flush(buffer[:size])
+                del buffer[:size]
+                size = current_chunk_size(MUNICIPIOS_ENDPOINT, self._chunk_size)
+        if buffer:
+            self._flush(buffer)
+
+
+def fetch_failure(
+    country_id: int,
+    external_id: int,
+    stage: str,
+    exc: requests.RequestException,
+    http_message: str,
+    network_message: str,
+    unit: Optional[str] = None,
+) -> SyncFailure:
+    if isinstance(exc, requests.HTTPError):
+        status, body = extract_http_context(exc)
+        return SyncFailure(
+            country_id=country_id,
+            external_id=external_id,
+            stage=stage,
+            status=status,
+            message=f"{http_message}: {exc}",
+            sample=body,
+            unit=unit,
+        )
+    return SyncFailure(
+        country_id=country_id,
+        external_id=external_id,
+        stage=stage,
+        status=None,
+        message=f"{network_message}: {exc}",
+        unit=unit,
+    )
+
+
+def log_delta(country_id: int, external_id: int, label: str, stats: DeltaStats) -> None:
+    logging.info(
+        "País %s/%s: %s sin cambios=%d, nuevos=%d, modificados=%d.",
+        country_id,
+        external_id,
+        label,
+        stats.unchanged,
+        stats.new,
+        stats.changed,
+    )
+
+
+def sync_country(
+    country: Dict,
+    backend_url: str,
+    backend_token: TokenSource,
+    external_token: TokenSource,
+    throttle_ms: int,
+    chunk_size: int,
+    municipality_workers: int,
+    backend_state_paths: Optional[Tuple[str, str]] = None,
+    stream_queue_size: int = 0,
+) -> SyncResult:
+    country_id = country["idPais"]
+    external_id = country.get("idPositiva")
+    result = SyncResult(country_id=country_id, external_id=external_id or 0)
+
+    if external_id is None:
+        logging.info("País %s no tiene idPositiva. Se omite.", country_id)
+        return result
+
+    if journal_country_done(country_id):
+        logging.info("País %s/%s: completado según el journal. Se omite.", country_id, external_id)
+        return result
+
+    logging.info("País %s/%s: descargando departamentos.", country_id, external_id)
+    try:
+        remote_departments = fetch_country_departments(external_id, external_token, throttle_ms)
+    except requests.RequestException as exc:
+        result.failures.append(
+            fetch_failure(
+                country_id,
+                external_id,
+                "fetch_departamentos",
+                exc,
+                "No se pudieron obtener departamentos",
+                "Error de red al obtener departamentos",
+            )
+        )
+        return result
+
+    if not remote_departments:
+        logging.info("País %s/%s: sin departamentos en API externa.", country_id, external_id)
+        return result
+
+    backend_state = (
+        fetch_backend_state(backend_url, backend_token, country_id, external_id, backend_state_paths)
+        if backend_state_paths is not None
+        else None
+    )
+
+    dept_payloads = [build_departamento_payload(external_id, dep) for dep in remote_departments]
+    if backend_state is not None:
+        dept_payloads, result.department_delta = diff_payloads(
+            dept_payloads, backend_state.departments, department_payload_key, DEPARTMENT_DIFF_FIELDS
+        )
+        log_delta(country_id, external_id, "departamentos", result.department_delta)
+    deps_sent, dep_failures = persist_departments(
+        backend_url,
+        backend_token,
+        dept_payloads,
+        chunk_size,
+        country_id,
+        external_id,
+    )
+    result.departments_sent = deps_sent
+    result.failures.extend(dep_failures)
+    logging.info(
+        "País %s/%s: %d/%d departamentos enviados (%d fallos).",
+        country_id,
+        external_id,
+        deps_sent,
+        len(dept_payloads),
+        len(dep_failures),
+    )
+
+    # Un buffer por departamento; `list.append` es atómico y la unión se hace una vez al final.
+    department_buffers: List[MunicipioBuffer] = []
+    delta_lock = threading.Lock()
+    failures_lock = threading.Lock()
+    stream: Optional[MunicipioStream] = None
+    stream_dedup = MunicipioDedup()
+    if stream_queue_size > 0:
+        stream = MunicipioStream(
+            backend_url, backend_token, chunk_size, country_id, external_id, stream_queue_size
+        )
+        if backend_state is not None:
+            result.municipality_delta = DeltaStats()
+
+    def process_department_municipios(dep: DepartmentRecord) -> None:
+        try:
+            division_id_int, remote_dep_id_int, dep_name = department_identifiers(dep)
+        except ValueError as exc:
+            failure = SyncFailure(
+                country_id=country_id,
+                external_id=external_id,
+                stage="fetch_municipios",
+                status=None,
+                message=str(exc),
+                sample=serialize_sample(dep.raw),
+            )
+            with failures_lock:
+                result.failures.append(failure)
+            return
+        fetched = journal_fetched_municipios(country_id, division_id_int)
+        try:
+            if fetched is None:
+                fetched = fetch_municipios_from_external(
+                    external_id,
+                    division_id_int,
+                    external_token,
+                    throttle_ms,
+                )
+                journal_store_municipios(country_id, division_id_int, fetched)
+        except requests.RequestException as exc:
+            failure = fetch_failure(
+                country_id,
+                external_id,
+                "fetch_municipios",
+                exc,
+                f"No se pudieron obtener municipios para departamento {remote_dep_id_int}",
+                f"Error de red obteniendo municipios para departamento {remote_dep_id_int}",
+                str(division_id_int),
+            )
+            with failures_lock:
+                result.failures.append(failure)
+            return
+
+        if stream is None:
+            department_buffers.append(
+                collect_municipio_buffer(external_id, division_id_int, remote_dep_id_int, dep_name, fetched)
+            )
+            return
+        local_batch = collect_municipio_payloads(
+            external_id,
+            division_id_int,
+            remote_dep_id_int,
+            dep_name,
+            fetched,
+        )
+        if not local_batch:
+            return
+        local_batch = stream_dedup.admit(remote_dep_id_int, local_batch)
+        if backend_state is not None:
+            with delta_lock:
+                local_batch, _ = diff_payloads(
+                    local_batch,
+                    backend_state.municipios,
+                    municipio_payload_key,
+                    MUNICIPIO_DIFF_FIELDS,
+                    result.municipality_delta,
+                )
+        stream.put(local_batch)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=municipality_workers) as muni_pool:
+            list(muni_pool.map(process_department_municipios, remote_departments))
+    finally:
+        if stream is not None:
+            stream.close()
+
+    if stream is not None:
+        mun_total, mun_sent, mun_failures = stream.received, stream.sent, stream.failures
+        if result.municipality_delta is not None:
+            log_delta(country_id, external_id, "municipios", result.municipality_delta)
+    else:
+        municipios_payload: Sequence[Dict] = merge_municipio_batches(external_id, department_buffers)
+        if backend_state is not None:
+            municipios_payload, result.municipality_delta = diff_payloads(
+                municipios_payload, backend_state.municipios, municipio_payload_key, MUNICIPIO_DIFF_FIELDS
+            )
+            log_delta(country_id, external_id, "municipios", result.municipality_delta)
+
+        mun_total = len(municipios_payload)
+        mun_sent, mun_failures = persist_municipios(
+            backend_url,
+            backend_token,
+            municipios_payload,
+            chunk_size,
+            country_id,
+            external_id,
+        )
+    result.municipalities_sent = mun_sent
+    result.failures.extend(mun_failures)
+    logging.info(
+        "País %s/%s: %d/%d municipios enviados (%d fallos).",
+        country_id,
+        external_id,
+        mun_sent,
+        mun_total,
+        len(mun_failures),
+    )
+    journal_finish_country(result)
+    return result
+
+
+def delta_state_paths(args: argparse.Namespace) -> Optional[Tuple[str, str]]:
+    if not args.delta_sync:
+        return None
+    return args.backend_departments_path, args.backend_municipios_path
+
+
+def timed_sync_country(*args: Any) -> SyncResult:
+    started = time.monotonic()
+    result = sync_country(*args)
+    metrics.record_country(result, time.monotonic() - started)
+    return result
+
+
+def run_threaded_engine(
+    targets: List[Dict],
+    args: argparse.Namespace,
+    backend_token: TokenSource,
+    external_token: TokenSource,
+) -> List[SyncResult]:
+    results: List[SyncResult] = []
+    start_department_prefetch(targets, args, external_token)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as pool:
+            futures = [
+                pool.submit(
+                    timed_sync_country,
+                    country,
+                    args.backend_url,
+                    backend_token,
+                    external_token,
+                    args.throttle_ms,
+                    args.chunk_size,
+                    args.municipality_workers,
+                    delta_state_paths(args),
+                    args.stream_queue_size if args.stream else 0,
+                )
+                for country in targets
+            ]
+
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    result = future.result()
+                    if result:
+                        results.append(result)
+                except Exception as exc:
+                    logging.exception("Error sincronizando país: %s", exc)
+    finally:
+        stop_department_prefetch()
+    return results
@@ -0,0 +1,838 @@
+"""
+Cliente HTTP compartido: pool de conexiones keep-alive, reintentos de urllib3, límites de tasa por host,
+tokens Bearer renovables, serialización/gzip de los lotes y el cliente aiohttp de `--engine async`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import gzip
+import json
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from requests.auth import AuthBase
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - dependencia opcional (--engine async)
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional (JSON rápido)
+    orjson = None
+
+from .breaker import circuit_breakers, is_breaker_failure
+from .metrics import metrics
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+DEFAULT_BACKEND_TOKEN_URL = "http://localhost:8081/api/v1/autenticacion/token/all/platforms"
+
+
+DEFAULT_EXTERNAL_TOKEN_URL = (
+    "https://keycloak-sso-app.apps.openshift4.positiva.gov.co/"
+    "auth/realms/apis-pre/protocol/openid-connect/token"
+)
+
+
+thread_local = threading.local()
+
+
+class TokenBucket:
+    """Token bucket seguro entre hilos y utilizable desde asyncio.
+
+    Cada `acquire` reserva un token bajo el lock (el saldo puede quedar negativo) y luego espera
+    fuera del lock el tiempo que falte, de modo que la tasa total queda acotada a `rate` por segundo
+    sin importar cuántos hilos o corrutinas compartan el bucket.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        if rate <= 0:
+            raise ValueError("La tasa del token bucket debe ser positiva.")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class RateLimiterRegistry:
+    """Token buckets indexados por host y puerto de la URL destino.
+
+    Se toma un token por intento enviado: el primero y cada reenvío (reintentos de urllib3 y de
+    `AsyncHttpClient`, el reintento tras un 401 y el reenvío sin gzip).
+    """
+
+    def __init__(self) -> None:
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    @staticmethod
+    def _key(scheme: str, host: Optional[str], port: Optional[int]) -> str:
+        return f"{host}:{port or (443 if scheme == 'https' else 80)}"
+
+    def configure(self, base_url: str, rate: float, burst: Optional[int] = None) -> TokenBucket:
+        bucket = TokenBucket(rate, burst if burst is not None else math.ceil(rate))
+        parts = urlsplit(base_url)
+        self._buckets[self._key(parts.scheme, parts.hostname, parts.port)] = bucket
+        return bucket
+
+    def for_url(self, url: str) -> Optional[TokenBucket]:
+        if not self._buckets:
+            return None
+        parts = urlsplit(url)
+        return self._buckets.get(self._key(parts.scheme, parts.hostname, parts.port))
+
+    def for_pool(self, pool: Any) -> Optional[TokenBucket]:
+        """Bucket del host de un connection pool de urllib3 (para los reintentos de `CountingRetry`)."""
+        if not self._buckets or pool is None:
+            return None
+        return self._buckets.get(self._key(pool.scheme, pool.host, pool.port))
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+rate_limiters = RateLimiterRegistry()
+
+
+class CountingRetry(Retry):
+    """`Retry` de urllib3 que contabiliza cada reintento en `metrics` y, tras el backoff, toma un token
+    del rate limiter del host antes del reenvío."""
+
+    rate_bucket: Optional[TokenBucket] = None
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        reason = str(response.status) if response is not None else type(error).__name__
+        host = _pool.host if _pool is not None else ""
+        metrics.inc("http_retries_total", host=host, reason=reason)
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        retry.rate_bucket = rate_limiters.for_pool(_pool)
+        return retry
+
+    def sleep(self, response=None) -> None:
+        super().sleep(response)
+        if self.rate_bucket is not None:
+            self.rate_bucket.acquire()
+
+
+def record_http_response(resp: requests.Response, *args: Any, **kwargs: Any) -> None:
+    host = urlsplit(resp.url).netloc
+    metrics.inc("http_requests_total", host=host, method=resp.request.method, status=resp.status_code)
+    body = resp.request.body
+    if body:
+        metrics.inc("http_bytes_sent_total", len(body), host=host)
+    metrics.inc("http_bytes_received_total", len(resp.content or b""), host=host)
+
+
+class TokenRefreshError(requests.RequestException):
+    """No fue posible renovar un token vencido."""
+
+
+def jwt_expiry(token: str) -> Optional[float]:
+    """Lee el claim `exp` (epoch) de un JWT sin validarlo; None si el token no es un JWT."""
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    try:
+        padded = parts[1] + "=" * (-len(parts[1]) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return float(claims["exp"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class TokenProvider:
+    """Token Bearer compartido por todas las sesiones que se renueva antes de vencer.
+
+    `loader` devuelve `(token, expires_in)`. La renovación es single-flight: un solo hilo llama
+    al loader y, mientras el token vigente no haya vencido, los demás siguen usándolo sin
+    esperar. Sin `expires_in` se usa el claim `exp` del JWT; si tampoco existe, el token solo
+    se renueva cuando el servidor responde 401 (`invalidate`).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        token: str,
+        expires_in: Optional[float] = None,
+        loader: Optional[Callable[[], Tuple[str, Optional[float]]]] = None,
+        refresh_margin: float = 60.0,
+    ):
+        self.name = name
+        self._loader = loader
+        self._refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._set(token, expires_in)
+
+    def _set(self, token: str, expires_in: Optional[float]) -> None:
+        self._token = token
+        self._expires_at = time.time() + float(expires_in) if expires_in else jwt_expiry(token)
+
+    @property
+    def refreshable(self) -> bool:
+        return self._loader is not None
+
+    def needs_refresh(self) -> bool:
+        if self._loader is None or self._expires_at is None:
+            return False
+        return time.time() >= self._expires_at - self._refresh_margin
+
+    def get(self) -> str:
+        if not self.needs_refresh():
+            return self._token
+        expired = time.time() >= self._expires_at
+        if not self._lock.acquire(blocking=expired):
+            return self._token
+        try:
+            if self.needs_refresh():
+                self._refresh("expiry")
+            return self._token
+        finally:
+            self._lock.release()
+
+    def invalidate(self, stale: str) -> str:
+        """Renueva tras un 401 con `stale`; si otro hilo ya lo renovó, devuelve el token nuevo."""
+        if self._loader is None:
+            return self._token
+        with self._lock:
+            if self._token == stale:
+                self._refresh("unauthorized")
+            return self._token
+
+    def _refresh(self, reason: str) -> None:
+        try:
+            token, expires_in = self._loader()
+        except RuntimeError as exc:
+            metrics.inc("token_refresh_failures_total", token=self.name)
+            if self._expires_at is not None and time.time() < self._expires_at and reason == "expiry":
+                logging.warning("No se pudo renovar el token %s; se usa el vigente: %s", self.name, exc)
+                return
+            raise TokenRefreshError(f"No se pudo renovar el token {self.name}: {exc}") from exc
+        self._set(token, expires_in)
+        metrics.inc("token_refresh_total", token=self.name, reason=reason)
+        if self._expires_at is not None:
+            remaining = self._expires_at - time.time()
+            logging.info("Token %s renovado (%s); vence en %.0fs.", self.name, reason, remaining)
+        else:
+            logging.info("Token %s renovado (%s).", self.name, reason)
+
+
+TokenSource = Union[str, TokenProvider]
+
+
+def resolve_token(token: TokenSource) -> str:
+    return token.get() if isinstance(token, TokenProvider) else token
+
+
+async def resolve_token_async(token: TokenSource) -> str:
+    """Como `resolve_token`, pero la renovación (bloqueante) corre fuera del event loop."""
+    if isinstance(token, TokenProvider) and token.needs_refresh():
+        return await asyncio.get_running_loop().run_in_executor(None, token.get)
+    return resolve_token(token)
+
+
+class BearerAuth(AuthBase):
+    """Inyecta el token vigente en cada petición y reintenta una vez tras un 401 con token renovado."""
+
+    def __init__(self, token: TokenSource):
+        self._token = token
+
+    def __call__(self, request: requests.PreparedRequest) -> requests.PreparedRequest:
+        request.headers["Authorization"] = f"Bearer {resolve_token(self._token)}"
+        if isinstance(self._token, TokenProvider) and self._token.refreshable:
+            request.register_hook("response", self._handle_401)
+        return request
+
+    def _handle_401(self, resp: requests.Response, **kwargs: Any) -> requests.Response:
+        if resp.status_code != 401:
+            return resp
+        stale = resp.request.headers.get("Authorization", "").removeprefix("Bearer ")
+        fresh = self._token.invalidate(stale)
+        if fresh == stale:
+            return resp
+        resp.content
+        resp.close()
+        retry = resp.request.copy()
+        retry.headers["Authorization"] = f"Bearer {fresh}"
+        new_resp = resp.connection.send(retry, **kwargs)
+        new_resp.history.append(resp)
+        new_resp.request = retry
+        return new_resp
+
+
+class CircuitBreakerAdapter(HTTPAdapter):
+    """HTTPAdapter que consulta el circuito del endpoint antes de enviar y registra el resultado.
+
+    El resultado se registra una vez por petición, después de los reintentos de urllib3: con
+    `--status-retries 0` cada 5xx/429 cuenta como un fallo; si no, cuenta cada petición que los agotó.
+    También toma el token del rate limiter del host: todo envío pasa por aquí, incluido el reenvío
+    de `BearerAuth` tras un 401 (los reintentos de urllib3 los toma `CountingRetry`).
+    """
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        breaker = circuit_breakers.for_url(request.url or "")
+        if breaker is None:
+            wait_for_rate_limit(request.url or "")
+            return super().send(request, **kwargs)
+        breaker.before_call(circuit_breakers.max_wait)
+        try:
+            wait_for_rate_limit(request.url or "")
+        except BaseException:
+            breaker.release()
+            raise
+        try:
+            resp = super().send(request, **kwargs)
+        except Exception as exc:
+            if is_breaker_failure(exc=exc):
+                breaker.record_failure()
+            else:
+                breaker.release()
+            raise
+        if is_breaker_failure(resp.status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return resp
+
+
+class SharedConnectionPool:
+    """Un único `CircuitBreakerAdapter` (y su PoolManager de urllib3) para todas las sesiones del proceso.
+
+    Las sesiones siguen siendo una por hilo (`requests.Session` no es thread-safe), pero todas montan
+    este adaptador, así que una conexión keep-alive abierta por un hilo la reutiliza cualquier otro y el
+    handshake TLS se paga una vez por conexión, no por hilo. `pool_maxsize` es el máximo de conexiones
+    ociosas que se conservan por host; se dimensiona con la concurrencia (`configure_http_pool`).
+    """
+
+    # Pools por host que se conservan (backend, Positiva y los endpoints de token).
+    HOST_POOLS = 16
+
+    def __init__(self, maxsize: int = 10):
+        self.maxsize = maxsize
+        self.status_retries = 5
+        self.backoff = 0.5
+        self._adapter: Optional[CircuitBreakerAdapter] = None
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize: int, status_retries: int = 5, backoff: float = 0.5) -> None:
+        with self._lock:
+            self.maxsize = max(1, maxsize)
+            self.status_retries = max(0, status_retries)
+            self.backoff = backoff
+            previous, self._adapter = self._adapter, None
+        if previous is not None:
+            previous.close()
+
+    def adapter(self) -> CircuitBreakerAdapter:
+        with self._lock:
+            if self._adapter is None:
+                retries = CountingRetry(
+                    total=max(5, self.status_retries),
+                    read=5,
+                    connect=5,
+                    status=self.status_retries,
+                    backoff_factor=self.backoff,
+                    status_forcelist=RETRY_STATUSES if self.status_retries else (),
+                    allowed_methods=("GET", "POST"),
+                    # Al agotar los reintentos se devuelve la última respuesta en lugar de RetryError:
+                    # `raise_for_status` la convierte en HTTPError y un 5xx de lote se bisecta y, aislado,
+                    # va a cuarentena igual que los status que no se reintentan.
+                    raise_on_status=False,
+                )
+                self._adapter = CircuitBreakerAdapter(
+                    pool_connections=self.HOST_POOLS, pool_maxsize=self.maxsize, max_retries=retries
+                )
+            return self._adapter
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Por host: peticiones enviadas, conexiones abiertas y peticiones que reutilizaron una conexión."""
+        with self._lock:
+            adapter = self._adapter
+        if adapter is None:
+            return {}
+        pools = adapter.poolmanager.pools
+        stats: Dict[str, Dict[str, int]] = {}
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.host}:{pool.port}" if pool.port else pool.host
+            entry = stats.setdefault(host, {"requests": 0, "connections": 0, "reused": 0})
+            entry["requests"] += pool.num_requests
+            entry["connections"] += pool.num_connections
+            entry["reused"] += max(0, pool.num_requests - pool.num_connections)
+        return stats
+
+
+http_pool = SharedConnectionPool()
+
+
+_http_pool_reported: Dict[str, Tuple[int, int]] = {}
+
+
+def report_http_pool() -> None:
+    for host, stats in sorted(http_pool.stats().items()):
+        # Los contadores de urllib3 son acumulados; a las métricas solo se suma lo nuevo desde el último reporte.
+        opened, reused = _http_pool_reported.get(host, (0, 0))
+        metrics.inc("http_connections_opened_total", stats["connections"] - opened, host=host)
+        metrics.inc("http_connections_reused_total", stats["reused"] - reused, host=host)
+        _http_pool_reported[host] = (stats["connections"], stats["reused"])
+        logging.info(
+            "Conexiones HTTP %s: %d peticiones, %d conexiones nuevas, %d reutilizadas (%.0f%%).",
+            host,
+            stats["requests"],
+            stats["connections"],
+            stats["reused"],
+            100.0 * stats["reused"] / stats["requests"] if stats["requests"] else 0.0,
+        )
+
+
+def build_session(token: TokenSource) -> requests.Session:
+    session = requests.Session()
+    adapter = http_pool.adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.auth = BearerAuth(token)
+    session.headers.update({"Accept": "application/json"})
+    session.hooks["response"].append(record_http_response)
+    return session
+
+
+def encode_json(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_json(raw: bytes, text: Optional[str] = None) -> Any:
+    """Decodifica con orjson cuando está instalado; si falla (p. ej. cuerpo no UTF-8) usa `json`."""
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text if text is not None else raw)
+
+
+def response_json(resp: requests.Response) -> Any:
+    """Equivalente a `resp.json()` pero con el parser rápido cuando está disponible."""
+    if orjson is not None and resp.content:
+        try:
+            return orjson.loads(resp.content)
+        except orjson.JSONDecodeError:
+            pass
+    return resp.json()
+
+
+GZIP_FALLBACK_STATUSES = (400, 415, 422)
+
+
+class BodyEncoder:
+    """Serializa los lotes con `encode_json` y los comprime con gzip (`Content-Encoding: gzip`).
+
+    Si un POST comprimido recibe uno de `GZIP_FALLBACK_STATUSES`, el lote se reenvía sin comprimir; si
+    ese reenvío funciona, el backend no acepta gzip y el host queda en JSON plano el resto de la
+    corrida. Si también falla, el error es del lote y gzip sigue activo.
+    """
+
+    def __init__(self, level: int = 5):
+        self.level = level
+        self._plain_hosts: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def encode(self, url: str, payload: Any) -> Tuple[bytes, Dict[str, str]]:
+        raw = encode_json(payload)
+        host = urlsplit(url).netloc
+        metrics.inc("request_body_raw_bytes_total", len(raw), host=host)
+        headers = {"Content-Type": "application/json"}
+        with self._lock:
+            plain = host in self._plain_hosts
+        if plain:
+            return raw, headers
+        headers["Content-Encoding"] = "gzip"
+        return gzip.compress(raw, compresslevel=self.level), headers
+
+    def plain(self, payload: Any) -> Tuple[bytes, Dict[str, str]]:
+        return encode_json(payload), {"Content-Type": "application/json"}
+
+    def record_fallback(self, url: str, plain_succeeded: bool) -> None:
+        if not plain_succeeded:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host in self._plain_hosts:
+                return
+            self._plain_hosts.add(host)
+        metrics.inc("gzip_fallbacks_total", host=host)
+        logging.warning("El backend %s rechazó cuerpos gzip; se envía JSON sin comprimir.", host)
+
+
+body_encoder: Optional[BodyEncoder] = None
+
+
+def configure_body_encoder(args: argparse.Namespace) -> Optional[BodyEncoder]:
+    global body_encoder
+    body_encoder = BodyEncoder(args.gzip_level) if args.gzip_requests else None
+    if body_encoder is not None:
+        logging.info(
+            "Cuerpos de lote comprimidos con gzip (nivel %d, serializador %s).",
+            args.gzip_level,
+            "orjson" if orjson is not None else "json",
+        )
+    return body_encoder
+
+
+def post_batch(session: requests.Session, url: str, batch: List[Dict], timeout: float = 120) -> requests.Response:
+    """POST de un lote serializado con `encode_json`.
+
+    Con `--gzip-requests` usa `body_encoder` y su reenvío sin comprimir.
+    """
+    if body_encoder is None:
+        headers = {"Content-Type": "application/json"}
+        return session.post(url, data=encode_json(batch), headers=headers, timeout=timeout)
+    body, headers = body_encoder.encode(url, batch)
+    resp = session.post(url, data=body, headers=headers, timeout=timeout)
+    if "Content-Encoding" in headers and resp.status_code in GZIP_FALLBACK_STATUSES:
+        body, headers = body_encoder.plain(batch)
+        resp = session.post(url, data=body, headers=headers, timeout=timeout)
+        body_encoder.record_fallback(url, resp.ok)
+    return resp
+
+
+def throttle(delay_ms: int) -> None:
+    if delay_ms > 0:
+        time.sleep(delay_ms / 1000)
+
+
+def wait_for_slot(url: str, throttle_ms: int = 0) -> None:
+    """Retardo fijo previo a una petición cuando el host no tiene token bucket.
+
+    Con bucket el turno se toma por intento al enviar (`CircuitBreakerAdapter`, `AsyncHttpClient`).
+    """
+    if rate_limiters.for_url(url) is None:
+        throttle(throttle_ms)
+
+
+async def wait_for_slot_async(url: str, throttle_ms: int = 0) -> None:
+    if throttle_ms > 0 and rate_limiters.for_url(url) is None:
+        await asyncio.sleep(throttle_ms / 1000)
+
+
+def wait_for_rate_limit(url: str) -> None:
+    bucket = rate_limiters.for_url(url)
+    if bucket is not None:
+        bucket.acquire()
+
+
+async def wait_for_rate_limit_async(url: str) -> None:
+    bucket = rate_limiters.for_url(url)
+    if bucket is not None:
+        await bucket.acquire_async()
+
+
+def extract_http_context(error: Exception) -> Tuple[Optional[int], Optional[str]]:
+    response = getattr(error, "response", None)
+    status = None
+    body = None
+    if response is not None:
+        try:
+            status = response.status_code
+            body = (response.text or "")[:500]
+        except Exception:  # pragma: no cover - acceso defensivo
+            body = "<cuerpo no disponible>"
+    return status, body
+
+
+def obtain_backend_token(token_url: str, username: str, password: str) -> Tuple[str, Optional[float]]:
+    """Devuelve `(accessToken, expires_in)`; `expires_in` es None si la respuesta no lo informa."""
+    logging.info("Solicitando token del backend en %s para el usuario %s.", token_url, username)
+    payload = {"username": username, "password": password}
+    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    try:
+        resp = requests.post(token_url, json=payload, headers=headers, timeout=30)
+        resp.raise_for_status()
+    except requests.RequestException as exc:
+        raise RuntimeError(f"No fue posible obtener el token del backend: {exc}") from exc
+
+    try:
+        data = resp.json()
+    except ValueError as exc:
+        raise RuntimeError("La respuesta del backend no contiene JSON válido.") from exc
+
+    token_section = (
+        data.get("tokenIDP")
+        or data.get("TokenIDP")
+        or data.get("tokenIdp")
+        or data.get("token_idp")
+    )
+    access_token = None
+    expires_in = None
+    if isinstance(token_section, dict):
+        access_token = (
+            token_section.get("accessToken")
+            or token_section.get("AccessToken")
+            or token_section.get("access_token")
+        )
+        expires_in = (
+            token_section.get("expiresIn")
+            or token_section.get("ExpiresIn")
+            or token_section.get("expires_in")
+        )
+    elif isinstance(token_section, str):
+        access_token = token_section
+
+    if not access_token:
+        access_token = (
+            data.get("accessToken")
+            or data.get("AccessToken")
+            or data.get("access_token")
+            or data.get("token")
+        )
+
+    if not access_token:
+        raise RuntimeError("No se encontró el accessToken dentro de la respuesta del backend.")
+    if expires_in is None:
+        expires_in = data.get("expiresIn") or data.get("expires_in")
+
+    logging.info("Token del backend obtenido correctamente.")
+    return access_token, float(expires_in) if expires_in else None
+
+
+def obtain_external_token(
+    token_url: str,
+    client_id: str,
+    client_secret: str,
+    cookie: Optional[str] = None,
+) -> Tuple[str, Optional[float]]:
+    """Devuelve `(access_token, expires_in)` del flujo client_credentials."""
+    logging.info("Solicitando token externo en %s para el client_id %s.", token_url, client_id)
+    headers = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
+    if cookie:
+        headers["Cookie"] = cookie
+
+    payload = {
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "grant_type": "client_credentials",
+    }
+    try:
+        resp = requests.post(token_url, data=payload, headers=headers, timeout=30)
+        resp.raise_for_status()
+    except requests.RequestException as exc:
+        raise RuntimeError(f"No fue posible obtener el token externo: {exc}") from exc
+
+    try:
+        data = resp.json()
+    except ValueError as exc:
+        raise RuntimeError("La respuesta del servidor de autenticación externo no es JSON válida.") from exc
+
+    token = data.get("access_token")
+    if not token:
+        raise RuntimeError("No se encontró el campo access_token en la respuesta externa.")
+
+    logging.info("Token externo obtenido correctamente.")
+    expires_in = data.get("expires_in")
+    return token, float(expires_in) if expires_in else None
+
+
+def get_backend_session(token: TokenSource) -> requests.Session:
+    if not hasattr(thread_local, "backend_session"):
+        session = build_session(token)
+        session.headers.update({"Content-Type": "application/json"})
+        thread_local.backend_session = session
+    return thread_local.backend_session
+
+
+def get_external_session(token: TokenSource) -> requests.Session:
+    if not hasattr(thread_local, "external_session"):
+        thread_local.external_session = build_session(token)
+    return thread_local.external_session
+
+
+@dataclass
+class AsyncResponseSnapshot:
+    """Vista mínima de una respuesta aiohttp compatible con `extract_http_context`."""
+
+    status_code: int
+    text: str
+
+
+class AsyncHttpClient:
+    """Cliente aiohttp con la misma política de reintentos que `build_session`.
+
+    Los errores se traducen a excepciones de `requests` para que el motor async reutilice
+    exactamente el mismo manejo de fallos (`fetch_failure`, `handle_batch_error`).
+    """
+
+    def __init__(
+        self,
+        session: "aiohttp.ClientSession",
+        retries: int = 5,
+        backoff_factor: float = 0.5,
+        status_retries: int = 5,
+    ):
+        self._session = session
+        self._retries = retries
+        self._backoff_factor = backoff_factor
+        # Igual que `SharedConnectionPool.status_retries` (`--status-retries`).
+        self._status_retries = status_retries
+        self._retry_statuses = RETRY_STATUSES if status_retries > 0 else ()
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        if attempt == 0:
+            return 0.0
+        return min(120.0, self._backoff_factor * (2 ** attempt))
+
+    async def request_json(
+        self,
+        method: str,
+        url: str,
+        token: TokenSource,
+        *,
+        params: Optional[Dict] = None,
+        payload: Any = None,
+        timeout: float = 60,
+    ) -> Any:
+        breaker = circuit_breakers.for_url(url)
+        if breaker is None:
+            return await self._request_json(method, url, token, params, payload, timeout)
+        # Igual que CircuitBreakerAdapter: un resultado por petición (sin reintentos por status).
+        await breaker.before_call_async(circuit_breakers.max_wait)
+        try:
+            result = await self._request_json(method, url, token, params, payload, timeout)
+        except requests.HTTPError as exc:
+            status, _ = extract_http_context(exc)
+            if is_breaker_failure(status):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        except BaseException as exc:
+            if is_breaker_failure(exc=exc):
+                breaker.record_failure()
+            else:
+                breaker.release()
+            raise
+        breaker.record_success()
+        return result
+
+    async def _request_json(
+        self,
+        method: str,
+        url: str,
+        token: TokenSource,
+        params: Optional[Dict],
+        payload: Any,
+        timeout: float,
+    ) -> Any:
+        headers = {"Accept": "application/json"}
+        body = None
+        if payload is not None:
+            if body_encoder is not None:
+                body, encoding_headers = body_encoder.encode(url, payload)
+            else:
+                body, encoding_headers = encode_json(payload), {"Content-Type": "application/json"}
+            headers.update(encoding_headers)
+        gzip_fallback = False
+        host = urlsplit(url).netloc
+        attempt = 0
+        reauthenticated = False
+        while True:
+            bearer = await resolve_token_async(token)
+            headers["Authorization"] = f"Bearer {bearer}"
+            # Un token por intento, como `CircuitBreakerAdapter` y `CountingRetry` en el motor threads.
+            await wait_for_rate_limit_async(url)
+            try:
+                async with self._session.request(
+                    method,
+                    url,
+                    params=params,
+                    data=body,
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=timeout),
+                ) as resp:
+                    status = resp.status
+                    raw = await resp.read()
+                    text = raw.decode(resp.get_encoding() if raw else "utf-8", errors="replace")
+                    retry_after = resp.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if attempt < self._retries:
+                    metrics.inc("http_retries_total", host=host, reason=type(exc).__name__)
+                    await asyncio.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+                raise requests.ConnectionError(f"{method} {url}: {exc!r}") from exc
+
+            if status in self._retry_statuses and attempt < self._status_retries:
+                metrics.inc("http_retries_total", host=host, reason=str(status))
+            else:
+                metrics.inc("http_requests_total", host=host, method=method, status=status)
+                if body:
+                    metrics.inc("http_bytes_sent_total", len(body), host=host)
+                metrics.inc("http_bytes_received_total", len(raw), host=host)
+            if gzip_fallback:
+                gzip_fallback = False
+                body_encoder.record_fallback(url, status < 400)
+            if "Content-Encoding" in headers and status in GZIP_FALLBACK_STATUSES:
+                # Mismo criterio que post_batch: reenvío único sin comprimir.
+                body, encoding_headers = body_encoder.plain(payload)
+                headers.pop("Content-Encoding")
+                headers.update(encoding_headers)
+                gzip_fallback = True
+                continue
+            if status == 401 and isinstance(token, TokenProvider) and token.refreshable and not reauthenticated:
+                # Mismo criterio que BearerAuth: un único reintento con el token renovado.
+                reauthenticated = True
+                fresh = await asyncio.get_running_loop().run_in_executor(None, token.invalidate, bearer)
+                if fresh != bearer:
+                    continue
+            if status in self._retry_statuses and attempt < self._status_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+                attempt += 1
+                continue
+            # Agotados los reintentos la última respuesta se reporta como HTTPError (igual que
+            # `raise_on_status=False` en urllib3), así que un 5xx de lote se bisecta.
+            if status >= 400:
+                raise requests.HTTPError(
+                    f"{status} Error for url: {url}",
+                    response=AsyncResponseSnapshot(status, text),
+                )
+            try:
+                return decode_json(raw, text) if text else None
+            except ValueError as exc:
+                raise requests.exceptions.InvalidJSONError(f"Respuesta no JSON desde {url}") from exc
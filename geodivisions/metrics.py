@@ -0,0 +1,169 @@
+"""
+Métricas de la sincronización: histogramas de latencia por etapa, contadores HTTP y throughput por país,
+exportables en formato texto de Prometheus (`--metrics-file`) o JSON (`--metrics-json`).
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from .core import SyncResult
+
+
+class SyncMetrics:
+    """Métricas del barrido, seguras entre hilos, exportables a Prometheus (texto) y JSON."""
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+        self._maxima: Dict[str, float] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._countries: List[Dict[str, Any]] = []
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            buckets = self._buckets.setdefault(stage, [0] * (len(self.LATENCY_BUCKETS) + 1))
+            for index, bound in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+                    break
+            else:
+                buckets[-1] += 1
+            self._sums[stage] = self._sums.get(stage, 0.0) + seconds
+            self._maxima[stage] = max(self._maxima.get(stage, 0.0), seconds)
+
+    @contextlib.contextmanager
+    def timed(self, stage: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - started)
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def start_run(self) -> None:
+        """Descarta las filas por país de la corrida anterior (modo `serve`); contadores e histogramas siguen acumulando."""
+        with self._lock:
+            self._countries.clear()
+
+    def record_country(self, result: "SyncResult", elapsed: float) -> None:
+        records = result.departments_sent + result.municipalities_sent
+        with self._lock:
+            self._countries.append(
+                {
+                    "country_id": result.country_id,
+                    "external_id": result.external_id,
+                    "seconds": round(elapsed, 3),
+                    "records_sent": records,
+                    "records_per_second": round(records / elapsed, 2) if elapsed > 0 else 0.0,
+                    "failures": len(result.failures),
+                }
+            )
+
+    def percentile(self, stage: str, quantile: float) -> Optional[float]:
+        """Estimación por buckets (cota superior del bucket que alcanza el cuantil)."""
+        with self._lock:
+            buckets = list(self._buckets.get(stage, []))
+            maximum = self._maxima.get(stage)
+        total = sum(buckets)
+        if not total:
+            return None
+        threshold = quantile * total
+        cumulative = 0
+        for index, count in enumerate(buckets):
+            cumulative += count
+            if cumulative >= threshold:
+                return self.LATENCY_BUCKETS[index] if index < len(self.LATENCY_BUCKETS) else maximum
+        return maximum
+
+    def summary(self) -> Dict[str, Any]:
+        stages = {}
+        with self._lock:
+            stage_names = sorted(self._buckets)
+            counters = dict(self._counters)
+            countries = list(self._countries)
+        for stage in stage_names:
+            with self._lock:
+                count = sum(self._buckets[stage])
+                total = self._sums[stage]
+                maximum = self._maxima[stage]
+            stages[stage] = {
+                "count": count,
+                "sum_seconds": round(total, 3),
+                "avg_seconds": round(total / count, 4) if count else 0.0,
+                "p50_seconds": self.percentile(stage, 0.5),
+                "p95_seconds": self.percentile(stage, 0.95),
+                "max_seconds": round(maximum, 4),
+            }
+        counter_rows = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(counters.items())
+        ]
+        return {"stages": stages, "counters": counter_rows, "countries": countries}
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            buckets = {stage: list(values) for stage, values in self._buckets.items()}
+            sums = dict(self._sums)
+            counters = dict(self._counters)
+            countries = list(self._countries)
+        metric = "geodivision_stage_latency_seconds"
+        lines.append(f"# HELP {metric} Latencia por etapa de la sincronización.")
+        lines.append(f"# TYPE {metric} histogram")
+        for stage in sorted(buckets):
+            cumulative = 0
+            for bound, count in zip(self.LATENCY_BUCKETS, buckets[stage]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            cumulative += buckets[stage][-1]
+            lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {sums[stage]:.6f}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {cumulative}')
+        declared: Set[str] = set()
+        for (name, labels), value in sorted(counters.items()):
+            metric_name = f"geodivision_{name}"
+            if metric_name not in declared:
+                lines.append(f"# TYPE {metric_name} counter")
+                declared.add(metric_name)
+            label_text = ",".join(f'{label}="{val}"' for label, val in labels)
+            lines.append(f"{metric_name}{{{label_text}}} {value:g}" if label_text else f"{metric_name} {value:g}")
+        if countries:
+            lines.append("# TYPE geodivision_country_records_per_second gauge")
+            for row in countries:
+                lines.append(
+                    f'geodivision_country_records_per_second{{country_id="{row["country_id"]}",'
+                    f'external_id="{row["external_id"]}"}} {row["records_per_second"]}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def write(self, prometheus_path: Optional[str], json_path: Optional[str]) -> None:
+        for path, content in (
+            (prometheus_path, lambda: self.to_prometheus()),
+            (json_path, lambda: json.dumps(self.summary(), ensure_ascii=False, indent=2)),
+        ):
+            if not path:
+                continue
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as handle:
+                handle.write(content())
+            logging.info("Métricas escritas en %s.", path)
+
+
+metrics = SyncMetrics()
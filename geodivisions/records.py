@@ -0,0 +1,413 @@
+"""
+Registros de Positiva normalizados, payloads de `actualizar-lote-*`, comparación para `--delta-sync` y el
+buffer columnar de municipios pendientes.
+"""
+
+from __future__ import annotations
+
+import sys
+import threading
+from array import array
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+
+@dataclass
+class DeltaStats:
+    new: int = 0
+    changed: int = 0
+    unchanged: int = 0
+
+
+DEPARTMENT_FIELD_KEYS: Dict[str, Tuple[str, ...]] = {
+    "division_id": ("idDivisionPolitica", "ID_DIVISION_POLITICA", "idDepartamento", "ID_DEPARTAMENTO"),
+    # idDepartamento y, si falta, el mismo valor que division_id.
+    "remote_dep_id": ("idDepartamento", "ID_DEPARTAMENTO", "idDivisionPolitica", "ID_DIVISION_POLITICA"),
+    "name": ("nombreDepartamento", "NombreDepartamento", "nombreEstado", "NOMBRE_ESTADO", "nombre"),
+    "state_name": ("nombreEstado", "NOMBRE_ESTADO"),
+}
+
+
+MUNICIPIO_FIELD_KEYS: Dict[str, Tuple[str, ...]] = {
+    "consecutivo": ("consecutivo", "CONSECUTIVO", "conscutivo", "idMunicipio", "ID_MUNICIPIO"),
+    "name": ("nombreCiudad", "NOMBRE_CIUDAD", "nombreMunicipio", "NOMBRE_MUNICIPIO"),
+    "divipola": ("codigoDivipola", "CODIGO_DIVIPOLA"),
+}
+
+
+class DepartmentRecord(NamedTuple):
+    """Departamento de Positiva normalizado una sola vez (`raw` se conserva para reportes)."""
+
+    division_id: Any
+    remote_dep_id: Any
+    name: Any
+    state_name: Any
+    raw: Dict
+
+
+class MunicipioRecord(NamedTuple):
+    """Municipio de Positiva normalizado una sola vez (`raw` se conserva para el journal)."""
+
+    consecutivo: Any
+    name: Any
+    divipola: Any
+    raw: Dict
+
+
+def first_value(record: Dict, keys: Tuple[str, ...]) -> Any:
+    """Equivale a `record.get(a) or record.get(b) or ...`: el primer valor verdadero, o el último."""
+    value = None
+    for key in keys:
+        value = record.get(key)
+        if value:
+            return value
+    return value
+
+
+def normalize_departments(raw_departments: Iterable[Dict]) -> List[DepartmentRecord]:
+    """Normaliza (una vez por registro) y deduplica por idDivisionPolitica; gana el primero."""
+    keys = DEPARTMENT_FIELD_KEYS
+    dedup: Dict[int, DepartmentRecord] = {}
+    for raw in raw_departments:
+        dep = DepartmentRecord(
+            first_value(raw, keys["division_id"]),
+            first_value(raw, keys["remote_dep_id"]),
+            first_value(raw, keys["name"]),
+            first_value(raw, keys["state_name"]),
+            raw,
+        )
+        if dep.division_id is not None:
+            dedup.setdefault(int(dep.division_id), dep)
+    return list(dedup.values())
+
+
+def normalize_municipios(raw_municipios: Iterable[Dict]) -> List[MunicipioRecord]:
+    """Igual que `normalize_departments`, deduplicando por consecutivo."""
+    keys = MUNICIPIO_FIELD_KEYS
+    dedup: Dict[int, MunicipioRecord] = {}
+    for raw in raw_municipios:
+        muni = MunicipioRecord(
+            first_value(raw, keys["consecutivo"]),
+            first_value(raw, keys["name"]),
+            first_value(raw, keys["divipola"]),
+            raw,
+        )
+        if muni.consecutivo is not None:
+            dedup.setdefault(int(muni.consecutivo), muni)
+    return list(dedup.values())
+
+
+def build_departamento_payload(external_id: int, dep: DepartmentRecord) -> Dict:
+    return {
+        "idPais": external_id,
+        "idDepartamento": dep.division_id,
+        "idDivisionPolitica": dep.division_id,
+        "nombreDepartamento": dep.name,
+        "nombreEstado": dep.state_name or dep.name,
+    }
+
+
+def build_municipio_payload(
+    external_id: int,
+    dep_division_id: int,
+    dep_remote_id: int,
+    municipio: MunicipioRecord,
+    dep_name: Optional[str],
+) -> Dict:
+    return {
+        "idPais": external_id,
+        "idDepartamento": dep_remote_id,
+        "idDivisionPolitica": dep_division_id,
+        "idMunicipio": municipio.consecutivo,
+        "nombreDepartamento": dep_name,
+        "nombreMunicipio": municipio.name,
+        "divipola": municipio.divipola,
+    }
+
+
+def department_payload_key(record: Dict) -> Optional[int]:
+    value = record.get("idDivisionPolitica") or record.get("idDepartamento")
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def municipio_payload_key(record: Dict) -> Optional[Tuple[int, int]]:
+    dep_id = record.get("idDepartamento")
+    muni_id = record.get("idMunicipio")
+    try:
+        if dep_id is None or muni_id is None:
+            return None
+        return int(dep_id), int(muni_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_records(data: Any) -> List[Dict]:
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in ("content", "data", "items", "resultado"):
+            if isinstance(data.get(key), list):
+                return data[key]
+    return []
+
+
+def delta_value(value: Any) -> Optional[str]:
+    # Los ids pueden llegar como número o como cadena; None y "" siguen siendo distintos.
+    return None if value is None else str(value)
+
+
+def diff_payloads(
+    payloads: Sequence[Dict],
+    existing: Dict[Any, Dict],
+    key_fn: Callable[[Dict], Any],
+    fields: Tuple[str, ...],
+    stats: Optional[DeltaStats] = None,
+) -> Tuple[Sequence[Dict], DeltaStats]:
+    """Filtra los payloads que ya existen idénticos en el backend.
+
+    Se comparan todos los `fields`: si el registro del backend no trae uno de ellos no hay forma de
+    saber si cambió, así que cuenta como modificado y se envía. Un `MunicipioBuffer` se recorre fila a
+    fila y lo pendiente se devuelve como otro buffer. Si se pasa `stats` los conteos se acumulan sobre él.
+    """
+    stats = stats if stats is not None else DeltaStats()
+    pending_rows: List[int] = []
+    for row, payload in enumerate(payloads):
+        current = existing.get(key_fn(payload))
+        if current is None:
+            stats.new += 1
+            pending_rows.append(row)
+            continue
+        changed = any(
+            field_name not in current or delta_value(current[field_name]) != delta_value(payload.get(field_name))
+            for field_name in fields
+        )
+        if changed:
+            stats.changed += 1
+            pending_rows.append(row)
+        else:
+            stats.unchanged += 1
+    if isinstance(payloads, MunicipioBuffer):
+        return payloads.take(pending_rows), stats
+    return [payloads[row] for row in pending_rows], stats
+
+
+def department_identifiers(dep: DepartmentRecord) -> Tuple[int, int, Optional[str]]:
+    """Devuelve (idDivisionPolitica, idDepartamento, nombre) o lanza ValueError con el motivo."""
+    if dep.division_id is None or dep.remote_dep_id is None:
+        raise ValueError("Departamento sin identificadores válidos")
+    try:
+        return int(dep.division_id), int(dep.remote_dep_id), dep.state_name or dep.name
+    except (TypeError, ValueError):
+        raise ValueError("Departamento con identificadores no numéricos") from None
+
+
+def collect_municipio_payloads(
+    external_id: int,
+    division_id: int,
+    remote_dep_id: int,
+    dep_name: Optional[str],
+    fetched: Iterable[MunicipioRecord],
+) -> List[Dict]:
+    """Payloads de un departamento.
+
+    `normalize_municipios` ya dejó un solo registro por consecutivo (numérico), así que aquí no hay estado
+    compartido: la deduplicación entre departamentos (solo posible si comparten idDepartamento) la hace
+    `MunicipioDedup` en los modos que envían mientras descargan.
+    """
+    return [build_municipio_payload(external_id, division_id, remote_dep_id, muni, dep_name) for muni in fetched]
+
+
+def municipio_ids(batch: Iterable[Dict]) -> Set[int]:
+    return {int(payload["idMunicipio"]) for payload in batch}
+
+
+def filter_new_municipios(batch: List[Dict], seen: Set[int]) -> List[Dict]:
+    """Descarta de `batch` los consecutivos ya presentes en `seen` y registra los nuevos."""
+    fresh: List[Dict] = []
+    for payload in batch:
+        key = int(payload["idMunicipio"])
+        if key not in seen:
+            seen.add(key)
+            fresh.append(payload)
+    return fresh
+
+
+class MunicipioBuffer:
+    """Payloads de municipios pendientes de un país, en columnas.
+
+    En lugar de un dict de siete claves por municipio guarda una tabla por departamento
+    (idDepartamento, idDivisionPolitica, nombreDepartamento), el índice de departamento y el
+    consecutivo en arrays de enteros, y nombre y divipola como referencias (nombres internados);
+    `idPais` es uno por buffer. Se comporta como una secuencia de payloads: los dicts se arman solo al
+    cortar un lote (`buffer[a:b]`), que es lo que hace `BatchQueue` en `persist_entities`.
+    """
+
+    __slots__ = ("external_id", "_departments", "_dep_index", "_ids", "_names", "_divipolas", "_raw_ids")
+
+    def __init__(self, external_id: int):
+        self.external_id = external_id
+        self._departments: List[Tuple[int, int, Optional[str]]] = []
+        self._dep_index = array("l")
+        self._ids = array("q")
+        self._names: List[Any] = []
+        self._divipolas: List[Any] = []
+        # Consecutivos que no venían como int (p. ej. "05"): se envían tal cual llegaron.
+        self._raw_ids: Dict[int, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in range(len(self._ids)):
+            yield self._payload(row)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self._payload(row) for row in range(*index.indices(len(self._ids)))]
+        return self._payload(range(len(self._ids))[index])
+
+    def _payload(self, row: int) -> Dict:
+        # Mismo orden de claves que `build_municipio_payload` (el JSON y las huellas no cambian).
+        remote_dep_id, division_id, dep_name = self._departments[self._dep_index[row]]
+        return {
+            "idPais": self.external_id,
+            "idDepartamento": remote_dep_id,
+            "idDivisionPolitica": division_id,
+            "idMunicipio": self._raw_ids.get(row, self._ids[row]) if self._raw_ids else self._ids[row],
+            "nombreDepartamento": dep_name,
+            "nombreMunicipio": self._names[row],
+            "divipola": self._divipolas[row],
+        }
+
+    def add_department(
+        self,
+        division_id: int,
+        remote_dep_id: int,
+        dep_name: Optional[str],
+        fetched: Iterable[MunicipioRecord],
+    ) -> None:
+        dep_index = len(self._departments)
+        self._departments.append((remote_dep_id, division_id, sys.intern(dep_name) if dep_name else dep_name))
+        first = len(self._ids)
+        ids, names, divipolas, intern = self._ids, self._names, self._divipolas, sys.intern
+        for muni in fetched:
+            consecutivo = muni.consecutivo
+            if type(consecutivo) is not int:
+                self._raw_ids[len(ids)] = consecutivo
+            ids.append(int(consecutivo))
+            name = muni.name
+            names.append(intern(name) if type(name) is str else name)
+            divipolas.append(muni.divipola)
+        self._dep_index.extend(array("l", [dep_index]) * (len(ids) - first))
+
+    def take(self, rows: Iterable[int]) -> "MunicipioBuffer":
+        """Buffer con solo las filas indicadas (en ese orden)."""
+        taken = MunicipioBuffer(self.external_id)
+        taken._departments = list(self._departments)
+        for row in rows:
+            if row in self._raw_ids:
+                taken._raw_ids[len(taken._ids)] = self._raw_ids[row]
+            taken._dep_index.append(self._dep_index[row])
+            taken._ids.append(self._ids[row])
+            taken._names.append(self._names[row])
+            taken._divipolas.append(self._divipolas[row])
+        return taken
+
+    def extend(self, other: "MunicipioBuffer", exclude: Optional[Set[int]] = None) -> None:
+        """Agrega las filas de `other`; con `exclude` se omiten los consecutivos ya vistos y se registran."""
+        offset = len(self._departments)
+        self._departments.extend(other._departments)
+        if exclude is None:
+            base = len(self._ids)
+            if len(other._departments) == 1:
+                self._dep_index.extend(array("l", [offset]) * len(other))
+            else:
+                self._dep_index.extend(array("l", (index + offset for index in other._dep_index)))
+            self._ids.extend(other._ids)
+            self._names.extend(other._names)
+            self._divipolas.extend(other._divipolas)
+            self._raw_ids.update((base + row, raw) for row, raw in other._raw_ids.items())
+            return
+        for row, muni_id in enumerate(other._ids):
+            if muni_id in exclude:
+                continue
+            exclude.add(muni_id)
+            if row in other._raw_ids:
+                self._raw_ids[len(self._ids)] = other._raw_ids[row]
+            self._dep_index.append(other._dep_index[row] + offset)
+            self._ids.append(muni_id)
+            self._names.append(other._names[row])
+            self._divipolas.append(other._divipolas[row])
+
+
+def collect_municipio_buffer(
+    external_id: int,
+    division_id: int,
+    remote_dep_id: int,
+    dep_name: Optional[str],
+    fetched: Iterable[MunicipioRecord],
+) -> MunicipioBuffer:
+    """Como `collect_municipio_payloads`, pero en un `MunicipioBuffer` de un solo departamento."""
+    buffer = MunicipioBuffer(external_id)
+    buffer.add_department(division_id, remote_dep_id, dep_name, fetched)
+    return buffer
+
+
+def merge_municipio_batches(external_id: int, parts: Iterable[MunicipioBuffer]) -> MunicipioBuffer:
+    """Une los buffers por departamento una sola vez al final.
+
+    El primer departamento de cada idDepartamento pasa tal cual; solo los departamentos que repiten un
+    idDepartamento ya visto se filtran contra sus consecutivos (gana el primero, como antes).
+    """
+    merged = MunicipioBuffer(external_id)
+    owners: Dict[int, MunicipioBuffer] = {}
+    seen: Dict[int, Set[int]] = {}
+    for part in parts:
+        if not part:
+            continue
+        remote_dep_id = part._departments[0][0]
+        owner = owners.setdefault(remote_dep_id, part)
+        if owner is part:
+            merged.extend(part)
+            continue
+        ids = seen.get(remote_dep_id)
+        if ids is None:
+            ids = seen[remote_dep_id] = set(owner._ids)
+        merged.extend(part, ids)
+    return merged
+
+
+class MunicipioDedup:
+    """Deduplicación incremental entre departamentos para los modos que envían mientras descargan.
+
+    Cada departamento reclama su idDepartamento con `dict.setdefault` (atómico con el GIL): el primero
+    pasa sin candado y solo los que repiten un idDepartamento ya reclamado se filtran, con una única
+    toma del candado por departamento en lugar de una por municipio.
+    """
+
+    def __init__(self) -> None:
+        self._owners: Dict[int, Set[int]] = {}
+        self._lock = threading.Lock()
+
+    def admit(self, remote_dep_id: int, batch: List[Dict]) -> List[Dict]:
+        ids = municipio_ids(batch)
+        if self._owners.setdefault(remote_dep_id, ids) is ids:
+            return batch
+        with self._lock:
+            return filter_new_municipios(batch, self._owners[remote_dep_id])
@@ -0,0 +1,190 @@
+"""Reintento dirigido (`--replay`): reejecuta solo las unidades fallidas de un reporte anterior."""
+
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import requests
+
+from .core import (
+    DEPARTMENTS_ENDPOINT,
+    MUNICIPIOS_ENDPOINT,
+    SyncResult,
+    delta_state_paths,
+    fetch_departments_from_external,
+    fetch_failure,
+    fetch_municipios_from_external,
+    journal_store_municipios,
+    persist_entities,
+    persist_municipios,
+    timed_sync_country,
+)
+from .http_client import TokenSource
+from .metrics import metrics
+from .records import (
+    MunicipioBuffer,
+    collect_municipio_buffer,
+    department_identifiers,
+    merge_municipio_batches,
+)
+from .storage import SyncFailure
+
+
+REPLAY_PERSIST_ENDPOINTS = {
+    "persist_departamentos": DEPARTMENTS_ENDPOINT,
+    "persist_municipios": MUNICIPIOS_ENDPOINT,
+}
+
+
+def replay_targeted(failure: SyncFailure) -> bool:
+    """True si el fallo trae referencia suficiente para repetir solo su unidad."""
+    if failure.stage in REPLAY_PERSIST_ENDPOINTS:
+        return failure.payload is not None
+    return failure.stage == "fetch_municipios" and failure.unit is not None
+
+
+def replay_targets(failures: Iterable[SyncFailure]) -> Dict[int, Tuple[Dict, List[SyncFailure]]]:
+    """Agrupa los fallos por país: `{idPais: (país, fallos)}` con el país armado desde el reporte."""
+    grouped: Dict[int, Tuple[Dict, List[SyncFailure]]] = {}
+    for failure in failures:
+        country = {"idPais": failure.country_id, "idPositiva": failure.external_id}
+        grouped.setdefault(failure.country_id, (country, []))[1].append(failure)
+    return grouped
+
+
+def replay_country(
+    country: Dict,
+    failures: List[SyncFailure],
+    args: argparse.Namespace,
+    backend_token: TokenSource,
+    external_token: TokenSource,
+) -> SyncResult:
+    country_id = country["idPais"]
+    external_id = country["idPositiva"]
+    if not all(replay_targeted(failure) for failure in failures):
+        logging.info("País %s/%s: hay fallos sin referencia para reintento; se repite el país.", country_id, external_id)
+        return timed_sync_country(
+            country,
+            args.backend_url,
+            backend_token,
+            external_token,
+            args.throttle_ms,
+            args.chunk_size,
+            args.municipality_workers,
+            delta_state_paths(args),
+            args.stream_queue_size if args.stream else 0,
+        )
+
+    started = time.monotonic()
+    result = SyncResult(country_id=country_id, external_id=external_id)
+    divisions = {int(failure.unit) for failure in failures if failure.stage == "fetch_municipios"}
+    if divisions:
+        try:
+            departments = [
+                dep
+                for dep in fetch_departments_from_external(external_id, external_token, args.throttle_ms)
+                if dep.division_id is not None and int(dep.division_id) in divisions
+            ]
+        except requests.RequestException as exc:
+            result.failures.append(
+                fetch_failure(
+                    country_id,
+                    external_id,
+                    "fetch_departamentos",
+                    exc,
+                    "No se pudieron obtener departamentos",
+                    "Error de red al obtener departamentos",
+                )
+            )
+            departments = []
+        buffers: List[MunicipioBuffer] = []
+        for dep in departments:
+            division_id_int, remote_dep_id_int, dep_name = department_identifiers(dep)
+            try:
+                fetched = fetch_municipios_from_external(
+                    external_id, division_id_int, external_token, args.throttle_ms
+                )
+            except requests.RequestException as exc:
+                result.failures.append(
+                    fetch_failure(
+                        country_id,
+                        external_id,
+                        "fetch_municipios",
+                        exc,
+                        f"No se pudieron obtener municipios para departamento {remote_dep_id_int}",
+                        f"Error de red obteniendo municipios para departamento {remote_dep_id_int}",
+                        str(division_id_int),
+                    )
+                )
+                continue
+            journal_store_municipios(country_id, division_id_int, fetched)
+            buffers.append(
+                collect_municipio_buffer(external_id, division_id_int, remote_dep_id_int, dep_name, fetched)
+            )
+        sent, mun_failures = persist_municipios(
+            args.backend_url,
+            backend_token,
+            merge_municipio_batches(external_id, buffers),
+            args.chunk_size,
+            country_id,
+            external_id,
+        )
+        result.municipalities_sent += sent
+        result.failures.extend(mun_failures)
+
+    for failure in failures:
+        if failure.stage not in REPLAY_PERSIST_ENDPOINTS:
+            continue
+        sent, batch_failures = persist_entities(
+            REPLAY_PERSIST_ENDPOINTS[failure.stage],
+            failure.stage,
+            args.backend_url,
+            backend_token,
+            json.loads(failure.payload),
+            args.chunk_size,
+            country_id,
+            external_id,
+        )
+        if failure.stage == "persist_departamentos":
+            result.departments_sent += sent
+        else:
+            result.municipalities_sent += sent
+        result.failures.extend(batch_failures)
+
+    logging.info(
+        "País %s/%s: reintento de %d fallos, %d departamentos y %d municipios enviados (%d fallos nuevos).",
+        country_id,
+        external_id,
+        len(failures),
+        result.departments_sent,
+        result.municipalities_sent,
+        len(result.failures),
+    )
+    metrics.record_country(result, time.monotonic() - started)
+    return result
+
+
+def run_replay(
+    failures: List[SyncFailure],
+    args: argparse.Namespace,
+    backend_token: TokenSource,
+    external_token: TokenSource,
+) -> List[SyncResult]:
+    grouped = replay_targets(failures)
+    results: List[SyncResult] = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as pool:
+        futures = [
+            pool.submit(replay_country, country, country_failures, args, backend_token, external_token)
+            for country, country_failures in grouped.values()
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as exc:
+                logging.exception("Error reintentando país: %s", exc)
+    return results
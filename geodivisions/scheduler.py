@@ -0,0 +1,438 @@
+"""
+Planificador global (`--engine scheduler`): un único pool de hilos con cola de prioridad para países,
+descargas por departamento y lotes de persistencia.
+"""
+
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import functools
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from . import storage
+from .core import (
+    DEPARTMENT_DIFF_FIELDS,
+    DEPARTMENTS_PATH,
+    MUNICIPIO_DIFF_FIELDS,
+    MUNICIPIOS_ENDPOINT,
+    BackendState,
+    SyncResult,
+    current_chunk_size,
+    delta_state_paths,
+    fetch_backend_state,
+    fetch_country_departments,
+    fetch_failure,
+    fetch_municipios_from_external,
+    journal_country_done,
+    journal_fetched_municipios,
+    journal_finish_country,
+    journal_store_municipios,
+    log_delta,
+    persist_departments,
+    persist_municipios,
+    serialize_sample,
+    start_department_prefetch,
+    stop_department_prefetch,
+)
+from .http_client import TokenSource
+from .metrics import metrics
+from .records import (
+    DeltaStats,
+    DepartmentRecord,
+    MunicipioDedup,
+    build_departamento_payload,
+    collect_municipio_payloads,
+    department_identifiers,
+    department_payload_key,
+    diff_payloads,
+    municipio_payload_key,
+)
+from .storage import SyncFailure
+
+
+PRIORITY_PERSIST = 0
+
+
+PRIORITY_FETCH = 1
+
+
+PRIORITY_COUNTRY = 2
+
+
+class WorkScheduler:
+    """Pool único de hilos con una cola de prioridad global.
+
+    Todas las unidades de trabajo (países, descargas por departamento, lotes de persistencia) comparten
+    los mismos `workers` hilos, así que la concurrencia total hacia Positiva y el backend queda acotada
+    y cualquier hilo libre toma la siguiente tarea más prioritaria sin importar de qué país sea.
+    """
+
+    def __init__(self, workers: int):
+        self._heap: List[Tuple[Tuple, int, Callable[[], None]]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._active = 0
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"scheduler-{index}", daemon=True)
+            for index in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, priority: Tuple, task: Callable[[], None]) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (priority, next(self._seq), task))
+            self._cond.notify()
+
+    def submit_future(self, priority: Tuple, fn: Callable[[], Any]) -> concurrent.futures.Future:
+        """Como `submit`, pero devuelve un Future con el resultado; cancelarlo antes de que empiece la omite."""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+
+        def run() -> None:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn())
+            except BaseException as exc:
+                future.set_exception(exc)
+
+        self.submit(priority, run)
+        return future
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if not self._heap:
+                    return
+                _, _, task = heapq.heappop(self._heap)
+                self._active += 1
+            try:
+                task()
+            except Exception:  # pragma: no cover - las tareas registran sus propios fallos
+                logging.exception("Tarea del planificador terminó con error.")
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    if not self._heap and not self._active:
+                        self._cond.notify_all()
+
+    def wait_idle(self) -> None:
+        with self._cond:
+            while self._heap or self._active:
+                self._cond.wait()
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+
+def estimate_country_weight(external_id: Optional[int]) -> int:
+    """Cantidad de departamentos conocida para el país (caché de respuestas), 0 si se desconoce."""
+    if external_id is None or storage.response_cache is None:
+        return 0
+    cached = storage.response_cache.peek(DEPARTMENTS_PATH, external_id, 0)
+    return len(cached) if isinstance(cached, list) else 0
+
+
+class CountryJob:
+    """Estado de un país dentro del planificador global.
+
+    La tarea del país descarga y persiste los departamentos y luego encola una tarea de descarga por
+    departamento; los municipios se acumulan y cada `chunk_size` registros se encola una tarea de
+    persistencia. El país termina cuando no le quedan tareas pendientes.
+    """
+
+    def __init__(
+        self,
+        scheduler: WorkScheduler,
+        country: Dict,
+        backend_url: str,
+        backend_token: TokenSource,
+        external_token: TokenSource,
+        throttle_ms: int,
+        chunk_size: int,
+        backend_state_paths: Optional[Tuple[str, str]] = None,
+    ):
+        self._scheduler = scheduler
+        self._country = country
+        self._backend_url = backend_url
+        self._backend_token = backend_token
+        self._external_token = external_token
+        self._throttle_ms = throttle_ms
+        self._chunk_size = chunk_size
+        self._backend_state_paths = backend_state_paths
+        self.country_id = country["idPais"]
+        self.external_id = country.get("idPositiva")
+        self.weight = estimate_country_weight(self.external_id)
+        self.result = SyncResult(country_id=self.country_id, external_id=self.external_id or 0)
+        self._started = 0.0
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._fetches_remaining = 0
+        self._backend_state: Optional[BackendState] = None
+        self._buffer: List[Dict] = []
+        self._dedup = MunicipioDedup()
+        self._municipios_total = 0
+        self._municipio_failures = 0
+        self._fetched_departments = False
+
+    def start(self) -> None:
+        self._spawn(PRIORITY_COUNTRY, self._run_country)
+
+    def _mark_started(self) -> None:
+        self._started = time.monotonic()
+
+    def _spawn(self, rank: int, task: Callable[[], None]) -> None:
+        with self._lock:
+            self._outstanding += 1
+
+        def run() -> None:
+            try:
+                task()
+            except Exception as exc:  # pragma: no cover - defensa general
+                logging.exception("País %s/%s: error inesperado en tarea.", self.country_id, self.external_id)
+                with self._lock:
+                    self.result.failures.append(
+                        SyncFailure(
+                            country_id=self.country_id,
+                            external_id=self.external_id,
+                            stage="scheduler",
+                            status=None,
+                            message=f"Error inesperado: {exc}",
+                        )
+                    )
+            finally:
+                with self._lock:
+                    self._outstanding -= 1
+                    finished = self._outstanding == 0
+                if finished:
+                    self._finish()
+
+        self._scheduler.submit((rank, -self.weight), run)
+
+    def _run_country(self) -> None:
+        self._mark_started()
+        country_id, external_id = self.country_id, self.external_id
+        if external_id is None:
+            logging.info("País %s no tiene idPositiva. Se omite.", country_id)
+            return
+        if journal_country_done(country_id):
+            logging.info("País %s/%s: completado según el journal. Se omite.", country_id, external_id)
+            return
+
+        logging.info("País %s/%s: descargando departamentos.", country_id, external_id)
+        try:
+            remote_departments = fetch_country_departments(
+                external_id, self._external_token, self._throttle_ms
+            )
+        except requests.RequestException as exc:
+            self.result.failures.append(
+                fetch_failure(
+                    country_id,
+                    external_id,
+                    "fetch_departamentos",
+                    exc,
+                    "No se pudieron obtener departamentos",
+                    "Error de red al obtener departamentos",
+                )
+            )
+            return
+
+        if not remote_departments:
+            logging.info("País %s/%s: sin departamentos en API externa.", country_id, external_id)
+            return
+
+        self.weight = len(remote_departments)
+        if self._backend_state_paths is not None:
+            self._backend_state = fetch_backend_state(
+                self._backend_url, self._backend_token, country_id, external_id, self._backend_state_paths
+            )
+
+        dept_payloads = [build_departamento_payload(external_id, dep) for dep in remote_departments]
+        if self._backend_state is not None:
+            dept_payloads, self.result.department_delta = diff_payloads(
+                dept_payloads, self._backend_state.departments, department_payload_key, DEPARTMENT_DIFF_FIELDS
+            )
+            log_delta(country_id, external_id, "departamentos", self.result.department_delta)
+            self.result.municipality_delta = DeltaStats()
+        deps_sent, dep_failures = persist_departments(
+            self._backend_url,
+            self._backend_token,
+            dept_payloads,
+            self._chunk_size,
+            country_id,
+            external_id,
+        )
+        with self._lock:
+            self.result.departments_sent = deps_sent
+            self.result.failures.extend(dep_failures)
+            self._fetches_remaining = len(remote_departments)
+            self._fetched_departments = True
+        logging.info(
+            "País %s/%s: %d/%d departamentos enviados (%d fallos).",
+            country_id,
+            external_id,
+            deps_sent,
+            len(dept_payloads),
+            len(dep_failures),
+        )
+        for dep in remote_departments:
+            self._spawn(PRIORITY_FETCH, functools.partial(self._fetch_department, dep))
+
+    def _fetch_department(self, dep: DepartmentRecord) -> None:
+        try:
+            self._collect_department(dep)
+        finally:
+            with self._lock:
+                self._fetches_remaining -= 1
+                last = self._fetches_remaining == 0
+                remainder = self._buffer if last else []
+                if last:
+                    self._buffer = []
+            if remainder:
+                self._spawn(PRIORITY_PERSIST, functools.partial(self._persist_chunk, remainder))
+
+    def _add_failure(self, failure: SyncFailure) -> None:
+        with self._lock:
+            self.result.failures.append(failure)
+
+    def _collect_department(self, dep: DepartmentRecord) -> None:
+        country_id, external_id = self.country_id, self.external_id
+        try:
+            division_id_int, remote_dep_id_int, dep_name = department_identifiers(dep)
+        except ValueError as exc:
+            self._add_failure(
+                SyncFailure(
+                    country_id=country_id,
+                    external_id=external_id,
+                    stage="fetch_municipios",
+                    status=None,
+                    message=str(exc),
+                    sample=serialize_sample(dep.raw),
+                )
+            )
+            return
+        fetched = journal_fetched_municipios(country_id, division_id_int)
+        try:
+            if fetched is None:
+                fetched = fetch_municipios_from_external(
+                    external_id, division_id_int, self._external_token, self._throttle_ms
+                )
+                journal_store_municipios(country_id, division_id_int, fetched)
+        except requests.RequestException as exc:
+            self._add_failure(
+                fetch_failure(
+                    country_id,
+                    external_id,
+                    "fetch_municipios",
+                    exc,
+                    f"No se pudieron obtener municipios para departamento {remote_dep_id_int}",
+                    f"Error de red obteniendo municipios para departamento {remote_dep_id_int}",
+                    str(division_id_int),
+                )
+            )
+            return
+
+        local_batch = self._dedup.admit(
+            remote_dep_id_int,
+            collect_municipio_payloads(external_id, division_id_int, remote_dep_id_int, dep_name, fetched),
+        )
+        chunks: List[List[Dict]] = []
+        with self._lock:
+            if self._backend_state is not None:
+                local_batch, _ = diff_payloads(
+                    local_batch,
+                    self._backend_state.municipios,
+                    municipio_payload_key,
+                    MUNICIPIO_DIFF_FIELDS,
+                    self.result.municipality_delta,
+                )
+            self._municipios_total += len(local_batch)
+            self._buffer.extend(local_batch)
+            size = current_chunk_size(MUNICIPIOS_ENDPOINT, self._chunk_size)
+            while len(self._buffer) >= size:
+                chunks.append(self._buffer[:size])
+                del self._buffer[:size]
+        for chunk in chunks:
+            self._spawn(PRIORITY_PERSIST, functools.partial(self._persist_chunk, chunk))
+
+    def _persist_chunk(self, chunk: List[Dict]) -> None:
+        sent, failures = persist_municipios(
+            self._backend_url,
+            self._backend_token,
+            chunk,
+            self._chunk_size,
+            self.country_id,
+            self.external_id,
+        )
+        with self._lock:
+            self.result.municipalities_sent += sent
+            self.result.failures.extend(failures)
+            self._municipio_failures += len(failures)
+
+    def _finish(self) -> None:
+        metrics.record_country(self.result, time.monotonic() - self._started)
+        if self._fetched_departments:
+            if self.result.municipality_delta is not None:
+                log_delta(self.country_id, self.external_id, "municipios", self.result.municipality_delta)
+            logging.info(
+                "País %s/%s: %d/%d municipios enviados (%d fallos).",
+                self.country_id,
+                self.external_id,
+                self.result.municipalities_sent,
+                self._municipios_total,
+                self._municipio_failures,
+            )
+            journal_finish_country(self.result)
+
+
+def run_scheduled_engine(
+    targets: List[Dict],
+    args: argparse.Namespace,
+    backend_token: TokenSource,
+    external_token: TokenSource,
+) -> List[SyncResult]:
+    scheduler = WorkScheduler(args.max_workers)
+    jobs = [
+        CountryJob(
+            scheduler,
+            country,
+            args.backend_url,
+            backend_token,
+            external_token,
+            args.throttle_ms,
+            args.chunk_size,
+            delta_state_paths(args),
+        )
+        for country in targets
+    ]
+    ordered = sorted(jobs, key=lambda job: job.weight, reverse=True)
+    # El prefetch corre como tareas del scheduler (con la prioridad de las descargas), dentro de --max-workers.
+    start_department_prefetch(
+        sorted(targets, key=lambda country: estimate_country_weight(country.get("idPositiva")), reverse=True),
+        args,
+        external_token,
+        functools.partial(scheduler.submit_future, (PRIORITY_FETCH, 0)),
+    )
+    try:
+        for job in ordered:
+            job.start()
+        scheduler.wait_idle()
+    finally:
+        stop_department_prefetch()
+        scheduler.shutdown()
+    return [job.result for job in jobs]
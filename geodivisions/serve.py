@@ -0,0 +1,215 @@
+"""Modo servicio (`serve`): sincronizaciones periódicas o bajo demanda con tokens, pool HTTP y respuestas calientes."""
+
+from __future__ import annotations
+
+import argparse
+import http.server
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from . import storage
+from .cli import (
+    build_arg_parser,
+    build_token_providers,
+    close_run_state,
+    configure_process,
+    configure_run,
+    run_sync,
+    validate_args,
+)
+from .http_client import TokenSource
+from .metrics import metrics
+
+
+class SyncDaemon:
+    """Proceso de larga vida que repite sincronizaciones con el estado caliente.
+
+    Tokens, pool HTTP, caché de respuestas, circuitos y tamaños de lote se configuran una vez; cada
+    corrida trae su propio `RunState` (reporte de fallos con sufijo por corrida, coalescers, lotes
+    aparcados, retención de la cuarentena). Las corridas se ejecutan en el hilo principal, una a la vez:
+    cada `interval` segundos o cuando llega un disparo (`POST /sync`); los disparos que llegan durante
+    una corrida se agrupan en una sola corrida siguiente.
+    """
+
+    def __init__(self, args: argparse.Namespace, backend_token: TokenSource, external_token: TokenSource):
+        self._args = args
+        self._backend_token = backend_token
+        self._external_token = external_token
+        self._trigger = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.running = False
+        self.runs = 0
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.next_run_at: Optional[float] = None
+
+    def trigger(self) -> bool:
+        """Pide una corrida; devuelve True si había una en curso (la nueva queda encolada)."""
+        with self._lock:
+            running = self.running
+        self._trigger.set()
+        return running
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._trigger.set()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": "running" if self.running else "idle",
+                "runs": self.runs,
+                "interval_seconds": self._args.interval,
+                "next_run_at": self.next_run_at,
+                "last_run": self.last_run,
+            }
+
+    def run_once(self) -> None:
+        with self._lock:
+            self.running = True
+            self.next_run_at = None
+        metrics.start_run()
+        args = argparse.Namespace(**vars(self._args))
+        if args.report_file:
+            # Un reporte por corrida: con la ruta fija cada corrida truncaría el reporte de la anterior.
+            root, ext = os.path.splitext(args.report_file)
+            args.report_file = f"{root}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{self.runs + 1}{ext}"
+        try:
+            summary = run_sync(args, self._backend_token, self._external_token)
+        except Exception as exc:
+            logging.exception("Falló la sincronización programada: %s", exc)
+            summary = {"error": str(exc), "finished_at": time.time()}
+        with self._lock:
+            self.running = False
+            self.runs += 1
+            self.last_run = summary
+
+    def serve_forever(self) -> None:
+        while not self._stopping.is_set():
+            self._trigger.clear()
+            self.run_once()
+            interval = self._args.interval or None
+            with self._lock:
+                self.next_run_at = time.time() + interval if interval else None
+            self._trigger.wait(timeout=interval)
+
+
+class SyncDaemonHandler(http.server.BaseHTTPRequestHandler):
+    """`GET /status`, `GET /metrics` (texto Prometheus) y `POST /sync` del modo `serve`."""
+
+    daemon: SyncDaemon
+
+    def _send(self, status: int, body: str, content_type: str = "application/json") -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        path = urlsplit(self.path).path
+        if path == "/status":
+            self._send(200, json.dumps(self.daemon.status(), ensure_ascii=False))
+        elif path == "/metrics":
+            self._send(200, metrics.to_prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._send(404, json.dumps({"error": "no encontrado"}))
+
+    def do_POST(self) -> None:
+        if urlsplit(self.path).path != "/sync":
+            self._send(404, json.dumps({"error": "no encontrado"}))
+            return
+        queued = self.daemon.trigger()
+        self._send(202, json.dumps({"accepted": True, "queued_after_current": queued}))
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug("serve %s - %s", self.address_string(), format % args)
+
+
+def parse_listen(value: str) -> Tuple[str, int]:
+    host, _, port = value.rpartition(":")
+    try:
+        return host or "127.0.0.1", int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Dirección inválida {value!r}: use HOST:PUERTO.") from None
+
+
+def parse_serve_args(argv: List[str]) -> argparse.Namespace:
+    parser = build_arg_parser()
+    parser.prog = "sync_geodivisions.py serve"
+    parser.description = (
+        "Modo servicio: sincronizaciones periódicas o por HTTP con estado caliente (incrementales con --delta-sync)."
+    )
+    parser.add_argument(
+        "--listen",
+        type=parse_listen,
+        default=("127.0.0.1", 8787),
+        metavar="HOST:PUERTO",
+        help="Dirección del endpoint local (/status, /metrics, POST /sync). Por defecto 127.0.0.1:8787.",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=900,
+        help="Segundos entre sincronizaciones programadas (0 = solo por POST /sync).",
+    )
+    parser.add_argument(
+        "--snapshot-ttl",
+        type=float,
+        default=None,
+        help="Vigencia en segundos de las respuestas de Positiva en memoria cuando no se usa --cache-mode "
+        "(por defecto igual a --interval, o 900 si solo se sincroniza por POST /sync). Con un valor mayor "
+        "que --interval algunas corridas programadas no vuelven a consultar Positiva.",
+    )
+    args = validate_args(parser, parser.parse_args(argv))
+    if args.resume or args.replay or args.summary_file:
+        parser.error("--resume, --replay y --summary-file no aplican al modo serve.")
+    if args.snapshot_ttl is None:
+        args.snapshot_ttl = args.interval or 900
+    return args
+
+
+def serve(argv: List[str]) -> None:
+    args = parse_serve_args(argv)
+    configure_process(args)
+    backend_token, external_token = build_token_providers(args)
+    configure_run(args)
+    if storage.response_cache is None:
+        storage.configure_memory_cache(args.snapshot_ttl)
+        logging.info("Respuestas de Positiva en memoria (vigencia %.0fs).", args.snapshot_ttl)
+        if args.interval and args.snapshot_ttl > args.interval:
+            logging.warning(
+                "--snapshot-ttl %.0fs es mayor que --interval %.0fs: los cambios de Positiva pueden tardar "
+                "hasta %.0fs en llegar.",
+                args.snapshot_ttl,
+                args.interval,
+                args.snapshot_ttl,
+            )
+
+    daemon = SyncDaemon(args, backend_token, external_token)
+    handler = type("BoundSyncDaemonHandler", (SyncDaemonHandler,), {"daemon": daemon})
+    server = http.server.ThreadingHTTPServer(args.listen, handler)
+    threading.Thread(target=server.serve_forever, name="serve-http", daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    logging.info(
+        "Servicio escuchando en http://%s:%d (intervalo %s).",
+        *server.server_address[:2],
+        f"{args.interval:.0f}s" if args.interval else "solo POST /sync",
+    )
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Deteniendo el servicio.")
+    finally:
+        daemon.stop()
+        server.shutdown()
+        server.server_close()
+        close_run_state()
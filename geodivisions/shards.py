@@ -0,0 +1,192 @@
+"""Particionado entre procesos (`--shard k/n`), resumen de cada shard (`--summary-file`) y `merge-reports`."""
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import json
+import logging
+import os
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .core import SyncResult
+from .records import DeltaStats
+from .storage import FailureSink, default_report_path, read_failures_report
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """`k/n` con 1 <= k <= n (argparse type)."""
+    try:
+        index, count = (int(part) for part in value.split("/", 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard inválido {value!r}: use k/n, por ejemplo 2/4.") from None
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"Shard inválido {value!r}: se requiere 1 <= k <= n.")
+    return index, count
+
+
+def load_shard_weights(path: Optional[str]) -> Callable[[Dict], int]:
+    """Peso de un país: `--shard-weights` (JSON {idPais: peso}) o 1 para todos.
+
+    No se usa la caché de respuestas local: cada runner puede tener una caché distinta y calcularía otra
+    partición, con países omitidos o sincronizados dos veces. Sin pesos el reparto es uniforme por idPais.
+    """
+    if path:
+        with open(path, encoding="utf-8") as handle:
+            weights = {int(key): int(value) for key, value in json.load(handle).items()}
+        return lambda country: weights.get(country["idPais"], 0)
+    return lambda country: 1
+
+
+def shard_targets(
+    targets: List[Dict], shard: Tuple[int, int], weight: Callable[[Dict], int]
+) -> List[Dict]:
+    """Países del shard `k/n`.
+
+    Asignación LPT determinista: países ordenados por (peso desc., idPais) y cada uno al shard con menos
+    carga (desempate por cantidad de países y número de shard). Con las mismas entradas todos los
+    procesos calculan la misma partición, sin coordinarse; los pesos desconocidos cuentan como 1.
+    """
+    index, count = shard
+    loads = [(0, 0, shard_number) for shard_number in range(1, count + 1)]
+    selected: List[Dict] = []
+    for country in sorted(targets, key=lambda item: (-weight(item), item["idPais"])):
+        load, assigned, shard_number = heapq.heappop(loads)
+        if shard_number == index:
+            selected.append(country)
+        heapq.heappush(loads, (load + max(1, weight(country)), assigned + 1, shard_number))
+    return selected
+
+
+def delta_summary(stats: Optional[DeltaStats]) -> Optional[Dict[str, int]]:
+    return asdict(stats) if stats is not None else None
+
+
+def write_run_summary(
+    path: str,
+    results: List[SyncResult],
+    shard: Optional[Tuple[int, int]],
+    sink: Optional[FailureSink],
+) -> None:
+    """Totales por país de la corrida (o del shard) para `merge-reports`."""
+    summary = {
+        "shard": list(shard) if shard else None,
+        "countries": [
+            {
+                "country_id": result.country_id,
+                "external_id": result.external_id,
+                "departments_sent": result.departments_sent,
+                "municipalities_sent": result.municipalities_sent,
+                "failures": len(result.failures),
+                "department_delta": delta_summary(result.department_delta),
+                "municipality_delta": delta_summary(result.municipality_delta),
+            }
+            for result in sorted(results, key=lambda item: item.country_id)
+        ],
+        "failures": sink.count if sink is not None else 0,
+        # Relativo al resumen, para que `merge-reports` lo encuentre aunque se copien juntos a otra máquina.
+        "report_file": (
+            os.path.relpath(os.path.abspath(sink.path), os.path.dirname(os.path.abspath(path)))
+            if sink is not None and sink.count
+            else None
+        ),
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(summary, handle, ensure_ascii=False, indent=2)
+    logging.info("Resumen de la corrida escrito en %s.", path)
+
+
+def parse_merge_reports_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="sync_geodivisions.py merge-reports",
+        description="Une los resúmenes (--summary-file) y reportes de fallos de varios shards.",
+    )
+    parser.add_argument("summaries", nargs="+", help="Archivos --summary-file de cada shard.")
+    parser.add_argument(
+        "--report-file",
+        help="Reporte de fallos combinado (CSV, o JSONL si termina en .jsonl). Por defecto en ./exports.",
+    )
+    parser.add_argument("--output", help="Resumen combinado en JSON.")
+    return parser.parse_args(argv)
+
+
+def merge_reports(argv: List[str]) -> None:
+    args = parse_merge_reports_args(argv)
+    countries: Dict[int, Dict[str, Any]] = {}
+    shards: Dict[int, Set[int]] = {}
+    report_files: List[str] = []
+    for path in args.summaries:
+        with open(path, encoding="utf-8") as handle:
+            summary = json.load(handle)
+        if summary.get("shard"):
+            index, count = summary["shard"]
+            shards.setdefault(count, set()).add(index)
+        for row in summary.get("countries", []):
+            if row["country_id"] in countries:
+                logging.warning("País %s aparece en más de un resumen; se conserva el primero.", row["country_id"])
+                continue
+            countries[row["country_id"]] = row
+        if summary.get("report_file"):
+            # Las rutas se guardan relativas al resumen (las absolutas de versiones anteriores se respetan).
+            report_files.append(os.path.join(os.path.dirname(os.path.abspath(path)), summary["report_file"]))
+
+    for count, indexes in sorted(shards.items()):
+        missing = sorted(set(range(1, count + 1)) - indexes)
+        if missing:
+            logging.warning("Faltan los shards %s de %d.", ", ".join(str(index) for index in missing), count)
+    if len(shards) > 1:
+        logging.warning("Los resúmenes mezclan particiones distintas: %s.", ", ".join(f"n={n}" for n in shards))
+
+    missing_reports = [report_file for report_file in report_files if not os.path.exists(report_file)]
+    if missing_reports:
+        raise SystemExit(
+            "No se encontraron los reportes de fallos " + ", ".join(missing_reports) + ": copie cada reporte "
+            "junto a su resumen conservando la ruta relativa que indica `report_file`."
+        )
+    sink = FailureSink(args.report_file or default_report_path())
+    for report_file in report_files:
+        for failure in read_failures_report(report_file):
+            sink.put(failure)
+    sink.close()
+
+    rows = [countries[country_id] for country_id in sorted(countries)]
+    totals: Dict[str, Any] = {
+        "countries": len(rows),
+        "departments_sent": sum(row["departments_sent"] for row in rows),
+        "municipalities_sent": sum(row["municipalities_sent"] for row in rows),
+        "failures": sink.count,
+        "failed_countries": len(sink.countries),
+        "failures_by_stage": dict(sorted(sink.stages.items())),
+    }
+    for key in ("department_delta", "municipality_delta"):
+        deltas = [row[key] for row in rows if row.get(key)]
+        if deltas:
+            totals[key] = {name: sum(delta[name] for delta in deltas) for name in ("unchanged", "new", "changed")}
+    logging.info(
+        "Resumen combinado de %d resúmenes: %d países, %d departamentos y %d municipios enviados.",
+        len(args.summaries),
+        totals["countries"],
+        totals["departments_sent"],
+        totals["municipalities_sent"],
+    )
+    if sink.count:
+        logging.warning(
+            "%d fallos en %d países (%s). Reporte combinado: %s",
+            sink.count,
+            len(sink.countries),
+            ", ".join(f"{stage}={count}" for stage, count in sorted(sink.stages.items())),
+            sink.path,
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(
+                {"totals": totals, "countries": rows, "report_file": sink.path if sink.count else None},
+                handle,
+                ensure_ascii=False,
+                indent=2,
+            )
+        logging.info("Resumen combinado escrito en %s.", args.output)
@@ -0,0 +1,459 @@
+"""
+Archivos locales de la corrida: reporte de fallos (CSV o JSONL), caché de respuestas de Positiva
+(`--cache-mode`) y journal de reanudación (`--resume`).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, TextIO, Tuple
+
+import requests
+
+
+@dataclass
+class SyncFailure:
+    country_id: int
+    external_id: Optional[int]
+    stage: str
+    status: Optional[int]
+    message: str
+    payload_size: int = 0
+    sample: Optional[str] = None
+    records: List[str] = field(default_factory=list)
+    fingerprint: Optional[str] = None
+    # Referencias para `--replay`: división cuya descarga falló y lote completo (JSON) que no se persistió.
+    unit: Optional[str] = None
+    payload: Optional[str] = None
+
+
+class CacheMissError(requests.RequestException):
+    """No hay respuesta en caché para la clave solicitada (modo offline)."""
+
+
+class ResponseCache:
+    """Caché persistente (SQLite) de respuestas de Positiva indexada por (endpoint, idPais, idDivisionPolitica).
+
+    Modos:
+    - read: sirve entradas vigentes (TTL) y descarga solo las faltantes o vencidas.
+    - refresh: descarga siempre y sobrescribe la entrada.
+    - offline: sirve cualquier entrada sin importar el TTL; si falta, falla sin ir a la red.
+    """
+
+    def __init__(self, path: str, mode: str, ttl_seconds: float):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.mode = mode
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                endpoint TEXT NOT NULL,
+                id_pais INTEGER NOT NULL,
+                id_division INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                content_hash TEXT NOT NULL,
+                body BLOB NOT NULL,
+                PRIMARY KEY (endpoint, id_pais, id_division)
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def content_hash(data: Any) -> str:
+        canonical = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def lookup(self, endpoint: str, id_pais: int, id_division: int) -> Tuple[bool, Any]:
+        """Devuelve (encontrado, datos) según el modo y el TTL configurados."""
+        if self.mode == "refresh":
+            return False, None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at, body FROM responses WHERE endpoint = ? AND id_pais = ? AND id_division = ?",
+                (endpoint, id_pais, id_division),
+            ).fetchone()
+            fresh = row is not None and (self.mode == "offline" or time.time() - row[0] <= self.ttl_seconds)
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not fresh:
+            return False, None
+        return True, json.loads(zlib.decompress(row[1]).decode("utf-8"))
+
+    def peek(self, endpoint: str, id_pais: int, id_division: int) -> Optional[Any]:
+        """Lee una entrada sin considerar TTL ni contar aciertos (para estimaciones)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body FROM responses WHERE endpoint = ? AND id_pais = ? AND id_division = ?",
+                (endpoint, id_pais, id_division),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def store(self, endpoint: str, id_pais: int, id_division: int, data: Any) -> bool:
+        """Guarda la respuesta; devuelve True si el contenido cambió respecto a la entrada previa."""
+        digest = self.content_hash(data)
+        body = zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            previous = self._conn.execute(
+                "SELECT content_hash FROM responses WHERE endpoint = ? AND id_pais = ? AND id_division = ?",
+                (endpoint, id_pais, id_division),
+            ).fetchone()
+            if previous is not None and previous[0] == digest:
+                self._conn.execute(
+                    "UPDATE responses SET fetched_at = ? WHERE endpoint = ? AND id_pais = ? AND id_division = ?",
+                    (time.time(), endpoint, id_pais, id_division),
+                )
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (endpoint, id_pais, id_division, time.time(), digest, body),
+                )
+            self._conn.commit()
+        return previous is None or previous[0] != digest
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+response_cache: Optional[ResponseCache] = None
+
+
+def configure_response_cache(args: argparse.Namespace) -> Optional[ResponseCache]:
+    global response_cache
+    if args.cache_mode == "off":
+        response_cache = None
+    else:
+        path = args.cache_file or default_cache_path()
+        response_cache = ResponseCache(path, args.cache_mode, args.cache_ttl_hours * 3600)
+        logging.info("Caché de respuestas en %s (modo %s).", path, args.cache_mode)
+    return response_cache
+
+
+def configure_memory_cache(ttl_seconds: float) -> ResponseCache:
+    """Caché en memoria del modo `serve` cuando no se pidió `--cache-mode`."""
+    global response_cache
+    response_cache = ResponseCache(":memory:", "read", ttl_seconds)
+    return response_cache
+
+
+def cached_fetch(endpoint: str, id_pais: int, id_division: int, loader: Callable[[], Any]) -> Any:
+    cache = response_cache
+    if cache is None:
+        return loader()
+    found, data = cache.lookup(endpoint, id_pais, id_division)
+    if found:
+        return data
+    if cache.mode == "offline":
+        raise CacheMissError(f"Sin respuesta en caché para {endpoint} idPais={id_pais} division={id_division}")
+    data = loader()
+    cache.store(endpoint, id_pais, id_division, data)
+    return data
+
+
+async def cached_fetch_async(
+    endpoint: str, id_pais: int, id_division: int, loader: Callable[[], Awaitable[Any]]
+) -> Any:
+    """Como `cached_fetch`; las lecturas y escrituras del SQLite corren en un hilo, fuera del event loop."""
+    cache = response_cache
+    if cache is None:
+        return await loader()
+    found, data = await asyncio.to_thread(cache.lookup, endpoint, id_pais, id_division)
+    if found:
+        return data
+    if cache.mode == "offline":
+        raise CacheMissError(f"Sin respuesta en caché para {endpoint} idPais={id_pais} division={id_division}")
+    data = await loader()
+    await asyncio.to_thread(cache.store, endpoint, id_pais, id_division, data)
+    return data
+
+
+FAILURE_FIELDS = [
+    "country_id",
+    "external_id",
+    "stage",
+    "status",
+    "message",
+    "payload_size",
+    "sample",
+    "records",
+    "fingerprint",
+    "unit",
+    "payload",
+]
+
+
+class FailureSink:
+    """Reporte de fallos append-only que se escribe mientras corre la sincronización.
+
+    Los productores (hilos, corrutinas, consumidores de cola) solo encolan; el hilo escritor arranca con
+    el primer fallo (si no hay fallos no hay hilo ni archivo), abre el archivo, escribe una fila por fallo en CSV, o en
+    JSONL si la ruta termina en `.jsonl`, y hace flush por línea. El resumen final (total, países y
+    fallos por etapa) se acumula en el escritor a partir de lo escrito.
+    """
+
+    def __init__(self, destination: str):
+        self.path = destination
+        self.count = 0
+        self.countries: Set[int] = set()
+        self.stages: Dict[str, int] = {}
+        self._jsonl = destination.lower().endswith(".jsonl")
+        self._queue: "queue.Queue[Optional[SyncFailure]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def put(self, failure: SyncFailure) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="reporte-fallos", daemon=True)
+                    self._thread.start()
+        self._queue.put(failure)
+
+    def close(self) -> None:
+        """Espera a que se escriba todo lo encolado."""
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def _open(self) -> TextIO:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return open(self.path, "w", newline="", encoding="utf-8", buffering=1)
+
+    def _row(self, failure: SyncFailure) -> Dict[str, Any]:
+        if self._jsonl:
+            return asdict(failure)
+        return {
+            "country_id": failure.country_id,
+            "external_id": failure.external_id,
+            "stage": failure.stage,
+            "status": failure.status or "",
+            "message": failure.message,
+            "payload_size": failure.payload_size,
+            "sample": failure.sample or "",
+            "records": ";".join(failure.records),
+            "fingerprint": failure.fingerprint or "",
+            "unit": failure.unit or "",
+            "payload": failure.payload or "",
+        }
+
+    def _run(self) -> None:
+        handle: Optional[TextIO] = None
+        writer: Optional[csv.DictWriter] = None
+        try:
+            while True:
+                failure = self._queue.get()
+                if failure is None:
+                    break
+                try:
+                    if handle is None:
+                        handle = self._open()
+                        if not self._jsonl:
+                            writer = csv.DictWriter(handle, fieldnames=FAILURE_FIELDS)
+                            writer.writeheader()
+                    row = self._row(failure)
+                    if writer is None:
+                        handle.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    else:
+                        writer.writerow(row)
+                except OSError:
+                    logging.exception("No se pudo escribir un fallo en %s.", self.path)
+                self.count += 1
+                self.countries.add(failure.country_id)
+                self.stages[failure.stage] = self.stages.get(failure.stage, 0) + 1
+        finally:
+            if handle is not None:
+                handle.close()
+
+
+def write_failures_report(failures: Iterable[SyncFailure], destination: str) -> str:
+    sink = FailureSink(destination)
+    for failure in failures:
+        sink.put(failure)
+    sink.close()
+    return destination
+
+
+def optional_int(value: Any) -> Optional[int]:
+    return int(value) if value not in (None, "") else None
+
+
+def read_failures_report(source: str) -> List[SyncFailure]:
+    """Lee un reporte de `FailureSink` (CSV o JSONL) de vuelta a `SyncFailure`."""
+    known = set(SyncFailure.__dataclass_fields__)
+    failures: List[SyncFailure] = []
+    with open(source, newline="", encoding="utf-8") as handle:
+        if source.lower().endswith(".jsonl"):
+            for line in handle:
+                if line.strip():
+                    row = json.loads(line)
+                    failures.append(SyncFailure(**{key: value for key, value in row.items() if key in known}))
+            return failures
+        # El lote completo de un fallo puede superar el límite por defecto de un campo CSV (128 KiB).
+        csv.field_size_limit(max(csv.field_size_limit(), 1 << 30))
+        for row in csv.DictReader(handle):
+            failures.append(
+                SyncFailure(
+                    country_id=int(row["country_id"]),
+                    external_id=optional_int(row.get("external_id")),
+                    stage=row["stage"],
+                    status=optional_int(row.get("status")),
+                    message=row.get("message") or "",
+                    payload_size=optional_int(row.get("payload_size")) or 0,
+                    sample=row.get("sample") or None,
+                    records=[key for key in (row.get("records") or "").split(";") if key],
+                    fingerprint=row.get("fingerprint") or None,
+                    unit=row.get("unit") or None,
+                    payload=row.get("payload") or None,
+                )
+            )
+    return failures
+
+
+def default_report_path() -> str:
+    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(os.getcwd(), "exports", f"sync_failures_{timestamp}.csv")
+
+
+class SyncJournal:
+    """Journal SQLite de progreso para reanudar un barrido interrumpido (`--resume`).
+
+    Unidades registradas:
+    - `country`: país terminado sin fallos (se omite por completo al reanudar).
+    - `municipios_fetch`: respuesta deduplicada de municipios de un departamento.
+    - registros confirmados por el backend, por etapa de persistencia y clave del payload.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._acked: Dict[Tuple[str, int], Set[str]] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completed_units (
+                kind TEXT NOT NULL,
+                country_id INTEGER NOT NULL,
+                unit_key TEXT NOT NULL,
+                data BLOB,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (kind, country_id, unit_key)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS acked_records (
+                stage TEXT NOT NULL,
+                country_id INTEGER NOT NULL,
+                record_key TEXT NOT NULL,
+                PRIMARY KEY (stage, country_id, record_key)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def is_done(self, kind: str, country_id: int, unit_key: str = "") -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM completed_units WHERE kind = ? AND country_id = ? AND unit_key = ?",
+                (kind, country_id, unit_key),
+            ).fetchone()
+        return row is not None
+
+    def load_unit(self, kind: str, country_id: int, unit_key: str = "") -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM completed_units WHERE kind = ? AND country_id = ? AND unit_key = ?",
+                (kind, country_id, unit_key),
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def mark_done(self, kind: str, country_id: int, unit_key: str = "", data: Any = None) -> None:
+        blob = None
+        if data is not None:
+            blob = zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completed_units VALUES (?, ?, ?, ?, ?)",
+                (kind, country_id, unit_key, blob, time.time()),
+            )
+            self._conn.commit()
+
+    def _acked_set(self, stage: str, country_id: int) -> Set[str]:
+        # Debe llamarse con el lock tomado; se carga una vez por etapa/país y luego se mantiene en memoria.
+        acked = self._acked.get((stage, country_id))
+        if acked is None:
+            rows = self._conn.execute(
+                "SELECT record_key FROM acked_records WHERE stage = ? AND country_id = ?",
+                (stage, country_id),
+            ).fetchall()
+            acked = self._acked[(stage, country_id)] = {row[0] for row in rows}
+        return acked
+
+    def acked_keys(self, stage: str, country_id: int) -> Set[str]:
+        with self._lock:
+            return set(self._acked_set(stage, country_id))
+
+    def ack_records(self, stage: str, country_id: int, record_keys: Iterable[str]) -> None:
+        keys = list(record_keys)
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO acked_records VALUES (?, ?, ?)",
+                [(stage, country_id, key) for key in keys],
+            )
+            self._conn.commit()
+            self._acked_set(stage, country_id).update(keys)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+sync_journal: Optional[SyncJournal] = None
+
+
+def configure_journal(args: argparse.Namespace) -> Optional[SyncJournal]:
+    global sync_journal
+    sync_journal = SyncJournal(args.resume) if args.resume else None
+    if sync_journal is not None:
+        logging.info("Journal de progreso: %s.", args.resume)
+    return sync_journal
+
+
+def default_cache_path() -> str:
+    return os.path.join(os.getcwd(), "exports", "geodivision_cache.sqlite")
@@ -0,0 +1,113 @@
+"""Fixtures compartidas: los servidores simulados de `bench_geodivisions` y corridas en el mismo proceso."""
+
+import argparse
+import dataclasses
+import os
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bench_geodivisions as bench  # noqa: E402
+from geodivisions import breaker, cli, http_client  # noqa: E402
+from geodivisions.metrics import metrics  # noqa: E402
+
+
+@pytest.fixture
+def fake_servers() -> Callable[..., Tuple[bench.FakeServer, bench.FakeServer]]:
+    """Levanta Positiva y backend simulados; devuelve (positiva, backend) y los apaga al terminar."""
+    started: List[bench.FakeServer] = []
+
+    def start(
+        backend_faults: Optional[bench.FaultProfile] = None,
+        positiva_faults: Optional[bench.FaultProfile] = None,
+        countries: int = 3,
+        departments: int = 4,
+        municipios: int = 12,
+        seed: int = 11,
+    ) -> Tuple[bench.FakeServer, bench.FakeServer]:
+        fixtures = bench.FixtureSet.synthetic(countries, departments, municipios, seed)
+        positiva = bench.start_server(bench.FakeState(fixtures, positiva_faults or bench.FaultProfile(), seed))
+        backend = bench.start_server(bench.FakeState(fixtures, backend_faults or bench.FaultProfile(), seed + 1))
+        started.extend([positiva, backend])
+        return positiva, backend
+
+    yield start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def sync_args(tmp_path) -> Callable[..., argparse.Namespace]:
+    """Argumentos de `sync_geodivisions.py` apuntando a los servidores simulados."""
+
+    def build(positiva: bench.FakeServer, backend: bench.FakeServer, *extra: str) -> argparse.Namespace:
+        return cli.parse_args(
+            [
+                "--backend-url",
+                backend.url,
+                "--backend-token",
+                "backend",
+                "--external-token",
+                "externo",
+                "--external-base-url",
+                positiva.url,
+                "--report-file",
+                str(tmp_path / "fallos.csv"),
+                "--max-workers",
+                "2",
+                *extra,
+            ]
+        )
+
+    return build
+
+
+@pytest.fixture
+def configured_run() -> Callable[[argparse.Namespace], Tuple[http_client.TokenProvider, http_client.TokenProvider]]:
+    """Configura el proceso como `main`/`serve` y cierra el estado compartido al terminar la prueba."""
+
+    def configure(args: argparse.Namespace) -> Tuple[http_client.TokenProvider, http_client.TokenProvider]:
+        cli.configure_process(args)
+        tokens = cli.build_token_providers(args)
+        cli.configure_run(args)
+        metrics.start_run()
+        return tokens
+
+    yield configure
+    cli.close_run_state()
+    breaker.circuit_breakers.clear()
+
+
+def counters(server: bench.FakeServer) -> Dict[str, int]:
+    with server.state.lock:
+        return dict(server.state.counters)
+
+
+@dataclasses.dataclass
+class CountryOutage(bench.FaultProfile):
+    """El backend rechaza (501) todos los registros de un país mientras `down` lo indique."""
+
+    down: Optional[int] = None
+
+    def is_poison(self, record: Dict[str, Any]) -> bool:
+        return record.get("idPais") == self.down
+
+
+def stored(server: bench.FakeServer, external_id: int, kind: str) -> int:
+    with server.state.lock:
+        return len(server.state.stored.get((external_id, kind), {}))
+
+
+def stored_records(server: bench.FakeServer) -> Dict[Tuple[int, str], Dict[Tuple[Any, Any], Dict[str, Any]]]:
+    """Copia de todo lo persistido en el backend simulado, por (idPais externo, tipo)."""
+    with server.state.lock:
+        return {key: dict(records) for key, records in server.state.stored.items()}
+
+
+def expected_municipios(server: bench.FakeServer, external_id: int) -> int:
+    fixtures = server.state.fixtures
+    return sum(len(rows) for (country, _), rows in fixtures.municipios.items() if country == external_id)
@@ -0,0 +1,30 @@
+import bench_geodivisions as bench
+from geodivisions import cli
+from conftest import counters, stored_records
+
+
+def test_async_engine_persists_the_same_records_as_threads(fake_servers, sync_args, configured_run, tmp_path):
+    summaries, snapshots = [], []
+    for engine in ("threads", "async"):
+        positiva, backend = fake_servers()
+        args = sync_args(
+            positiva, backend, "--engine", engine, "--resume", str(tmp_path / f"journal-{engine}.sqlite")
+        )
+        summaries.append(cli.run_sync(args, *configured_run(args)))
+        snapshots.append(stored_records(backend))
+
+    threads, asynchronous = summaries
+    assert asynchronous["failures"] == threads["failures"] == 0
+    assert asynchronous["departments_sent"] == threads["departments_sent"]
+    assert asynchronous["municipalities_sent"] == threads["municipalities_sent"] > 0
+    assert snapshots[1] == snapshots[0]
+
+
+def test_async_engine_is_bounded_by_max_workers(fake_servers, sync_args, configured_run):
+    positiva, backend = fake_servers(positiva_faults=bench.FaultProfile(latency_ms=20), countries=4)
+    args = sync_args(positiva, backend, "--engine", "async", "--municipality-workers", "1")
+    summary = cli.run_sync(args, *configured_run(args))
+
+    assert summary["failures"] == 0
+    # --max-workers 2 países, cada uno con una descarga de municipios a la vez.
+    assert counters(positiva)["max_concurrentes"] <= 2
@@ -0,0 +1,28 @@
+from geodivisions import core
+
+
+def test_adaptive_sizer_grows_additively_and_halves_on_trouble(tmp_path):
+    sizer = core.AdaptiveBatchSizer(initial=100, minimum=10, maximum=130, step=20, latency_budget=1.0)
+    endpoint = "backend/municipios"
+
+    for _ in range(core.ADAPTIVE_SUCCESS_STREAK):
+        # Las colas más cortas que el tamaño vigente no cuentan para crecer.
+        sizer.record_success(endpoint, 40, 0.1)
+        sizer.record_success(endpoint, 100, 0.1)
+    assert sizer.current(endpoint) == 120
+    for _ in range(core.ADAPTIVE_SUCCESS_STREAK):
+        sizer.record_success(endpoint, 120, 0.1)
+    assert sizer.current(endpoint) == 130
+
+    sizer.record_success(endpoint, 130, 5.0)
+    assert sizer.current(endpoint) == 65
+    sizer.record_split(endpoint, 30)
+    assert sizer.current(endpoint) == 15
+    sizer.record_split(endpoint, 15)
+    assert sizer.current(endpoint) == 10
+
+    path = tmp_path / "lotes.json"
+    sizer.save(str(path))
+    learned = core.AdaptiveBatchSizer.load(str(path))
+    assert core.AdaptiveBatchSizer(100, 20, 130, 20, 1.0, learned).current(endpoint) == 20
+    assert core.AdaptiveBatchSizer.load(str(tmp_path / "no-existe.json")) == {}
@@ -0,0 +1,129 @@
+import time
+
+import bench_geodivisions as bench
+import pytest
+from geodivisions import cli, http_client
+from geodivisions.breaker import CircuitBreaker, CircuitOpenError
+from geodivisions.metrics import metrics
+from conftest import counters
+
+
+def wait_out(breaker: CircuitBreaker) -> None:
+    time.sleep(max(0.0, breaker._opened_until - time.monotonic()) + 0.01)
+
+
+def test_breaker_open_half_open_closed_transitions():
+    breaker = CircuitBreaker("backend/lote", threshold=2, cooldown=0.05, max_cooldown=0.2)
+
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call(0)
+
+    wait_out(breaker)
+    breaker.before_call(0)
+    assert breaker.state == breaker.HALF_OPEN
+    # Una sola petición de prueba a la vez.
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call(0)
+
+    # La prueba falla: se reabre con el cooldown duplicado.
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert breaker._cooldown == pytest.approx(0.1)
+
+    wait_out(breaker)
+    breaker.before_call(0)
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    assert breaker._cooldown == pytest.approx(0.05)
+
+
+def test_wait_until_ready_does_not_hold_the_probe():
+    breaker = CircuitBreaker("backend/lote", threshold=1, cooldown=0.05)
+    breaker.record_failure()
+
+    assert breaker.wait_until_ready(0) is False
+    assert breaker.wait_until_ready(1.0) is True
+    # La prueba queda libre para el envío real.
+    breaker.before_call(0)
+    assert breaker.state == breaker.HALF_OPEN
+
+
+def test_outage_parks_batches_and_final_pass_delivers(fake_servers, sync_args, configured_run, monkeypatch):
+    positiva, backend = fake_servers(countries=4)
+    outage = {"left": 6}
+    faulted = bench.FakeHandler._faulted
+
+    def post_outage(handler):
+        if handler.command == "POST" and handler.server is backend:
+            with backend.state.lock:
+                failing = outage["left"] > 0
+                outage["left"] -= failing
+            if failing:
+                handler._send_json(503, {"error": "caída simulada"})
+                return True
+        return faulted(handler)
+
+    monkeypatch.setattr(bench.FakeHandler, "_faulted", post_outage)
+    args = sync_args(
+        positiva, backend, "--status-retries", "0", "--breaker-threshold", "2", "--breaker-cooldown", "0.2", "--chunk-size", "10"
+    )
+    backend_token, external_token = configured_run(args)
+
+    summary = cli.run_sync(args, backend_token, external_token)
+
+    parked = [row for row in metrics.summary()["counters"] if row["name"] == "records_parked_total"]
+    assert parked
+    assert summary["failures"] == 0
+    assert counters(backend)["municipios_recibidos"] == summary["municipalities_sent"]
+    assert summary["municipalities_sent"] == sum(map(len, positiva.state.fixtures.municipios.values()))
+
+
+def test_final_pass_waits_at_most_breaker_max_wait(fake_servers, sync_args, configured_run, monkeypatch, caplog):
+    positiva, backend = fake_servers(countries=2)
+    faulted = bench.FakeHandler._faulted
+
+    def post_outage(handler):
+        if handler.command == "POST" and handler.server is backend:
+            handler._send_json(503, {"error": "caída simulada"})
+            return True
+        return faulted(handler)
+
+    monkeypatch.setattr(bench.FakeHandler, "_faulted", post_outage)
+    args = sync_args(
+        positiva,
+        backend,
+        "--status-retries",
+        "0",
+        "--breaker-threshold",
+        "2",
+        "--breaker-cooldown",
+        "60",
+        "--breaker-max-wait",
+        "0.2",
+        "--breaker-passes",
+        "2",
+    )
+    backend_token, external_token = configured_run(args)
+
+    started = time.monotonic()
+    summary = cli.run_sync(args, backend_token, external_token)
+
+    # Sin la cota cada pasada esperaría el cooldown completo (60s) en el hilo principal.
+    assert time.monotonic() - started < 10
+    assert summary["departments_sent"] == summary["municipalities_sent"] == 0
+    assert summary["failures"] > 0
+    assert "sigue abierto; sus lotes quedan aparcados" in caplog.text
+
+
+def test_breaker_does_not_change_status_retries(fake_servers, sync_args, configured_run):
+    positiva, backend = fake_servers()
+    configured_run(sync_args(positiva, backend, "--breaker-threshold", "3"))
+    retries = http_client.http_pool.adapter().max_retries
+    assert retries.status == 5 and 503 in retries.status_forcelist
+
+    configured_run(sync_args(positiva, backend, "--breaker-threshold", "3", "--status-retries", "0"))
+    assert not http_client.http_pool.adapter().max_retries.status_forcelist
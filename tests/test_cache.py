@@ -0,0 +1,80 @@
+import threading
+import time
+
+from geodivisions import cli, storage
+from conftest import counters
+
+ROWS = [{"consecutivo": 1, "nombre": "Uno"}]
+
+
+def test_read_mode_serves_entries_within_the_ttl(tmp_path, monkeypatch):
+    cache = storage.ResponseCache(str(tmp_path / "cache.sqlite"), "read", ttl_seconds=60)
+    assert cache.lookup("municipios", 7, 1) == (False, None)
+    assert cache.store("municipios", 7, 1, ROWS)
+    assert not cache.store("municipios", 7, 1, ROWS)
+    assert cache.lookup("municipios", 7, 1) == (True, ROWS)
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.lookup("municipios", 7, 1) == (False, None)
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.close()
+
+
+def test_refresh_ignores_and_offline_keeps_expired_entries(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite")
+    cache = storage.ResponseCache(path, "read", ttl_seconds=60)
+    cache.store("municipios", 7, 1, ROWS)
+    cache.close()
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 3600)
+
+    refresh = storage.ResponseCache(path, "refresh", ttl_seconds=60)
+    assert refresh.lookup("municipios", 7, 1) == (False, None)
+    refresh.close()
+    offline = storage.ResponseCache(path, "offline", ttl_seconds=60)
+    assert offline.lookup("municipios", 7, 1) == (True, ROWS)
+    assert offline.lookup("municipios", 7, 2) == (False, None)
+    offline.close()
+
+
+def test_hit_and_miss_counts_are_exact_across_threads(tmp_path):
+    cache = storage.ResponseCache(str(tmp_path / "cache.sqlite"), "read", ttl_seconds=60)
+    cache.store("municipios", 7, 1, ROWS)
+
+    def lookups() -> None:
+        for division in range(200):
+            cache.lookup("municipios", 7, division % 2)
+
+    threads = [threading.Thread(target=lookups) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (cache.hits, cache.misses) == (800, 800)
+    cache.close()
+
+
+def test_offline_run_replays_a_warm_cache_without_calling_positiva(fake_servers, sync_args, configured_run, tmp_path):
+    cache_file = str(tmp_path / "cache.sqlite")
+    positiva, backend = fake_servers(countries=2, departments=2, municipios=4)
+    args = sync_args(positiva, backend, "--cache-mode", "read", "--cache-file", cache_file)
+    warm = cli.run_sync(args, *configured_run(args))
+    requests = counters(positiva)["requests"]
+
+    offline_args = sync_args(positiva, backend, "--cache-mode", "offline", "--cache-file", cache_file)
+    offline = cli.run_sync(offline_args, *configured_run(offline_args))
+
+    assert counters(positiva)["requests"] == requests
+    assert offline["failures"] == warm["failures"] == 0
+    assert offline["municipalities_sent"] == warm["municipalities_sent"] > 0
+
+
+def test_offline_run_with_a_cold_cache_reports_fetch_failures(fake_servers, sync_args, configured_run, tmp_path):
+    positiva, backend = fake_servers(countries=2, departments=2, municipios=4)
+    args = sync_args(positiva, backend, "--cache-mode", "offline", "--cache-file", str(tmp_path / "cache.sqlite"))
+    summary = cli.run_sync(args, *configured_run(args))
+
+    assert "requests" not in counters(positiva)
+    assert summary["failed_countries"] == 2
+    assert summary["municipalities_sent"] == 0
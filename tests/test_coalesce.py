@@ -0,0 +1,20 @@
+import pytest
+from geodivisions import cli, storage
+from conftest import CountryOutage, expected_municipios, stored
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_coalesced_failures_map_back_to_their_country(fake_servers, sync_args, configured_run, engine):
+    positiva, backend = fake_servers(CountryOutage(down=1002), departments=2, municipios=6)
+    args = sync_args(positiva, backend, "--engine", engine, "--coalesce", "--coalesce-window-ms", "50")
+    summary = cli.run_sync(args, *configured_run(args))
+
+    failures = storage.read_failures_report(summary["report_file"])
+    assert summary["failed_countries"] == 1
+    assert {(failure.country_id, failure.external_id) for failure in failures} == {(2, 1002)}
+    # Cada registro rechazado aparece una sola vez, en el fallo de su país.
+    failed = [key for failure in failures for key in failure.records]
+    assert len(failed) == len(set(failed))
+    for external_id in (1001, 1003):
+        assert stored(backend, external_id, "municipios") == expected_municipios(positiva, external_id)
+    assert stored(backend, 1002, "municipios") == 0
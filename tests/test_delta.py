@@ -0,0 +1,127 @@
+import logging
+
+import bench_geodivisions as bench
+import pytest
+from geodivisions import cli, core
+from geodivisions.metrics import metrics
+from geodivisions.records import (
+    DeltaStats,
+    MunicipioBuffer,
+    MunicipioRecord,
+    collect_municipio_buffer,
+    diff_payloads,
+    municipio_payload_key,
+)
+from conftest import counters
+
+DELTA_ARGS = (
+    "--delta-sync",
+    "--backend-departments-path",
+    bench.STATE_PATHS[0],
+    "--backend-municipios-path",
+    bench.STATE_PATHS[1],
+)
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_unreadable_backend_state_warns_once_per_run(fake_servers, sync_args, configured_run, caplog, engine):
+    positiva, backend = fake_servers(countries=4)
+    args = sync_args(
+        positiva, backend, "--engine", engine, *DELTA_ARGS, "--backend-departments-path", "/sin-estado/{idPais}"
+    )
+    backend_token, external_token = configured_run(args)
+
+    for _ in range(2):
+        caplog.clear()
+        with caplog.at_level(logging.WARNING):
+            summary = cli.run_sync(args, backend_token, external_token)
+
+        warnings = [r for r in caplog.records if "estado del backend" in r.getMessage()]
+        assert len(warnings) == 1
+        assert summary["backend_state_failures"] == 4
+    # Sin estado se envía todo en ambas corridas.
+    assert counters(backend)["municipios_recibidos"] == 2 * summary["municipalities_sent"]
+    counted = [row["value"] for row in metrics.summary()["counters"] if row["name"] == "backend_state_failures_total"]
+    assert counted and counted[0] >= 8
+
+
+def test_delta_sync_sends_only_new_and_changed_records(fake_servers, sync_args, configured_run):
+    positiva, backend = fake_servers(countries=2)
+    args = sync_args(positiva, backend, *DELTA_ARGS)
+    backend_token, external_token = configured_run(args)
+    total = sum(map(len, positiva.state.fixtures.municipios.values()))
+
+    first = cli.run_sync(args, backend_token, external_token)
+    assert first["municipalities_sent"] == total
+    assert first["municipality_delta"] == {"new": total, "changed": 0, "unchanged": 0}
+
+    next(iter(positiva.state.fixtures.municipios.values()))[0]["nombreCiudad"] = "Renombrada"
+    received = counters(backend)["municipios_recibidos"]
+    second = cli.run_sync(args, backend_token, external_token)
+
+    assert second["municipality_delta"] == {"new": 0, "changed": 1, "unchanged": total - 1}
+    assert second["departments_sent"] == 0
+    assert counters(backend)["municipios_recibidos"] - received == 1
+
+
+def test_backend_rows_without_a_diff_field_are_resent(fake_servers, sync_args, configured_run):
+    positiva, backend = fake_servers(countries=2)
+    args = sync_args(positiva, backend, *DELTA_ARGS)
+    backend_token, external_token = configured_run(args)
+    total = cli.run_sync(args, backend_token, external_token)["municipalities_sent"]
+
+    # El GET del backend deja de devolver divipola: no se puede saber si cambió, así que se envía.
+    with backend.state.lock:
+        for (_, kind), records in backend.state.stored.items():
+            if kind == "municipios":
+                for record in records.values():
+                    record.pop("divipola")
+    received = counters(backend)["municipios_recibidos"]
+    summary = cli.run_sync(args, backend_token, external_token)
+
+    assert summary["municipality_delta"] == {"new": 0, "changed": total, "unchanged": 0}
+    assert counters(backend)["municipios_recibidos"] - received == total
+
+
+def test_delta_sync_requires_the_state_paths():
+    with pytest.raises(SystemExit):
+        cli.parse_args(["--backend-token", "b", "--external-token", "e", "--delta-sync"])
+
+
+def test_diff_payloads_counts_new_changed_and_unchanged():
+    existing = {
+        1: {"idMunicipio": 1, "nombreMunicipio": "Uno", "divipola": None},
+        2: {"idMunicipio": 2, "nombreMunicipio": "Dos"},
+        3: {"idMunicipio": 3, "nombreMunicipio": "Tres", "divipola": "003"},
+        5: {"idMunicipio": "5", "nombreMunicipio": "Cinco", "divipola": 5},
+    }
+    payloads = [
+        # null en el backend y "" local son valores distintos.
+        {"idMunicipio": 1, "nombreMunicipio": "Uno", "divipola": ""},
+        # El backend no expone divipola para este registro: cuenta como modificado.
+        {"idMunicipio": 2, "nombreMunicipio": "Dos", "divipola": "002"},
+        {"idMunicipio": 3, "nombreMunicipio": "Tres", "divipola": "333"},
+        {"idMunicipio": 4, "nombreMunicipio": "Cuatro", "divipola": "004"},
+        {"idMunicipio": 5, "nombreMunicipio": "Cinco", "divipola": "5"},
+    ]
+    stats = DeltaStats(new=1)
+
+    pending, returned = diff_payloads(
+        payloads, existing, lambda p: int(p["idMunicipio"]), ("nombreMunicipio", "divipola"), stats
+    )
+
+    assert [p["idMunicipio"] for p in pending] == [1, 2, 3, 4]
+    assert returned is stats
+    assert stats == DeltaStats(new=2, changed=3, unchanged=1)
+
+
+def test_diff_payloads_keeps_a_municipio_buffer_columnar():
+    fetched = [MunicipioRecord(n, f"Ciudad {n}", f"{n:03d}", {}) for n in range(1, 5)]
+    buffer = collect_municipio_buffer(1001, 10, 100, "Norte", fetched)
+    existing = {(100, 1): buffer[0], (100, 3): dict(buffer[2], nombreMunicipio="Antes")}
+
+    pending, stats = diff_payloads(buffer, existing, municipio_payload_key, core.MUNICIPIO_DIFF_FIELDS)
+
+    assert isinstance(pending, MunicipioBuffer)
+    assert list(pending) == [buffer[1], buffer[2], buffer[3]]
+    assert stats == DeltaStats(new=2, changed=1, unchanged=1)
@@ -0,0 +1,45 @@
+import bench_geodivisions as bench
+import pytest
+from geodivisions import cli, http_client
+from geodivisions.metrics import metrics
+from conftest import counters
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_plain_bodies_use_encode_json(fake_servers, sync_args, configured_run, monkeypatch, engine):
+    positiva, backend = fake_servers()
+    encoded = []
+    original = http_client.encode_json
+
+    def counting(payload):
+        encoded.append(len(payload))
+        return original(payload)
+
+    monkeypatch.setattr(http_client, "encode_json", counting)
+    args = sync_args(positiva, backend, "--engine", engine)
+    backend_token, external_token = configured_run(args)
+
+    summary = cli.run_sync(args, backend_token, external_token)
+
+    assert sum(encoded) == summary["departments_sent"] + summary["municipalities_sent"]
+    assert counters(backend)["municipios_recibidos"] == summary["municipalities_sent"]
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_gzip_rejected_with_415_falls_back_to_plain_json(fake_servers, sync_args, configured_run, engine):
+    positiva, backend = fake_servers(bench.FaultProfile(reject_gzip=True))
+    args = sync_args(positiva, backend, "--engine", engine, "--gzip-requests")
+    backend_token, external_token = configured_run(args)
+
+    summary = cli.run_sync(args, backend_token, external_token)
+
+    assert summary["failures"] == 0
+    assert counters(backend)["municipios_recibidos"] == summary["municipalities_sent"] > 0
+    host = backend.url.split("//")[1]
+    fallbacks = [
+        row["value"]
+        for row in metrics.summary()["counters"]
+        if row["name"] == "gzip_fallbacks_total" and row["labels"] == {"host": host}
+    ]
+    # El primer 415 deja al host en JSON plano el resto de la corrida.
+    assert fallbacks == [1]
@@ -0,0 +1,46 @@
+import threading
+
+from geodivisions import cli, core, storage
+from conftest import CountryOutage
+
+
+def test_jsonl_report_reads_back_as_failures(fake_servers, sync_args, configured_run, tmp_path):
+    positiva, backend = fake_servers(CountryOutage(down=1003), departments=2, municipios=6)
+    report = tmp_path / "fallos.jsonl"
+    args = sync_args(positiva, backend, "--report-file", str(report))
+    summary = cli.run_sync(args, *configured_run(args))
+
+    assert summary["report_file"] == str(report)
+    failures = storage.read_failures_report(str(report))
+    assert len(failures) == summary["failures"] > 0
+    assert {failure.external_id for failure in failures} == {1003}
+    assert all(failure.payload for failure in failures if failure.stage.startswith("persist_"))
+    assert core.current_run().failure_sink is None
+
+
+def test_sink_starts_its_writer_with_the_first_failure(tmp_path):
+    report = tmp_path / "fallos.jsonl"
+    sink = storage.FailureSink(str(report))
+    assert not any(thread.name == "reporte-fallos" for thread in threading.enumerate())
+    sink.close()
+    assert not report.exists()
+
+    sink = storage.FailureSink(str(report))
+    failure = storage.SyncFailure(
+        country_id=7, external_id=1007, stage="persist_departamentos", status=None, message="x", records=["1"]
+    )
+    sink.put(failure)
+    sink.close()
+    assert storage.read_failures_report(str(report)) == [failure]
+
+
+def test_end_run_detaches_the_sink(tmp_path):
+    run = core.begin_run()
+    run.failure_sink = storage.FailureSink(str(tmp_path / "fallos.csv"))
+    core.end_run()
+    assert core.current_run().failure_sink is None
+
+    log = core.FailureLog()
+    log.append(storage.SyncFailure(country_id=7, external_id=None, stage="fetch_municipios", status=None, message="x"))
+    assert len(log) == 1
+    assert not (tmp_path / "fallos.csv").exists()
@@ -0,0 +1,25 @@
+from geodivisions import cli, http_client
+from conftest import counters
+
+
+def test_pool_stats_count_reused_connections(fake_servers, sync_args, configured_run):
+    positiva, backend = fake_servers(countries=2, departments=3, municipios=4)
+    args = sync_args(positiva, backend, "--municipality-workers", "2")
+    summary = cli.run_sync(args, *configured_run(args))
+    assert summary["failures"] == 0
+
+    stats = http_client.http_pool.stats()
+    for server in (positiva, backend):
+        entry = stats[server.url.split("//")[1]]
+        assert entry["requests"] == counters(server)["requests"]
+        # Todos los hilos comparten el adaptador: cada conexión se abre una vez y se reutiliza.
+        assert 0 < entry["connections"] <= http_client.http_pool.maxsize
+        assert entry["reused"] == entry["requests"] - entry["connections"] > 0
+
+
+def test_reconfiguring_the_pool_starts_new_stats():
+    pool = http_client.SharedConnectionPool()
+    pool.adapter()
+    pool.configure(4)
+    assert pool.stats() == {}
+    assert pool.adapter().poolmanager.connection_pool_kw["maxsize"] == 4
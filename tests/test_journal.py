@@ -0,0 +1,27 @@
+from geodivisions import cli
+from conftest import CountryOutage, counters, expected_municipios, stored
+
+
+def test_resume_only_sends_what_the_journal_did_not_ack(fake_servers, sync_args, configured_run, tmp_path):
+    outage = CountryOutage(down=1002)
+    positiva, backend = fake_servers(outage, departments=2, municipios=6)
+    args = sync_args(positiva, backend, "--resume", str(tmp_path / "journal.sqlite"))
+    backend_token, external_token = configured_run(args)
+
+    first = cli.run_sync(args, backend_token, external_token)
+    assert first["failures"] > 0
+    assert first["failed_countries"] == 1
+    assert stored(backend, 1002, "municipios") == 0
+
+    outage.down = None
+    received = counters(backend)["municipios_recibidos"]
+    fetched = counters(positiva)["requests"]
+    second = cli.run_sync(args, backend_token, external_token)
+
+    assert second["failures"] == 0
+    # Solo se reenvía el país caído; los terminados se omiten sin volver a descargarse.
+    assert counters(backend)["municipios_recibidos"] - received == expected_municipios(positiva, 1002)
+    assert stored(backend, 1002, "municipios") == expected_municipios(positiva, 1002)
+    assert counters(positiva)["requests"] - fetched <= 1
+    third = cli.run_sync(args, backend_token, external_token)
+    assert third["municipalities_sent"] == 0
@@ -0,0 +1,51 @@
+import json
+
+from geodivisions import cli, core
+from geodivisions.metrics import SyncMetrics, metrics
+from conftest import counters
+
+
+def requests_to(rows, host):
+    return sum(row["value"] for row in rows if row["name"] == "http_requests_total" and row["labels"]["host"] == host)
+
+
+def test_prometheus_text_has_histograms_counters_and_country_gauges():
+    metrics = SyncMetrics()
+    metrics.observe("persist_municipios", 0.2)
+    metrics.observe("persist_municipios", 3.0)
+    metrics.inc("http_retries_total", host="backend", reason="503")
+    metrics.inc("http_retries_total", 2, host="backend", reason="503")
+    metrics.record_country(core.SyncResult(country_id=7, external_id=1007, municipalities_sent=10), 2.0)
+
+    lines = metrics.to_prometheus().splitlines()
+
+    assert "# TYPE geodivision_stage_latency_seconds histogram" in lines
+    assert 'geodivision_stage_latency_seconds_bucket{stage="persist_municipios",le="0.25"} 1' in lines
+    assert 'geodivision_stage_latency_seconds_bucket{stage="persist_municipios",le="2.5"} 1' in lines
+    assert 'geodivision_stage_latency_seconds_bucket{stage="persist_municipios",le="+Inf"} 2' in lines
+    assert 'geodivision_stage_latency_seconds_sum{stage="persist_municipios"} 3.200000' in lines
+    assert 'geodivision_http_retries_total{host="backend",reason="503"} 3' in lines
+    assert 'geodivision_country_records_per_second{country_id="7",external_id="1007"} 5.0' in lines
+
+
+def test_metrics_files_describe_the_run(fake_servers, sync_args, configured_run, tmp_path):
+    positiva, backend = fake_servers(countries=2, departments=2, municipios=4)
+    prometheus_file, json_file = tmp_path / "metricas.prom", tmp_path / "metricas.json"
+    args = sync_args(positiva, backend, "--metrics-file", str(prometheus_file), "--metrics-json", str(json_file))
+    tokens = configured_run(args)
+    positiva_host = positiva.url.split("//")[1]
+    before = requests_to(metrics.summary()["counters"], positiva_host)
+
+    summary = cli.run_sync(args, *tokens)
+
+    exported = json.loads(json_file.read_text(encoding="utf-8"))
+    assert {row["external_id"] for row in exported["countries"]} == {1001, 1002}
+    assert sum(row["records_sent"] for row in exported["countries"]) == (
+        summary["departments_sent"] + summary["municipalities_sent"]
+    )
+    assert exported["stages"]["fetch_municipios"]["count"] >= 4
+    assert exported["stages"]["persist_municipios"]["count"] >= 2
+    assert requests_to(exported["counters"], positiva_host) - before == counters(positiva)["requests"]
+    text = prometheus_file.read_text(encoding="utf-8")
+    assert 'geodivision_stage_latency_seconds_count{stage="persist_departamentos"}' in text
+    assert 'geodivision_country_records_per_second{country_id="1",external_id="1001"}' in text
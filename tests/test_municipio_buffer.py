@@ -0,0 +1,42 @@
+from geodivisions import records
+
+
+def municipios(*rows):
+    return [records.MunicipioRecord(consecutivo, name, divipola, {}) for consecutivo, name, divipola in rows]
+
+
+def test_municipio_buffer_slices_match_payload_dicts():
+    first = municipios((1, "Uno", "001"), ("02", "Dos", None), (3, "Tres", "003"))
+    second = municipios((7, "Siete", "007"), (8, "Ocho", "008"))
+    buffer = records.MunicipioBuffer(1001)
+    buffer.add_department(10, 100, "Norte", first)
+    buffer.add_department(20, 200, None, second)
+    expected = records.collect_municipio_payloads(1001, 10, 100, "Norte", first) + records.collect_municipio_payloads(
+        1001, 20, 200, None, second
+    )
+
+    assert len(buffer) == 5
+    assert list(buffer) == expected
+    assert buffer[1:4] == expected[1:4]
+    assert buffer[3:99] == expected[3:]
+    assert buffer[-1] == expected[-1]
+    # Un consecutivo que no llegó como int se envía tal cual.
+    assert buffer[1]["idMunicipio"] == "02"
+
+
+def test_merge_municipio_batches_keeps_first_department_per_remote_id():
+    norte = records.collect_municipio_buffer(1001, 10, 100, "Norte", municipios((1, "Uno", "001"), (2, "Dos", "002")))
+    repetido = records.collect_municipio_buffer(
+        1001, 11, 100, "Norte bis", municipios((2, "Otro", "x"), (4, "Cuatro", "004"))
+    )
+    sur = records.collect_municipio_buffer(1001, 20, 200, "Sur", municipios((2, "Dos sur", "202")))
+
+    merged = records.merge_municipio_batches(1001, [norte, repetido, records.MunicipioBuffer(1001), sur])
+
+    assert [(p["idDepartamento"], p["idMunicipio"], p["nombreMunicipio"]) for p in merged] == [
+        (100, 1, "Uno"),
+        (100, 2, "Dos"),
+        (100, 4, "Cuatro"),
+        (200, 2, "Dos sur"),
+    ]
+    assert merged[2]["idDivisionPolitica"] == 11
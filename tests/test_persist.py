@@ -0,0 +1,54 @@
+import argparse
+
+import bench_geodivisions as bench
+import pytest
+from geodivisions import cli, core
+
+
+def sent_and_failures(summary):
+    return summary["departments_sent"], summary["municipalities_sent"], summary["failures"]
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_inflight_lanes_keep_sent_and_failure_counts(fake_servers, sync_args, configured_run, engine):
+    if engine == "async":
+        pytest.importorskip("aiohttp")
+    positiva, backend = fake_servers(bench.FaultProfile(poison_rate=0.02), countries=3, municipios=30)
+    outcomes = []
+    for inflight in ("1", "4"):
+        args = sync_args(positiva, backend, "--engine", engine, "--chunk-size", "15", "--persist-inflight", inflight)
+        backend_token, external_token = configured_run(args)
+        outcomes.append(sent_and_failures(cli.run_sync(args, backend_token, external_token)))
+        core.close_persist_lanes()
+
+    assert outcomes[0] == outcomes[1]
+    assert outcomes[0][2] > 0
+
+
+@pytest.mark.parametrize("extra", [("--engine", "scheduler"), ("--coalesce",)])
+def test_inflight_is_ignored_when_sends_are_owned_elsewhere(fake_servers, sync_args, configured_run, extra):
+    positiva, backend = fake_servers()
+    args = sync_args(positiva, backend, "--persist-inflight", "4", *extra)
+    configured_run(args)
+
+    assert core.persist_lanes is None
+    assert core.persist_inflight_limit(core.MUNICIPIOS_ENDPOINT) == 1
+    assert core.extra_persist_lanes(args) == 0
+
+
+def test_lanes_share_one_bounded_pool(fake_servers, sync_args, configured_run):
+    positiva, backend = fake_servers()
+    args = sync_args(positiva, backend, "--persist-inflight", "municipios=3", "--max-workers", "2")
+    configured_run(args)
+
+    assert core.persist_lanes is not None
+    assert core.persist_lanes._max_workers == 4
+    assert core.persist_inflight_limit(core.DEPARTMENTS_ENDPOINT) == 1
+
+
+def test_persist_inflight_values():
+    assert core.parse_persist_inflight("3") == {core.DEPARTMENTS_ENDPOINT: 3, core.MUNICIPIOS_ENDPOINT: 3}
+    assert core.parse_persist_inflight("municipios=5") == {core.MUNICIPIOS_ENDPOINT: 5}
+    for invalid in ("0", "x", "paises=2"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            core.parse_persist_inflight(invalid)
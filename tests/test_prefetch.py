@@ -0,0 +1,36 @@
+import bench_geodivisions as bench
+from geodivisions import cli
+from geodivisions.metrics import metrics
+from conftest import counters, stored_records
+
+
+def prefetch_results():
+    return {
+        row["labels"]["result"]: row["value"]
+        for row in metrics.summary()["counters"]
+        if row["name"] == "departments_prefetch_total"
+    }
+
+
+def test_threaded_engine_takes_departments_from_the_prefetch(fake_servers, sync_args, configured_run):
+    positiva, backend = fake_servers(positiva_faults=bench.FaultProfile(latency_ms=10), countries=4, departments=2)
+    args = sync_args(positiva, backend, "--max-workers", "1", "--prefetch-departments", "2")
+    tokens = configured_run(args)
+    before = prefetch_results()
+
+    summary = cli.run_sync(args, *tokens)
+
+    used = {result: value - before.get(result, 0) for result, value in prefetch_results().items()}
+    assert summary["failures"] == 0
+    assert sum(used.values()) == 4
+    # Con un solo hilo de países el prefetch va por delante: salvo el primero, cada país encuentra su lista
+    # ya descargada o en curso.
+    assert used.get("ready", 0) + used.get("waited", 0) >= 3
+    # Cada lista de departamentos se descarga una sola vez.
+    departments = sum(len(rows) for rows in positiva.state.fixtures.departments.values())
+    assert counters(positiva)["requests"] == 4 + departments
+
+    plain_positiva, plain_backend = fake_servers(countries=4, departments=2)
+    plain_args = sync_args(plain_positiva, plain_backend, "--max-workers", "1")
+    cli.run_sync(plain_args, *configured_run(plain_args))
+    assert stored_records(backend) == stored_records(plain_backend)
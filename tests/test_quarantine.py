@@ -0,0 +1,69 @@
+import dataclasses
+import json
+
+import bench_geodivisions as bench
+from geodivisions import cli, core
+from conftest import counters
+
+
+# Un 500, que urllib3/aiohttp reintentan (--status-retries por defecto), y no un status raro como 501.
+POISON = bench.FaultProfile(poison_rate=0.03, poison_status=500)
+
+
+def quarantine_args(sync_args, positiva, backend, path, *extra):
+    # Sin backoff solo para que la prueba sea rápida; los reintentos siguen activos.
+    return sync_args(
+        positiva, backend, "--quarantine-file", str(path), "--chunk-size", "20", "--retry-backoff", "0", *extra
+    )
+
+
+def test_quarantine_file_survives_and_skip_mode_never_resends(fake_servers, sync_args, configured_run, tmp_path):
+    positiva, backend = fake_servers(dataclasses.replace(POISON))
+    path = tmp_path / "cuarentena.json"
+    args = quarantine_args(sync_args, positiva, backend, path)
+    backend_token, external_token = configured_run(args)
+    cli.run_sync(args, backend_token, external_token)
+
+    saved = json.loads(path.read_text(encoding="utf-8"))["records"]
+    assert saved
+    assert all(entry["hits"] == 1 and entry["status"] == 500 for entry in saved.values())
+
+    # Proceso nuevo: la cuarentena se carga del archivo.
+    skip_args = quarantine_args(sync_args, positiva, backend, path, "--quarantine-mode", "skip")
+    configured_run(skip_args)
+    assert len(core.record_quarantine) == len(saved)
+    rejected = counters(backend)["poison_rechazados"]
+    summary = cli.run_sync(skip_args, backend_token, external_token)
+
+    assert counters(backend)["poison_rechazados"] == rejected
+    assert summary["failures"] == 0
+    assert json.loads(path.read_text(encoding="utf-8"))["records"].keys() == saved.keys()
+
+
+def test_records_fixed_at_the_backend_leave_the_quarantine(fake_servers, sync_args, configured_run, tmp_path):
+    positiva, backend = fake_servers(dataclasses.replace(POISON))
+    path = tmp_path / "cuarentena.json"
+    args = quarantine_args(sync_args, positiva, backend, path)
+    backend_token, external_token = configured_run(args)
+    cli.run_sync(args, backend_token, external_token)
+    assert len(core.record_quarantine) > 0
+
+    backend.state.faults.poison_rate = 0.0
+    summary = cli.run_sync(args, backend_token, external_token)
+
+    assert summary["failures"] == 0
+    assert len(core.record_quarantine) == 0
+    assert json.loads(path.read_text(encoding="utf-8"))["records"] == {}
+
+
+def test_async_engine_isolates_a_retried_500(fake_servers, sync_args, configured_run, tmp_path):
+    positiva, backend = fake_servers(dataclasses.replace(POISON, poison_rate=0.05), departments=2)
+    path = tmp_path / "cuarentena.json"
+    args = quarantine_args(sync_args, positiva, backend, path, "--engine", "async")
+    backend_token, external_token = configured_run(args)
+
+    summary = cli.run_sync(args, backend_token, external_token)
+
+    entries = json.loads(path.read_text(encoding="utf-8"))["records"]
+    assert entries and summary["failures"] == len(entries)
+    assert {entry["status"] for entry in entries.values()} == {500}
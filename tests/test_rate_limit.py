@@ -0,0 +1,36 @@
+import dataclasses
+import time
+from typing import List, Optional
+
+import bench_geodivisions as bench
+import pytest
+from geodivisions import cli
+from conftest import counters
+
+
+@dataclasses.dataclass
+class ArrivalLog(bench.FaultProfile):
+    """Registra el instante de llegada de cada petición al servidor simulado."""
+
+    arrivals: List[float] = dataclasses.field(default_factory=list)
+
+    def apply(self, rng) -> Optional[int]:
+        self.arrivals.append(time.monotonic())
+        return super().apply(rng)
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_external_rps_counts_every_attempt(fake_servers, sync_args, configured_run, engine):
+    faults = ArrivalLog(error_rate=0.3, error_status=503)
+    positiva, backend = fake_servers(positiva_faults=faults, countries=2, departments=3, municipios=3)
+    args = sync_args(
+        positiva, backend, "--engine", engine, "--external-rps", "20", "--external-burst", "1", "--retry-backoff", "0"
+    )
+    summary = cli.run_sync(args, *configured_run(args))
+
+    assert summary["failures"] == 0
+    # Una descarga de departamentos y una de municipios por departamento, más los reintentos por 503.
+    assert counters(positiva)["injected_503"] > 0
+    assert len(faults.arrivals) == 2 * (1 + 3) + counters(positiva)["injected_503"]
+    elapsed = faults.arrivals[-1] - faults.arrivals[0]
+    assert (len(faults.arrivals) - 1) / elapsed <= 20 * 1.1
@@ -0,0 +1,33 @@
+import functools
+
+import pytest
+from geodivisions import records
+
+
+def or_chain(record, candidates):
+    return functools.reduce(lambda a, b: a or b, [record.get(key) for key in candidates])
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        {"consecutivo": 0, "conscutivo": 5, "nombreCiudad": "a", "codigoDivipola": ""},
+        {"idMunicipio": 7, "NOMBRE_CIUDAD": "b"},
+        {"consecutivo": 0, "nombreCiudad": "", "CODIGO_DIVIPOLA": ""},
+        {"consecutivo": 3, "CONSECUTIVO": None, "nombreCiudad": "", "NOMBRE_CIUDAD": ""},
+        {},
+    ],
+)
+def test_normalized_municipio_matches_or_chains(record):
+    expected = [or_chain(record, keys) for keys in records.MUNICIPIO_FIELD_KEYS.values()]
+
+    normalized = records.normalize_municipios([record])
+
+    # Sin consecutivo el registro se descarta.
+    assert normalized == ([] if expected[0] is None else [records.MunicipioRecord(*expected, record)])
+
+
+def test_department_remote_id_falls_back_to_division_id():
+    deps = records.normalize_departments([{"idDivisionPolitica": 4, "nombreEstado": "X"}, {"idDivisionPolitica": 4}])
+
+    assert deps == [records.DepartmentRecord(4, 4, "X", "X", {"idDivisionPolitica": 4, "nombreEstado": "X"})]
@@ -0,0 +1,24 @@
+from geodivisions import cli
+from conftest import CountryOutage, counters, expected_municipios, stored
+
+
+def test_replay_resends_only_the_failed_batches(fake_servers, sync_args, configured_run, tmp_path):
+    outage = CountryOutage(down=1003)
+    positiva, backend = fake_servers(outage, departments=2, municipios=6)
+    args = sync_args(positiva, backend)
+    backend_token, external_token = configured_run(args)
+    first = cli.run_sync(args, backend_token, external_token)
+    assert first["failed_countries"] == 1
+
+    outage.down = None
+    replay_args = sync_args(
+        positiva, backend, "--replay", first["report_file"], "--report-file", str(tmp_path / "replay.csv")
+    )
+    configured_run(replay_args)
+    received = counters(backend)["municipios_recibidos"]
+    summary = cli.run_sync(replay_args, backend_token, external_token)
+
+    assert summary["failures"] == 0
+    assert summary["countries"] == 1
+    assert counters(backend)["municipios_recibidos"] - received == expected_municipios(positiva, 1003)
+    assert stored(backend, 1003, "departamentos") > 0
@@ -0,0 +1,52 @@
+import concurrent.futures
+
+import bench_geodivisions as bench
+import pytest
+from geodivisions import cli, core
+from conftest import counters
+
+
+def test_scheduler_with_prefetch_stays_within_max_workers(fake_servers, sync_args, configured_run):
+    positiva, backend = fake_servers(
+        bench.FaultProfile(latency_ms=10), bench.FaultProfile(latency_ms=10), countries=6, municipios=20
+    )
+    args = sync_args(positiva, backend, "--engine", "scheduler", "--prefetch-departments", "4", "--chunk-size", "25")
+    backend_token, external_token = configured_run(args)
+
+    summary = cli.run_sync(args, backend_token, external_token)
+
+    assert summary["failures"] == 0
+    assert summary["municipalities_sent"] == counters(backend)["municipios_recibidos"]
+    # --max-workers 2: ni el prefetch ni nada más abre peticiones fuera del scheduler.
+    assert counters(positiva)["max_concurrentes"] <= 2
+    assert counters(backend)["max_concurrentes"] <= 2
+
+
+def test_scheduler_rejects_coalesce():
+    with pytest.raises(SystemExit):
+        cli.parse_args(["--backend-token", "b", "--external-token", "e", "--engine", "scheduler", "--coalesce"])
+
+
+def test_scheduler_rejects_stream():
+    with pytest.raises(SystemExit):
+        cli.parse_args(["--backend-token", "b", "--external-token", "e", "--engine", "scheduler", "--stream"])
+
+
+def test_prefetch_not_started_is_fetched_by_the_caller(monkeypatch):
+    monkeypatch.setattr(core, "fetch_departments_from_external", lambda external_id, token, throttle_ms: [external_id])
+    queued = []
+
+    def never_runs(fn):
+        # Como una tarea encolada detrás del hilo que la pide: nunca empieza por sí sola.
+        future = concurrent.futures.Future()
+        queued.append(future)
+        return future
+
+    prefetcher = core.DepartmentPrefetcher([{"idPais": 1, "idPositiva": 1001}], "token", 0, 1, never_runs)
+    prefetcher._thread.join(timeout=5)
+    try:
+        assert queued
+        assert prefetcher.get(1001) == [1001]
+        assert queued[0].cancelled()
+    finally:
+        prefetcher.close()
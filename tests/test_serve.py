@@ -0,0 +1,87 @@
+import os
+
+import bench_geodivisions as bench
+from geodivisions import cli, core, serve
+from conftest import counters
+
+
+def test_second_run_in_same_process_still_defers_quarantine(fake_servers, sync_args, configured_run, tmp_path):
+    positiva, backend = fake_servers(bench.FaultProfile(poison_rate=0.03))
+    args = sync_args(
+        positiva,
+        backend,
+        "--chunk-size",
+        "20",
+        "--quarantine-file",
+        str(tmp_path / "cuarentena.json"),
+    )
+    backend_token, external_token = configured_run(args)
+
+    cli.run_sync(args, backend_token, external_token)
+    quarantined = len(core.record_quarantine)
+    assert quarantined > 0
+
+    # La segunda corrida difiere los registros conocidos y al final los envía uno a uno; la tercera debe
+    # seguir difiriéndolos aunque ese envío final haya apagado `quarantine_holding`.
+    for _ in range(2):
+        rejected = counters(backend)["poison_rechazados"]
+        summary = cli.run_sync(args, backend_token, external_token)
+        # Cada registro en cuarentena se rechaza una sola vez, sin volver a bisectar su lote.
+        assert counters(backend)["poison_rechazados"] - rejected == quarantined
+        assert summary["failures"] == quarantined
+
+
+def test_each_run_starts_with_a_fresh_run_state():
+    run = core.begin_run()
+    run.quarantine_holding = False
+    run.backend_state_failures.record(1, 1001, RuntimeError("sin estado"))
+    core.end_run()
+
+    fresh = core.begin_run()
+    try:
+        assert fresh is not run
+        assert fresh.quarantine_holding is True
+        assert fresh.backend_state_failures.count == 0
+    finally:
+        core.end_run()
+
+
+def test_daemon_writes_one_report_per_run(fake_servers, configured_run, tmp_path):
+    positiva, backend = fake_servers(bench.FaultProfile(poison_rate=0.03))
+    report = tmp_path / "fallos.csv"
+    args = serve.parse_serve_args(
+        [
+            "--backend-url",
+            backend.url,
+            "--backend-token",
+            "backend",
+            "--external-token",
+            "externo",
+            "--external-base-url",
+            positiva.url,
+            "--report-file",
+            str(report),
+            "--interval",
+            "0",
+        ]
+    )
+    assert args.snapshot_ttl == 900
+    backend_token, external_token = configured_run(args)
+    daemon = serve.SyncDaemon(args, backend_token, external_token)
+
+    daemon.run_once()
+    first = daemon.last_run["report_file"]
+    daemon.run_once()
+    second = daemon.last_run["report_file"]
+
+    assert first and second and first != second
+    assert os.path.exists(first) and os.path.exists(second)
+    assert not report.exists()
+    # Sin --delta-sync el daemon envía todo: no depende de que el backend exponga su estado.
+    assert not args.delta_sync
+    assert "municipality_delta" not in daemon.last_run
+
+
+def test_snapshot_ttl_defaults_to_interval():
+    args = serve.parse_serve_args(["--backend-token", "b", "--external-token", "e", "--interval", "300"])
+    assert args.snapshot_ttl == 300
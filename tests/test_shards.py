@@ -0,0 +1,84 @@
+import json
+import shutil
+
+import bench_geodivisions as bench
+from geodivisions import cli, scheduler
+from geodivisions.shards import load_shard_weights, merge_reports, shard_targets
+
+
+def countries(count):
+    return [{"idPais": index, "idPositiva": 1000 + index} for index in range(1, count + 1)]
+
+
+def test_shards_cover_every_country_exactly_once():
+    targets = countries(11)
+    weight = load_shard_weights(None)
+    shards = [shard_targets(targets, (index, 3), weight) for index in range(1, 4)]
+
+    assigned = [country["idPais"] for shard in shards for country in shard]
+    assert sorted(assigned) == [country["idPais"] for country in targets]
+    assert sorted(len(shard) for shard in shards) == [3, 4, 4]
+
+
+def test_shards_ignore_local_response_cache(tmp_path, monkeypatch):
+    targets = countries(6)
+    expected = shard_targets(targets, (1, 2), load_shard_weights(None))
+    # Una caché local con tamaños distintos no debe cambiar la partición de este runner.
+    monkeypatch.setattr(scheduler, "estimate_country_weight", lambda external_id: external_id % 7)
+    assert shard_targets(targets, (1, 2), load_shard_weights(None)) == expected
+
+
+def test_shard_weights_file_balances_by_size(tmp_path):
+    weights = tmp_path / "pesos.json"
+    weights.write_text(json.dumps({"1": 10, "2": 1, "3": 1, "4": 1, "5": 1}), encoding="utf-8")
+    weight = load_shard_weights(str(weights))
+
+    first = shard_targets(countries(5), (1, 2), weight)
+    second = shard_targets(countries(5), (2, 2), weight)
+
+    assert [country["idPais"] for country in first] == [1]
+    assert [country["idPais"] for country in second] == [2, 3, 4, 5]
+
+
+def test_merge_reports_after_moving_shard_outputs(fake_servers, sync_args, configured_run, tmp_path):
+    positiva, backend = fake_servers(bench.FaultProfile(poison_rate=0.03), countries=4)
+    shard_dir = tmp_path / "runner"
+    shard_dir.mkdir()
+    totals = {"municipalities_sent": 0, "failures": 0}
+    for index in (1, 2):
+        args = sync_args(
+            positiva,
+            backend,
+            "--shard",
+            f"{index}/2",
+            "--summary-file",
+            str(shard_dir / f"shard{index}.json"),
+            "--report-file",
+            str(shard_dir / "reportes" / f"fallos{index}.csv"),
+        )
+        backend_token, external_token = configured_run(args)
+        summary = cli.run_sync(args, backend_token, external_token)
+        totals["municipalities_sent"] += summary["municipalities_sent"]
+        totals["failures"] += summary["failures"]
+    assert totals["failures"] > 0
+
+    # Los resúmenes y reportes se copian juntos a otra máquina (otro directorio).
+    merged_dir = tmp_path / "merge"
+    shutil.copytree(shard_dir, merged_dir)
+    shutil.rmtree(shard_dir)
+    output = tmp_path / "combinado.json"
+    merge_reports(
+        [
+            str(merged_dir / "shard1.json"),
+            str(merged_dir / "shard2.json"),
+            "--report-file",
+            str(tmp_path / "fallos.csv"),
+            "--output",
+            str(output),
+        ]
+    )
+
+    merged = json.loads(output.read_text(encoding="utf-8"))["totals"]
+    assert merged["countries"] == 4
+    assert merged["municipalities_sent"] == totals["municipalities_sent"]
+    assert merged["failures"] == totals["failures"]
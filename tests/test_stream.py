@@ -0,0 +1,19 @@
+import pytest
+from geodivisions import cli
+from conftest import stored_records
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_stream_persists_the_same_records_as_the_batch_path(fake_servers, sync_args, configured_run, engine):
+    summaries, snapshots = [], []
+    for extra in ((), ("--stream", "--stream-queue-size", "2")):
+        positiva, backend = fake_servers(departments=4, municipios=9)
+        args = sync_args(positiva, backend, "--engine", engine, "--chunk-size", "7", *extra)
+        summaries.append(cli.run_sync(args, *configured_run(args)))
+        snapshots.append(stored_records(backend))
+
+    batch, streamed = summaries
+    assert streamed["failures"] == batch["failures"] == 0
+    assert streamed["departments_sent"] == batch["departments_sent"]
+    assert streamed["municipalities_sent"] == batch["municipalities_sent"] > 0
+    assert snapshots[1] == snapshots[0]
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+from geodivisions import cli, http_client
+from conftest import counters
+
+
+class CountingLoader:
+    def __init__(self, token: str, expires_in=None):
+        self.token = token
+        self.expires_in = expires_in
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        return self.token, self.expires_in
+
+
+def test_expiring_token_is_refreshed_once_across_threads():
+    loader = CountingLoader("nuevo", expires_in=3600)
+    provider = http_client.TokenProvider("externo", "viejo", expires_in=1, loader=loader, refresh_margin=60)
+    assert provider.needs_refresh()
+
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(provider.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loader.calls == 1
+    assert set(seen) == {"nuevo"}
+    assert not provider.needs_refresh()
+
+
+def test_invalidate_refreshes_only_the_stale_token():
+    loader = CountingLoader("nuevo")
+    provider = http_client.TokenProvider("externo", "viejo", loader=loader)
+    assert not provider.needs_refresh()
+
+    assert provider.invalidate("viejo") == "nuevo"
+    # Otro hilo que también recibió 401 con el token viejo reutiliza el ya renovado.
+    assert provider.invalidate("viejo") == "nuevo"
+    assert loader.calls == 1
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_401_is_retried_once_with_the_renewed_token(fake_servers, sync_args, configured_run, engine):
+    positiva, backend = fake_servers(countries=2, departments=2, municipios=4)
+    positiva.state.bearer = "nuevo"
+    args = sync_args(positiva, backend, "--engine", engine)
+    backend_token, _ = configured_run(args)
+    loader = CountingLoader("nuevo")
+    external_token = http_client.TokenProvider("externo", "viejo", loader=loader)
+
+    summary = cli.run_sync(args, backend_token, external_token)
+
+    assert summary["failures"] == 0
+    assert summary["municipalities_sent"] > 0
+    assert loader.calls == 1
+    assert counters(positiva)["rechazos_401"] >= 1